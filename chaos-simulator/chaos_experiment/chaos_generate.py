@@ -4,6 +4,11 @@ import subprocess
 from typing import Union
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -30,7 +35,7 @@ class Chaos_Generate:
         f = open(f_path, "r", encoding="utf-8")
         data = f.read()
         f.close()
-        self.template = yaml.safe_load(data)
+        self.template = yaml.load(data, Loader=SafeLoader)
         self.name = self.template["metadata"]["name"]
         self.type = self.template["kind"]
 
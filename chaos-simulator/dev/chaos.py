@@ -4,6 +4,8 @@ import datetime
 import logging
 import subprocess
 
+from yaml_loader import load_yaml
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -32,10 +34,7 @@ class Chaos:
             _LOGGER.warn("No chaos file: {}, set no chaos".format(f_path))
             return None
 
-        f = open(f_path, "r", encoding="utf-8")
-        data = f.read()
-        f.close()
-        data = yaml.safe_load(data)
+        data = load_yaml(f_path)
         self.name = data["metadata"]["name"]
         self.namespace = list(data["spec"]["selector"]["pods"])[0]
         self.duration = (
@@ -1,23 +1,42 @@
 import json
 import logging
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import Union
 from chaos import Chaos
+from promql import (
+    MAX_POINTS,
+    fill_pods,
+    group_by_pod,
+    split_by_pod,
+    windows,
+)
 
 import dateparser
 import pandas as pd
 import plotly.express as px
 import pytz
+import requests
 from prometheus_api_client import PrometheusConnect
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 _LOGGER = logging.getLogger(__name__)
 
 
 class Prometheus_Client:
-    def __init__(self, url: str, disable_ssl: bool = True) -> None:
+    def __init__(
+        self, url: str, disable_ssl: bool = True, headers: dict = None
+    ) -> None:
 
-        self.PROM = PrometheusConnect(url=url, disable_ssl=disable_ssl)
+        self.PROM = PrometheusConnect(
+            url=url, headers=headers, disable_ssl=disable_ssl
+        )
+        self.url = url.rstrip("/")
+        self.disable_ssl = disable_ssl
 
     def get_all_metrics(self) -> list:
         """Get the list of all the metrics that the Prometheus host scrapes
@@ -82,9 +101,15 @@ class Prometheus_Client:
         pod: str,
         chaos: Chaos = Chaos(),
         save: bool = True,
+        max_points: int = MAX_POINTS,
+        concurrency: int = 4,
     ) -> Union[list, None]:
         """Query metrics from Prometheus
 
+        The query goes through ``session``, with the headers and
+        authentication of ``PROM``, and a window of more than ``max_points``
+        steps is queried in chunks, see ``query_range``.
+
         Args:
             query (str): PromQL query
             query_idx (int): PromQL query index
@@ -95,16 +120,28 @@ class Prometheus_Client:
             pod (str): PromQL query pod
             chaos (Chaos, optional): Label with chaos experiment. Defaults to Chaos().
             save (bool, optional): Save the query result. Defaults to True.
+            max_points (int, optional): Samples per query. Defaults to
+                MAX_POINTS.
+            concurrency (int, optional): Chunks queried at once.
+                Defaults to 4.
+
+        Raises:
+            requests.HTTPError: Query failed
 
         Returns:
             Union[list, None]: Query result
         """
 
-        query = query.strip()
-
-        metric_data = self.PROM.custom_query_range(
-            query=query, start_time=start_time, end_time=end_time, step=step
-        )
+        with self.session(concurrency) as session:
+            metric_data = self.query_range(
+                session,
+                query,
+                start_time,
+                end_time,
+                step,
+                max_points=max_points,
+                concurrency=concurrency,
+            )
 
         if not save:
             return metric_data
@@ -113,12 +150,36 @@ class Prometheus_Client:
             _LOGGER.error("No values for {}".format(query))
             return None
 
+        value = metric_data[0]["values"]
+        self.save_metric(value, query_idx, namespace, pod, chaos)
+
+        return value
+
+    def save_metric(
+        self,
+        value: list,
+        query_idx: Union[int, str],
+        namespace: str,
+        pod: str,
+        chaos: Chaos = Chaos(),
+    ) -> str:
+        """Save the values of a query result
+
+        Args:
+            value (list): ``[timestamp, value]`` samples
+            query_idx (Union[int, str]): PromQL query index
+            namespace (str): PromQL query namespace
+            pod (str): PromQL query pod
+            chaos (Chaos, optional): Label with chaos experiment. Defaults to Chaos().
+
+        Returns:
+            str: Saved file path
+        """
+
         chaos_name = chaos.name
         if not chaos_name:
             _LOGGER.warn("Undefined chaos, use none as default")
             chaos_name = "none"
-        data = metric_data[0]
-        value = data["values"]
 
         f_path = "../metric/{chaos_name}/{namespace}/{pod}/{query_idx}.json".format(
             chaos_name=chaos_name,
@@ -131,7 +192,333 @@ class Prometheus_Client:
         with open(f_path, "w") as f:
             json.dump(value, f)
 
-        return value
+        return f_path
+
+    def session(
+        self, concurrency: int = 8, retries: int = 3, backoff: float = 0.5
+    ) -> requests.Session:
+        """HTTP session keeping a connection per concurrent query
+
+        Requests carry the headers and authentication of ``PROM``.
+
+        Args:
+            concurrency (int, optional): Pooled connections. Defaults to 8.
+            retries (int, optional): Retries of a failed or throttled query.
+                Defaults to 3.
+            backoff (float, optional): Retry backoff factor, in seconds.
+                Defaults to 0.5.
+
+        Returns:
+            requests.Session: Session
+        """
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=concurrency, max_retries=retry
+        )
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.verify = not self.disable_ssl
+        session.headers.update(self.PROM.headers or {})
+        session.auth = getattr(self.PROM, "auth", None)
+
+        return session
+
+    def get_range(
+        self,
+        session: requests.Session,
+        query: str,
+        start: float,
+        end: float,
+        step: str,
+        timeout: float = 30,
+    ) -> list:
+        """One range query through a session
+
+        Args:
+            session (requests.Session): Session from ``session``
+            query (str): PromQL query
+            start (float): Start timestamp
+            end (float): End timestamp
+            step (str): PromQL query step
+            timeout (float, optional): Seconds to connect and to wait for the
+                response. Defaults to 30.
+
+        Raises:
+            requests.HTTPError: Query failed
+
+        Returns:
+            list: Query result
+        """
+
+        response = session.get(
+            "{}/api/v1/query_range".format(self.url),
+            params={
+                "query": query.strip(),
+                "start": start,
+                "end": end,
+                "step": step,
+            },
+            timeout=timeout,
+        )
+        response.raise_for_status()
+
+        return response.json()["data"]["result"]
+
+    def query_range(
+        self,
+        session: requests.Session,
+        query: str,
+        start_time: datetime,
+        end_time: datetime,
+        step: str,
+        timeout: float = 30,
+        max_points: int = MAX_POINTS,
+        concurrency: int = 4,
+    ) -> list:
+        """Range query through a session, as ``custom_query_range``
+
+        A window of more than ``max_points`` steps is split by ``windows``
+        and its chunks queried ``concurrency`` at a time. Chunks are
+        stitched in order as they arrive, dropping samples already stitched,
+        and only ``concurrency`` chunks are held at once.
+
+        Args:
+            session (requests.Session): Session from ``session``
+            query (str): PromQL query
+            start_time (datetime): PromQL query start time
+            end_time (datetime): PromQL query end time
+            step (str): PromQL query step
+            timeout (float, optional): Seconds to connect and to wait for the
+                response. Defaults to 30.
+            max_points (int, optional): Samples per query. Defaults to
+                MAX_POINTS.
+            concurrency (int, optional): Chunks queried at once.
+                Defaults to 4.
+
+        Raises:
+            requests.HTTPError: Query failed
+
+        Returns:
+            list: Query result
+        """
+
+        start = round(start_time.timestamp())
+        end = round(end_time.timestamp())
+        chunks = windows(start, end, step, max_points)
+        if len(chunks) == 1:
+            return self.get_range(session, query, start, end, step, timeout)
+
+        series = {}
+        chunks = iter(chunks)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+            def submit():
+                window = next(chunks, None)
+                if window is not None:
+                    pending.append(
+                        executor.submit(
+                            self.get_range,
+                            session,
+                            query,
+                            *window,
+                            step,
+                            timeout,
+                        )
+                    )
+
+            try:
+                for _ in range(concurrency):
+                    submit()
+                while pending:
+                    chunk = pending.popleft().result()
+                    submit()
+                    for item in chunk:
+                        key = tuple(sorted(item["metric"].items()))
+                        if key not in series:
+                            series[key] = item
+                            continue
+                        values = series[key]["values"]
+                        values += [
+                            value
+                            for value in item["values"]
+                            if not values or value[0] > values[-1][0]
+                        ]
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        return list(series.values())
+
+    def collect_metrics(
+        self,
+        namespace: str,
+        pods: list,
+        queries: dict,
+        start_time: datetime,
+        end_time: datetime,
+        step: str,
+        chaos: Chaos = Chaos(),
+        concurrency: int = 8,
+        retries: int = 3,
+        timeout: float = 30,
+        save: bool = True,
+        batch_pods: bool = True,
+        batch_size: int = 50,
+        max_points: int = MAX_POINTS,
+        chunk_concurrency: int = 2,
+    ) -> dict:
+        """Query every metric of a query table for every pod
+
+        ``$namespace`` and ``$pod`` are substituted in every query of the
+        table, and the queries run on a pool of ``concurrency`` threads
+        sharing one pooled session. Failed and throttled queries are retried
+        with backoff. Each result is saved as soon as it arrives, as
+        ``query_metric`` does, with "category-index" as query index, and not
+        kept in memory.
+
+        With ``batch_pods``, a query matching ``pod=~"$pod"`` runs once for
+        up to ``batch_size`` pods when ``group_by_pod`` can group it by pod,
+        and its result is split into the result of each pod. A query not
+        matching ``$pod`` runs once for all the pods. Other queries run for
+        each pod.
+
+        Args:
+            namespace (str): PromQL query namespace
+            pods (list): Pods, e.g. from ``get_pod_names``
+            queries (dict): Query table, e.g. loaded from METRIC.yaml
+            start_time (datetime): PromQL query start time
+            end_time (datetime): PromQL query end time
+            step (str): PromQL query step
+            chaos (Chaos, optional): Label with chaos experiment. Defaults to Chaos().
+            concurrency (int, optional): Concurrent queries. Defaults to 8.
+            retries (int, optional): Retries of a failed query. Defaults to 3.
+            timeout (float, optional): Seconds to connect and to wait for
+                each response. Defaults to 30.
+            save (bool, optional): Save the query results. Defaults to True.
+            batch_pods (bool, optional): Query several pods at once when
+                safe. Defaults to True.
+            batch_size (int, optional): Pods per batched query.
+                Defaults to 50.
+            max_points (int, optional): Samples per query, longer windows
+                are queried in chunks. Defaults to MAX_POINTS.
+            chunk_concurrency (int, optional): Chunks of a query queried at
+                once. Defaults to 2.
+
+        Returns:
+            dict: Numbers of pod queries, HTTP requests, saved, empty and
+                failed results, and seconds spent. Without ``save``, results by
+                ``(pod, query_idx)`` under "results".
+        """
+
+        # Every task is a query, the pods and query index of its results,
+        # and whether its result is split by pod
+        tasks = []
+        for category, items in queries.items():
+            for item in items:
+                query_idx = "{}-{}".format(category, item["index"])
+                query = item["query"].replace("$namespace", namespace)
+                if batch_pods and "$pod" not in query:
+                    targets = [(pod, query_idx) for pod in pods]
+                    tasks.append((query, targets, False))
+                    continue
+
+                single = pods
+                template = None
+                if batch_pods and len(pods) > 1:
+                    template = group_by_pod(query)
+                if template is not None:
+                    single = []
+                    for i in range(0, len(pods), batch_size):
+                        batch = pods[i : i + batch_size]
+                        batched = fill_pods(template, batch)
+                        if batched is None or len(batch) == 1:
+                            single += batch
+                        else:
+                            targets = [(pod, query_idx) for pod in batch]
+                            tasks.append((batched, targets, True))
+                tasks += [
+                    (query.replace("$pod", pod), [(pod, query_idx)], False)
+                    for pod in single
+                ]
+
+        report = {
+            "queries": sum(len(targets) for _, targets, _ in tasks),
+            "requests": len(tasks),
+            "saved": 0,
+            "empty": 0,
+            "failed": 0,
+            "seconds": 0,
+        }
+        if not save:
+            report["results"] = {}
+
+        start = time.perf_counter()
+        session = self.session(concurrency * chunk_concurrency, retries)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(
+                    self.query_range,
+                    session,
+                    query,
+                    start_time,
+                    end_time,
+                    step,
+                    timeout,
+                    max_points,
+                    chunk_concurrency,
+                ): (query, targets, split)
+                for query, targets, split in tasks
+            }
+            for future in as_completed(futures):
+                query, targets, split = futures.pop(future)
+                try:
+                    metric_data = future.result()
+                except (requests.RequestException, ValueError, KeyError) as err:
+                    _LOGGER.error("Failed to query {}: {}".format(query, err))
+                    report["failed"] += len(targets)
+                    continue
+
+                if split:
+                    results = split_by_pod(metric_data, [p for p, _ in targets])
+                for pod, query_idx in targets:
+                    pod_data = results[pod] if split else metric_data
+                    if not save:
+                        report["results"][(pod, query_idx)] = pod_data
+                    elif not pod_data:
+                        _LOGGER.error(
+                            "No values for {} of {}".format(query, pod)
+                        )
+                        report["empty"] += 1
+                    else:
+                        self.save_metric(
+                            pod_data[0]["values"],
+                            query_idx,
+                            namespace,
+                            pod,
+                            chaos,
+                        )
+                        report["saved"] += 1
+        session.close()
+        report["seconds"] = time.perf_counter() - start
+
+        _LOGGER.info(
+            "Collected {saved} of {queries} queries in {requests} requests "
+            "({empty} empty, {failed} failed) in {seconds:.1f} s".format(
+                **report
+            )
+        )
+
+        return report
 
     def plot_metric(
         self,
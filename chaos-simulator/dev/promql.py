@@ -0,0 +1,423 @@
+import re
+from typing import Union
+
+# Aggregations whose result, grouped by pod, is the per-pod result
+AGGREGATIONS = {
+    "sum",
+    "avg",
+    "min",
+    "max",
+    "count",
+    "group",
+    "stddev",
+    "stdvar",
+}
+
+# Functions keeping the pod label of every series
+FUNCTIONS = {
+    "rate",
+    "irate",
+    "increase",
+    "delta",
+    "idelta",
+    "deriv",
+    "resets",
+    "changes",
+    "avg_over_time",
+    "sum_over_time",
+    "min_over_time",
+    "max_over_time",
+    "count_over_time",
+    "last_over_time",
+    "stddev_over_time",
+    "stdvar_over_time",
+    "abs",
+    "ceil",
+    "floor",
+    "round",
+    "exp",
+    "ln",
+    "log2",
+    "log10",
+    "sqrt",
+    "clamp",
+    "clamp_min",
+    "clamp_max",
+}
+
+OPERATORS = {"+", "-", "*", "/", "%", "^"}
+
+# Pods matched by themselves only as a regular expression
+LITERAL_POD = re.compile(r"[A-Za-z0-9_:-]+")
+
+TOKEN = re.compile(
+    r"""\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    |(?P<range>\[[^\]]*\])
+    |(?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+    |(?P<ident>[A-Za-z_:][A-Za-z0-9_:]*)
+    |(?P<op>=~|!~|!=|==|>=|<=|[-+*/%^(){},<>=])
+    )""",
+    re.VERBOSE,
+)
+POD_MATCHER = re.compile(r'"\$pod"|\'\$pod\'')
+
+# Samples of a series a range query may return, as Prometheus limits them
+MAX_POINTS = 11000
+
+DURATION = re.compile(r"(\d+)(ms|s|m|h|d|w|y)")
+UNITS = {
+    "ms": 0.001,
+    "s": 1,
+    "m": 60,
+    "h": 3600,
+    "d": 86400,
+    "w": 604800,
+    "y": 31536000,
+}
+
+
+def duration_seconds(duration: Union[str, int, float]) -> float:
+    """Seconds of a PromQL duration or a number of seconds, e.g. a step
+
+    Args:
+        duration (Union[str, int, float]): Duration, e.g. "15s", "1m30s"
+            or "15"
+
+    Raises:
+        ValueError: Not a duration
+
+    Returns:
+        float: Seconds
+    """
+
+    try:
+        return float(duration)
+    except ValueError:
+        pass
+
+    pos = 0
+    seconds = 0.0
+    for match in DURATION.finditer(duration):
+        if match.start() != pos:
+            break
+        seconds += int(match.group(1)) * UNITS[match.group(2)]
+        pos = match.end()
+    if pos != len(duration) or not pos:
+        raise ValueError("Invalid duration {!r}".format(duration))
+
+    return seconds
+
+
+def windows(
+    start: float, end: float, step: str, max_points: int = MAX_POINTS
+) -> list:
+    """Split a query window into windows of at most ``max_points`` samples
+
+    Every window starts a whole number of steps after ``start``, so the
+    samples of the windows are those of the whole window.
+
+    Args:
+        start (float): Start timestamp
+        end (float): End timestamp
+        step (str): PromQL query step
+        max_points (int, optional): Samples per window. Defaults to
+            MAX_POINTS.
+
+    Returns:
+        list: ``(start, end)`` timestamps of every window, just the whole
+            window when it is small enough
+    """
+
+    seconds = duration_seconds(step)
+    span = seconds * (max_points - 1)
+    if end - start <= span:
+        return [(start, end)]
+
+    chunks = []
+    steps = 0
+    while start + steps * seconds <= end:
+        chunk_start = start + steps * seconds
+        chunks.append((chunk_start, min(chunk_start + span, end)))
+        steps += max_points
+
+    return chunks
+
+
+class Unsafe(Exception):
+    """Query whose result is not the same grouped by pod"""
+
+
+def tokenize(query: str) -> list:
+    """Split a PromQL query into tokens
+
+    Args:
+        query (str): PromQL query
+
+    Raises:
+        Unsafe: Unknown syntax
+
+    Returns:
+        list: ``(kind, text, start, end)`` of every token
+    """
+
+    tokens = []
+    pos = 0
+    query = query.rstrip()
+    while pos < len(query):
+        match = TOKEN.match(query, pos)
+        if not match:
+            raise Unsafe("Unexpected {!r}".format(query[pos:]))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind), match.start(kind), match.end()))
+        pos = match.end()
+
+    return tokens
+
+
+class Rewriter:
+    def __init__(self, query: str) -> None:
+        """Parser of the subset of PromQL that can be grouped by pod
+
+        A query can be grouped by pod when it is arithmetic between numbers
+        and aggregations without grouping, optionally wrapped in
+        ``histogram_quantile`` and grouped by ``le``. Aggregations may only
+        apply label-preserving functions and arithmetic to selectors
+        matching ``pod=~"$pod"``. Then every aggregation, grouped by pod too,
+        gives one series per pod, and operators match the series of each
+        pod, exactly as in the query of that pod alone.
+
+        Args:
+            query (str): PromQL query template
+
+        Raises:
+            Unsafe: The query cannot be grouped by pod
+        """
+
+        self.query = query
+        self.tokens = tokenize(query)
+        self.pos = 0
+        # Insertions turning the query into one grouped by pod
+        self.edits = []
+        self.expression(self.term)
+        if self.pos != len(self.tokens):
+            raise Unsafe("Unexpected {!r}".format(self.peek()[1]))
+
+    def peek(self, offset: int = 0) -> tuple:
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else (None, "", 0, 0)
+
+    def take(self, text: str = None, kind: str = None) -> tuple:
+        token = self.peek()
+        if (text is not None and token[1] != text) or (
+            kind is not None and token[0] != kind
+        ):
+            raise Unsafe(
+                "Expected {!r}, got {!r}".format(text or kind, token[1])
+            )
+        self.pos += 1
+        return token
+
+    def expression(self, term):
+        term()
+        while self.peek()[0] == "op" and self.peek()[1] in OPERATORS:
+            self.take()
+            term()
+
+    def term(self):
+        """Number, parenthesis, aggregation or quantile of aggregation"""
+
+        kind, text, _, _ = self.peek()
+        if kind == "number":
+            self.take()
+        elif text == "(":
+            self.take()
+            self.expression(self.term)
+            self.take(")")
+        elif text in AGGREGATIONS:
+            self.aggregation()
+        elif text == "histogram_quantile":
+            self.take()
+            self.take("(")
+            self.take(kind="number")
+            self.take(",")
+            self.aggregation(by=("le",))
+            self.take(")")
+        else:
+            raise Unsafe("Unexpected {!r}".format(text))
+
+    def aggregation(self, by: tuple = ()):
+        """Aggregation grouped by ``by`` labels, to be grouped by pod too"""
+
+        _, _, _, end = self.take(kind="ident")
+        grouped = False
+        if not by:
+            self.edits.append((end, " by (pod)"))
+        elif self.peek()[1] == "by":
+            self.grouping(by)
+            grouped = True
+
+        self.take("(")
+        self.expression(self.inner)
+        self.take(")")
+
+        if by and not grouped:
+            self.grouping(by)
+        elif self.peek()[1] in ["by", "without"]:
+            raise Unsafe("Grouped twice or not by ({})".format(", ".join(by)))
+
+    def grouping(self, by: tuple):
+        """``by`` clause, with exactly the ``by`` labels"""
+
+        self.take("by")
+        self.take("(")
+        labels = []
+        while self.peek()[1] != ")":
+            labels.append(self.take(kind="ident")[1])
+            if self.peek()[1] == ",":
+                self.take()
+        _, _, start, _ = self.take(")")
+        if tuple(labels) != by:
+            raise Unsafe("Grouped by {}".format(", ".join(labels)))
+        self.edits.append((start, ", pod"))
+
+    def inner(self):
+        """Number, parenthesis, function call or selector of the pod"""
+
+        kind, text, _, _ = self.peek()
+        if kind == "number":
+            self.take()
+        elif text == "(":
+            self.take()
+            self.expression(self.inner)
+            self.take(")")
+        elif kind == "ident" and self.peek(1)[1] == "(":
+            if text not in FUNCTIONS:
+                raise Unsafe("Function {}".format(text))
+            self.take()
+            self.take("(")
+            self.expression(self.inner)
+            while self.peek()[1] == ",":
+                self.take()
+                self.expression(self.inner)
+            self.take(")")
+        elif kind == "ident":
+            self.selector()
+        else:
+            raise Unsafe("Unexpected {!r}".format(text))
+
+    def selector(self):
+        """Metric selector matching ``pod=~"$pod"``, optionally a range"""
+
+        self.take(kind="ident")
+        self.take("{")
+        pod = False
+        while self.peek()[1] != "}":
+            label = self.take(kind="ident")[1]
+            operator = self.take(kind="op")[1]
+            value = self.take(kind="string")[1]
+            if label == "pod":
+                if pod or operator != "=~" or not POD_MATCHER.fullmatch(value):
+                    raise Unsafe("Pod matched by {}{}".format(operator, value))
+                pod = True
+            elif "$pod" in value:
+                raise Unsafe("Label {} matches $pod".format(label))
+            if self.peek()[1] == ",":
+                self.take()
+        self.take("}")
+        if not pod:
+            raise Unsafe('Selector not matching pod=~"$pod"')
+        if self.peek()[0] == "range":
+            self.take()
+
+    def rewrite(self) -> str:
+        """Query template grouped by pod, still matching ``$pod``"""
+
+        query = self.query
+        for pos, text in sorted(self.edits, reverse=True):
+            query = query[:pos] + text + query[pos:]
+        return query
+
+
+def group_by_pod(query: str) -> Union[str, None]:
+    """Turn a per-pod query template into a template grouped by pod
+
+    See ``Rewriter`` for the queries this is safe for.
+
+    Args:
+        query (str): PromQL query template, matching ``pod=~"$pod"``
+
+    Returns:
+        Union[str, None]: Template grouped by pod, still matching ``$pod``,
+            or None when the query cannot be grouped by pod
+    """
+
+    try:
+        return Rewriter(query.strip()).rewrite()
+    except Unsafe:
+        return None
+
+
+def fill_pods(template: str, pods: list) -> Union[str, None]:
+    """Query of several pods from a template of ``group_by_pod``
+
+    Args:
+        template (str): Template grouped by pod
+        pods (list): Pods, made of letters, digits, "_", ":" and "-" only
+
+    Returns:
+        Union[str, None]: Query for all the pods, or None when a pod name
+            cannot be batched
+    """
+
+    if not all(LITERAL_POD.fullmatch(pod) for pod in pods):
+        return None
+
+    return template.replace("$pod", "|".join(pods))
+
+
+def batch_query(query: str, pods: list) -> Union[str, None]:
+    """Turn a per-pod query template into one query for several pods
+
+    ``pod=~"$pod"`` matches all the pods at once and every aggregation is
+    grouped by pod, see ``Rewriter`` for the queries this is safe for.
+    ``$namespace`` and other templates are left as they are. To batch a
+    query for several groups of pods, call ``group_by_pod`` once and
+    ``fill_pods`` for each group instead.
+
+    Args:
+        query (str): PromQL query template, matching ``pod=~"$pod"``
+        pods (list): Pods, made of letters, digits, "_", ":" and "-" only
+
+    Returns:
+        Union[str, None]: Query for all the pods, or None when the query or a
+            pod name cannot be batched
+    """
+
+    template = group_by_pod(query)
+    if template is None:
+        return None
+
+    return fill_pods(template, pods)
+
+
+def split_by_pod(metric_data: list, pods: list) -> dict:
+    """Split the result of a batched query into the result of each pod
+
+    Args:
+        metric_data (list): Result of a query from ``batch_query``
+        pods (list): Batched pods
+
+    Returns:
+        dict: Result of each pod, as queried alone, empty for pods without
+            values
+    """
+
+    results = {pod: [] for pod in pods}
+    for series in metric_data:
+        metric = dict(series["metric"])
+        pod = metric.pop("pod", None)
+        if pod in results:
+            results[pod].append(dict(series, metric=metric))
+
+    return results
@@ -0,0 +1,132 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, HERE)
+
+from promql import duration_seconds  # noqa: E402
+
+
+class Fake_Prometheus(ThreadingHTTPServer):
+    def __init__(self) -> None:
+        """Range query API answering deterministic series
+
+        A selector ``pod=~"a|b"`` gives one series per pod when the query is
+        grouped by pod, else one series. Values only depend on the query of
+        one pod and the timestamp, so a batched query gives the same values
+        as the queries of each pod.
+        """
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.server_address[1])
+        self.lock = threading.Lock()
+        self.requests = []
+        self.inflight = 0
+        self.max_inflight = 0
+        # Queries failing once with 503
+        self.fail_once = set()
+        # Queries always failing with 400
+        self.fail = set()
+        self.delay = 0.0
+        self.max_points = 11000
+
+    def series(self, query: str, start: float, end: float, step: float):
+        match = re.search(r'pod=~"([^"]*)"', query)
+        by_pod = match and ("by (pod)" in query or ", pod)" in query)
+        pods = match.group(1).split("|") if by_pod else [None]
+
+        result = []
+        for pod in pods:
+            key = query
+            if pod is not None:
+                key = (
+                    query.replace(match.group(0), 'pod=~"{}"'.format(pod))
+                    .replace(" by (pod)", "")
+                    .replace(", pod)", ")")
+                )
+            values = []
+            timestamp = start
+            while timestamp <= end:
+                value = sum(map(ord, key)) * timestamp % 1000 / 10
+                values.append([timestamp, str(value)])
+                timestamp += step
+            if values:
+                result.append(
+                    {"metric": {"pod": pod} if pod else {}, "values": values}
+                )
+
+        return result
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status: int, data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        params = {
+            key: values[0]
+            for key, values in parse_qs(urlsplit(self.path).query).items()
+        }
+        with server.lock:
+            server.requests.append(dict(params, headers=dict(self.headers)))
+            server.inflight += 1
+            server.max_inflight = max(server.max_inflight, server.inflight)
+
+        try:
+            time.sleep(server.delay)
+            query = params["query"]
+            with server.lock:
+                if query in server.fail_once:
+                    server.fail_once.discard(query)
+                    return self.reply(503, {"status": "error"})
+            if query in server.fail:
+                return self.reply(400, {"status": "error"})
+
+            start, end = float(params["start"]), float(params["end"])
+            step = duration_seconds(params["step"])
+            if (end - start) / step + 1 > server.max_points:
+                return self.reply(400, {"status": "error"})
+
+            self.reply(
+                200,
+                {
+                    "status": "success",
+                    "data": {
+                        "resultType": "matrix",
+                        "result": server.series(query, start, end, step),
+                    },
+                },
+            )
+        finally:
+            with server.lock:
+                server.inflight -= 1
+
+
+@pytest.fixture
+def prometheus():
+    server = Fake_Prometheus()
+    thread = threading.Thread(
+        target=server.serve_forever, args=(0.05,), daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,200 @@
+import datetime
+import json
+
+import pytest
+
+from prometheus import Prometheus_Client
+
+END = datetime.datetime(2024, 1, 1, 1)
+START = END - datetime.timedelta(minutes=30)
+
+QUERIES = {
+    "cpu": [
+        {
+            "index": 0,
+            "query": 'sum(rate(cpu{namespace="$namespace", pod=~"$pod"}[5m]))',
+        },
+        {"index": 1, "query": "node_time_seconds"},
+    ],
+    "memory": [
+        {
+            "index": 0,
+            "query": 'sum(memory{namespace="$namespace", pod=~"$pod"}) '
+            '/ sum(limit{namespace="$namespace"})',
+        },
+    ],
+}
+PODS = ["adservice-0", "adservice-1", "cartservice-0"]
+
+
+@pytest.fixture
+def dev_dir(tmp_path, monkeypatch):
+    """Run in a dev directory, metrics being saved to ../metric"""
+
+    (tmp_path / "dev").mkdir()
+    monkeypatch.chdir(tmp_path / "dev")
+    return tmp_path
+
+
+def test_collect_metrics(prometheus, dev_dir):
+    client = Prometheus_Client(prometheus.url)
+    failing = QUERIES["cpu"][0]["query"].replace("$namespace", "hipster")
+    prometheus.fail_once.add(failing.replace("$pod", "adservice-1"))
+    prometheus.delay = 0.01
+
+    report = client.collect_metrics(
+        "hipster",
+        PODS,
+        QUERIES,
+        START,
+        END,
+        "15",
+        concurrency=2,
+        batch_pods=False,
+    )
+
+    assert report["queries"] == report["requests"] == 9
+    assert report["saved"] == 9
+    assert report["failed"] == report["empty"] == 0
+    assert len(prometheus.requests) == 10
+    assert prometheus.max_inflight <= 2
+
+    for pod in PODS:
+        query = failing.replace("$pod", pod)
+        expected = client.query_metric(
+            query, 0, START, END, "15", "hipster", pod, save=False
+        )
+        with open(
+            dev_dir / "metric/none/hipster/{}/cpu-0.json".format(pod)
+        ) as f:
+            assert json.load(f) == expected[0]["values"]
+
+
+def test_collect_failures(prometheus, dev_dir):
+    client = Prometheus_Client(prometheus.url)
+    prometheus.fail.add("node_time_seconds")
+
+    report = client.collect_metrics(
+        "hipster", PODS, QUERIES, START, END, "15", save=False, retries=0
+    )
+
+    assert report["failed"] == len(PODS)
+    assert report["saved"] == 0
+    assert len(report["results"]) == 2 * len(PODS)
+    assert not (dev_dir / "metric").exists()
+
+
+def test_batch_pods(prometheus, dev_dir, monkeypatch):
+    import prometheus as module
+
+    parsed = []
+    original = module.group_by_pod
+
+    def group_by_pod(query):
+        parsed.append(query)
+        return original(query)
+
+    monkeypatch.setattr(module, "group_by_pod", group_by_pod)
+
+    client = Prometheus_Client(prometheus.url)
+    pods = PODS + ["adservice-{}".format(i) for i in range(2, 7)] + ["odd.pod"]
+    results = {}
+    for batch_pods in [False, True]:
+        prometheus.requests.clear()
+        report = client.collect_metrics(
+            "hipster",
+            pods,
+            QUERIES,
+            START,
+            END,
+            "15",
+            save=False,
+            batch_pods=batch_pods,
+            batch_size=3,
+        )
+        assert report["queries"] == 3 * len(pods)
+        assert report["requests"] == len(prometheus.requests)
+        results[batch_pods] = report["results"]
+
+    assert results[True] == results[False]
+    # cpu-0 in 2 batches and for each pod of the batch holding odd.pod,
+    # node_time_seconds once, and memory-0 for each pod
+    assert len(prometheus.requests) == 2 + 3 + 1 + len(pods)
+    assert len(parsed) == 2
+
+
+@pytest.mark.parametrize(
+    "step, max_points, hours",
+    [("7", 11000, 72), ("60", 7, 1), ("13", 3, 0.1), ("90", 100, 12)]
+    + [("0.5", 1000, 1)],
+)
+def test_query_range_chunks(prometheus, step, max_points, hours):
+    client = Prometheus_Client(prometheus.url)
+    query = 'sum by (pod)(x{pod=~"a|b"})'
+    start = END - datetime.timedelta(hours=hours, seconds=17)
+
+    with client.session() as session:
+        prometheus.max_points = 10**9
+        whole = client.get_range(
+            session,
+            query,
+            round(start.timestamp()),
+            round(END.timestamp()),
+            step,
+        )
+        prometheus.max_points = max_points
+        prometheus.requests.clear()
+        chunked = client.query_range(
+            session, query, start, END, step, max_points=max_points
+        )
+
+    assert chunked == whole
+    assert len(whole) == 2
+    assert len(prometheus.requests) == -(-len(whole[0]["values"]) // max_points)
+
+
+def test_query_range_overlap(prometheus, monkeypatch):
+    import prometheus as module
+
+    client = Prometheus_Client(prometheus.url)
+    query = 'sum by (pod)(x{pod=~"a|b"})'
+    start = END - datetime.timedelta(hours=1)
+    with client.session() as session:
+        whole = client.query_range(session, query, start, END, "15")
+
+        # Windows sharing their last sample with the next one
+        original = module.windows
+        monkeypatch.setattr(
+            module,
+            "windows",
+            lambda *args: [
+                (chunk_start, min(chunk_end + 15, args[1]))
+                for chunk_start, chunk_end in original(*args)
+            ],
+        )
+        chunked = client.query_range(
+            session, query, start, END, "15", max_points=10, concurrency=3
+        )
+
+    assert chunked == whole
+
+
+@pytest.mark.parametrize("hours", [1, 24 * 3])
+def test_query_metric(prometheus, dev_dir, hours):
+    client = Prometheus_Client(prometheus.url, headers={"X-Scope": "hipster"})
+    start = END - datetime.timedelta(hours=hours)
+    prometheus.max_points = 1000
+
+    value = client.query_metric(
+        "cpu", 0, start, END, "15", "hipster", "adservice-0", max_points=1000
+    )
+
+    assert len(value) == hours * 240 + 1
+    assert value[0][0] == start.timestamp()
+    assert len(prometheus.requests) == -(-len(value) // 1000)
+    assert all(
+        request["headers"]["X-Scope"] == "hipster"
+        for request in prometheus.requests
+    )
+    with open(dev_dir / "metric/none/hipster/adservice-0/0.json") as f:
+        assert json.load(f) == value
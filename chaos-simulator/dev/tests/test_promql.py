@@ -0,0 +1,157 @@
+import os
+
+import pytest
+import yaml
+
+from promql import (
+    batch_query,
+    duration_seconds,
+    fill_pods,
+    group_by_pod,
+    split_by_pod,
+    windows,
+)
+
+with open(
+    os.path.join(os.path.dirname(__file__), "../../config/METRIC.yaml")
+) as f:
+    METRICS = yaml.safe_load(f)
+
+POD_QUERIES = {
+    "{}-{}".format(category, item["index"]): item["query"].strip()
+    for category, items in METRICS.items()
+    for item in items
+    if "$pod" in item["query"]
+}
+
+# Divided by a series of every pod, or matching the pod by another label
+UNSAFE = {"cpu-1", "cpu-2", "memory-5", "memory-6", "memory-7", "icmp-0"}
+
+
+@pytest.mark.parametrize("query_idx", sorted(POD_QUERIES))
+def test_metric_queries(query_idx):
+    query = POD_QUERIES[query_idx]
+    template = group_by_pod(query)
+
+    if query_idx in UNSAFE:
+        assert template is None
+        assert batch_query(query, ["a", "b"]) is None
+        return
+
+    assert template.count("by (pod)") + template.count(", pod)") == sum(
+        query.count(aggregation + " (") + query.count(aggregation + "(")
+        for aggregation in ["sum", "avg"]
+    )
+    assert template.replace(" by (pod)", "").replace(", pod)", ")") == query
+
+    batched = batch_query(query, ["a", "b"])
+    assert batched == template.replace("$pod", "a|b")
+    assert "$pod" not in batched
+
+
+def test_rewrite():
+    assert group_by_pod(POD_QUERIES["network-8"]) == (
+        "histogram_quantile(0.90, sum(irate(istio_request_duration_"
+        'milliseconds_bucket{reporter=~"destination",pod=~"$pod"}[1m])) '
+        "by (le, pod)) / 1000"
+    )
+    assert group_by_pod(POD_QUERIES["memory-8"]) == (
+        'sum by (pod) (container_memory_rss{namespace=~"$namespace", '
+        'pod=~"$pod"}) / sum by (pod)(container_spec_memory_limit_bytes'
+        '{namespace=~"$namespace",pod=~"$pod"})  * 100'
+    )
+    assert group_by_pod('2 * (max(x{pod=~"$pod"}) - 1)') == (
+        '2 * (max by (pod)(x{pod=~"$pod"}) - 1)'
+    )
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        # Already grouped
+        'sum(x{pod=~"$pod"}) by (pod)',
+        'sum by (instance) (x{pod=~"$pod"})',
+        'sum without (le) (x{pod=~"$pod"})',
+        'histogram_quantile(0.9, sum(x{pod=~"$pod"}) by (le, instance))',
+        # Pod not matched by pod=~"$pod"
+        'sum(x{target=~"$pod"})',
+        'sum(x{pod="$pod"})',
+        'sum(x{pod=~"$pod-.*"})',
+        'sum(x{pod=~"$pod", pod=~"$pod"})',
+        # Selector without a pod filter
+        'sum(x{namespace="hipster"})',
+        'sum(x{pod=~"$pod"}) / sum(y{namespace="hipster"})',
+        "up",
+        # Not per pod, or not grouped by pod as is
+        'x{pod=~"$pod"}',
+        'topk(3, x{pod=~"$pod"})',
+        'sum(label_replace(x{pod=~"$pod"}, "a", "$1", "b", "(.*)"))',
+        'sum(x{pod=~"$pod"} offset 5m)',
+        'sum(x{pod=~"$pod"}) > bool 1',
+        # Not PromQL
+        'sum(x{pod=~"$pod"}',
+        'sum(x{pod=~"$pod"}) @',
+    ],
+)
+def test_unsafe(query):
+    assert group_by_pod(query) is None
+    assert batch_query(query, ["a", "b"]) is None
+
+
+def test_fill_pods():
+    template = group_by_pod('sum(x{pod=~"$pod"})')
+
+    assert fill_pods(template, ["a-0", "b_1:2"]) == (
+        'sum by (pod)(x{pod=~"a-0|b_1:2"})'
+    )
+    assert fill_pods(template, ["a-0", "b.1"]) is None
+    assert batch_query('sum(x{pod=~"$pod"})', ["a", "(b)"]) is None
+
+
+def test_split_by_pod():
+    metric_data = [
+        {"metric": {"pod": "a", "le": "1"}, "values": [[1, "1"]]},
+        {"metric": {"pod": "c"}, "values": [[1, "2"]]},
+        {"metric": {}, "values": [[1, "3"]]},
+    ]
+
+    assert split_by_pod(metric_data, ["a", "b"]) == {
+        "a": [{"metric": {"le": "1"}, "values": [[1, "1"]]}],
+        "b": [],
+    }
+
+
+@pytest.mark.parametrize(
+    "duration, seconds",
+    [("15", 15), (15, 15), ("0.5", 0.5), ("15s", 15), ("1m30s", 90)]
+    + [("500ms", 0.5), ("2h", 7200), ("1d", 86400), ("1w", 604800)],
+)
+def test_duration_seconds(duration, seconds):
+    assert duration_seconds(duration) == seconds
+
+
+@pytest.mark.parametrize("duration", ["", "s", "15x", "1m 30s", "m1", "1.5m"])
+def test_invalid_duration(duration):
+    with pytest.raises(ValueError):
+        duration_seconds(duration)
+
+
+@pytest.mark.parametrize(
+    "start, end, step, max_points",
+    [(0, 100, "1", 7), (0, 99, "1", 10), (5, 5, "1", 2), (0, 3600, "1m", 11)]
+    + [(10, 1000, "13", 3), (0, 100, "0.5", 11000), (0, 100, "1m30s", 2)],
+)
+def test_windows(start, end, step, max_points):
+    seconds = duration_seconds(step)
+
+    def samples(start, end):
+        count = int((end - start) // seconds) + 1
+        return [start + i * seconds for i in range(count)]
+
+    chunks = windows(start, end, step, max_points)
+    stitched = [sample for chunk in chunks for sample in samples(*chunk)]
+
+    assert stitched == samples(start, end)
+    assert all(len(samples(*chunk)) <= max_points for chunk in chunks)
+    if end - start <= seconds * (max_points - 1):
+        assert chunks == [(start, end)]
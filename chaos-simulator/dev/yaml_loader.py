@@ -0,0 +1,25 @@
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+def load_yaml(f_path: str):
+    """Load a YAML file with the libyaml loader when PyYAML was built with it
+
+    Args:
+        f_path (str): YAML file path
+
+    Returns:
+        Document
+    """
+
+    f = open(f_path, "r", encoding="utf-8")
+    data = f.read()
+    f.close()
+    return yaml.load(data, Loader=SafeLoader)
+
+
+__all__ = ["load_yaml"]
@@ -0,0 +1,385 @@
+import gc
+import os
+import copy
+import random
+import tempfile
+import time
+import tracemalloc
+import yaml
+from kb import KB
+from pool import Reasoner_Pool
+from reasoning import Reasoner
+from dedup import deduplicate
+from util import weighted_LCS, bit_parallel_LCS, weighted_LCS_bound
+
+
+def timer(func, *args, repeat=5):
+    """Best wall time of a call over several runs
+
+    Args:
+        func (callable): Function to time
+        repeat (int, optional): Number of runs. Defaults to 5.
+
+    Returns:
+        float: Seconds
+    """
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_lcs(lengths=(16, 64, 256, 1024), clue_num=64, seed=0) -> list:
+    """Benchmark the ordered metrics kernels on long reordered fingerprints
+
+    The case is a random sequence of clues and the fingerprint is the same
+    sequence with a tenth of its clues moved to random positions, like a
+    fingerprint whose anomalies were detected slightly out of order.
+
+    Args:
+        lengths (tuple, optional): Fingerprint lengths.
+            Defaults to (16, 64, 256, 1024).
+        clue_num (int, optional): Number of distinct clues. Defaults to 64.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        list: Seconds per call of every kernel, for each length
+    """
+
+    rnd = random.Random(seed)
+    clues = ["network-{}-dips".format(i) for i in range(clue_num)]
+    weight = {clue: rnd.random() for clue in clues}
+
+    results = []
+    for length in lengths:
+        case = [rnd.choice(clues) for _ in range(length)]
+        fingerprint = list(case)
+        for _ in range(length // 10):
+            clue = fingerprint.pop(rnd.randrange(len(fingerprint)))
+            fingerprint.insert(rnd.randrange(len(fingerprint) + 1), clue)
+
+        results.append(
+            {
+                "length": length,
+                "weighted_LCS": timer(weighted_LCS, fingerprint, case, weight),
+                "weighted_LCS_path": timer(
+                    lambda: weighted_LCS(fingerprint, case, weight, path=True)
+                ),
+                "bit_parallel_LCS": timer(bit_parallel_LCS, fingerprint, case),
+                "weighted_LCS_bound": timer(
+                    weighted_LCS_bound, fingerprint, case, weight
+                ),
+            }
+        )
+
+    return results
+
+
+def random_fingerprints(kb: KB, num: int, seed: int = 0) -> list:
+    """Random fingerprints drawn from the clues of the knowledge base
+
+    Args:
+        kb (KB): Loaded knowledge base
+        num (int): Number of fingerprints
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        list: Fingerprints
+    """
+
+    rnd = random.Random(seed)
+    fingerprints = []
+    for _ in range(num):
+        chaos = rnd.choice([c for t in kb.kb.values() for c in t])
+        anomalies = {}
+        for target_type, clues in chaos["anomalies"].items():
+            anomalies[target_type] = {
+                key: rnd.sample(value, max(1, len(value) // 2))
+                for key, value in clues.items()
+            }
+        fingerprints.append(
+            {"groundtruth": chaos["experiment"], "anomalies": anomalies}
+        )
+
+    return fingerprints
+
+
+def benchmark_pool(
+    kb_path="./KNOWLEDGE_BASE.yaml", workers=None, num=2000, seed=0
+) -> list:
+    """Benchmark fingerprints per second against the number of workers
+
+    Args:
+        kb_path (str, optional): Knowledge base path.
+            Defaults to "./KNOWLEDGE_BASE.yaml".
+        workers (list, optional): Worker numbers. Defaults to powers of two
+            up to the number of CPUs.
+        num (int, optional): Number of fingerprints. Defaults to 2000.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        list: Fingerprints per second for each worker number
+    """
+
+    kb = KB()
+    kb.load(kb_path)
+    fingerprints = random_fingerprints(kb, num, seed)
+
+    if workers is None:
+        workers = [1]
+        while workers[-1] * 2 <= os.cpu_count():
+            workers.append(workers[-1] * 2)
+
+    results = []
+    for processes in workers:
+        with Reasoner_Pool(kb, processes=processes) as pool:
+            start = time.perf_counter()
+            pool.reason(fingerprints)
+            elapsed = time.perf_counter() - start
+        results.append(
+            {"workers": processes, "fingerprints/s": num / elapsed}
+        )
+
+    return results
+
+
+def benchmark_add_case(
+    kb_path="./KNOWLEDGE_BASE.yaml", nums=(10, 50), seed=0
+) -> list:
+    """Benchmark cases added per second, against weighting the KB again
+
+    Random fingerprints are added as cases of their chaos type: by loading
+    the grown knowledge base again, with ``KB.add_case``, and with
+    ``add_case`` logging to a write-ahead log, refreshing the weights once
+    at the end. The time to compact the log into the knowledge base file
+    follows.
+
+    Args:
+        kb_path (str, optional): Knowledge base path.
+            Defaults to "./KNOWLEDGE_BASE.yaml".
+        nums (tuple, optional): Numbers of added cases. Defaults to (10, 50).
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        list: Cases per second of every way, and compaction seconds, for
+            each number of cases
+    """
+
+    base = KB()
+    base.load(kb_path)
+    experiments = {
+        chaos["experiment"]: chaos_type
+        for chaos_type, cases in base.kb.items()
+        for chaos in cases
+    }
+
+    results = []
+    for num in nums:
+        fingerprints = random_fingerprints(base, num, seed)
+        cases = [
+            (experiments[fingerprint["groundtruth"]], fingerprint)
+            for fingerprint in fingerprints
+        ]
+        row = {"cases": num}
+
+        kb = copy.deepcopy(base.kb)
+        start = time.perf_counter()
+        for chaos_type, fingerprint in cases:
+            kb[chaos_type] = kb[chaos_type] + [
+                {
+                    "index": len(kb[chaos_type]),
+                    "experiment": fingerprint["groundtruth"],
+                    "instance_related": False,
+                    "anomalies": fingerprint["anomalies"],
+                }
+            ]
+            KB().load(kb)
+        row["reload"] = num / (time.perf_counter() - start)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for mode in ["add_case", "add_case_log"]:
+                kb = KB()
+                kb.load(kb_path)
+                if mode == "add_case_log":
+                    kb.attach_log(os.path.join(tmp_dir, "kb.log"))
+                start = time.perf_counter()
+                for chaos_type, fingerprint in cases:
+                    kb.add_case(chaos_type, fingerprint)
+                kb.refresh()
+                row[mode] = num / (time.perf_counter() - start)
+
+                if mode == "add_case_log":
+                    start = time.perf_counter()
+                    kb.compact(os.path.join(tmp_dir, "kb.yaml"))
+                    row["compact_s"] = time.perf_counter() - start
+                    kb.log.close()
+
+        results.append(row)
+
+    return results
+
+
+def benchmark_dedup(
+    kb_path="./KNOWLEDGE_BASE.yaml", copies=(1, 4, 16), num=500, seed=0
+) -> list:
+    """Benchmark case scoring before and after deduplication
+
+    Every case is repeated as other experiments, like the runs of one
+    experiment on several pods, and the grown knowledge base deduplicated.
+    Both must give the same case and chaos type scores to the same random
+    fingerprints, and case scoring is timed on both.
+
+    Args:
+        kb_path (str, optional): Knowledge base path.
+            Defaults to "./KNOWLEDGE_BASE.yaml".
+        copies (tuple, optional): Numbers of runs of every case.
+            Defaults to (1, 4, 16).
+        num (int, optional): Number of fingerprints. Defaults to 500.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        list: Case numbers, fingerprints per second and speedup for each
+            number of copies
+    """
+
+    base = KB()
+    base.load(kb_path)
+    fingerprints = random_fingerprints(base, num, seed)
+
+    results = []
+    for copy_num in copies:
+        grown = {}
+        for chaos_type, cases in base.kb.items():
+            grown[chaos_type] = [
+                dict(
+                    chaos,
+                    index=i * len(cases) + j,
+                    experiment=chaos["experiment"]
+                    + ("#{}".format(i) if i else ""),
+                )
+                for i in range(copy_num)
+                for j, chaos in enumerate(cases)
+            ]
+        deduplicated, dedup_report = deduplicate(grown)
+
+        row = {
+            "copies": copy_num,
+            "cases": dedup_report["cases"],
+            "representatives": dedup_report["representatives"],
+        }
+        scores = []
+        parsed = {}
+        for name, kb in [("original", grown), ("deduplicated", deduplicated)]:
+            loaded = KB()
+            loaded.load(kb)
+            reasoner = Reasoner(loaded)
+            parsed[name] = [reasoner.parse_fingerprint(f) for f in fingerprints]
+            scores.append([reasoner.reason(f) for f in fingerprints])
+            row[name] = num / timer(
+                lambda: [reasoner.score_cases(f) for f in parsed[name]]
+            )
+
+        row["speedup"] = row["deduplicated"] / row["original"]
+        if any(
+            dict(a.case_scores) != dict(b.case_scores)
+            or list(a.case_scores) != list(b.case_scores)
+            or a.type_scores != b.type_scores
+            for a, b in zip(*scores)
+        ):
+            raise Exception("Deduplication changed scores")
+        results.append(row)
+
+    return results
+
+
+def benchmark_memory(kb_path="./KNOWLEDGE_BASE.yaml", copies=(1, 10, 100)):
+    """Benchmark the memory a loaded knowledge base keeps
+
+    Every case is repeated as other experiments, and the memory still
+    allocated once ``KB.load`` returned, as traced by ``tracemalloc``, is
+    measured for the whole knowledge base: case records, index, weights and
+    anything else it keeps.
+
+    Args:
+        kb_path (str, optional): Knowledge base path.
+            Defaults to "./KNOWLEDGE_BASE.yaml".
+        copies (tuple, optional): Copies of every case. Defaults to
+            (1, 10, 100).
+
+    Returns:
+        list: Cases, and retained kilobytes in all and per case
+    """
+
+    base = KB()
+    document = base.load(kb_path)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num in copies:
+            grown = {
+                chaos_type: [
+                    dict(
+                        chaos,
+                        index=i,
+                        experiment="{}-{}".format(chaos["experiment"], i),
+                    )
+                    for i in range(num)
+                    for chaos in cases
+                ]
+                for chaos_type, cases in document.items()
+            }
+            path = os.path.join(tmp_dir, "kb.yaml")
+            with open(path, "w") as f:
+                yaml.safe_dump(grown, f, sort_keys=False)
+            cases = sum(len(cases) for cases in grown.values())
+            del grown
+
+            gc.collect()
+            tracemalloc.start()
+            kb = KB()
+            kb.load(path)
+            gc.collect()
+            retained, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del kb
+
+            results.append(
+                {
+                    "cases": cases,
+                    "retained_kb": retained / 1024,
+                    "per_case_kb": retained / 1024 / cases,
+                }
+            )
+
+    return results
+
+
+def report(results: list):
+    """Print benchmark results as a table
+
+    Args:
+        results (list): Rows of a benchmark
+    """
+
+    keys = list(results[0].keys())
+    print(" ".join("{:>20}".format(key) for key in keys))
+    for row in results:
+        print(
+            " ".join(
+                "{:>20}".format(row[key])
+                if type(row[key]) is int
+                else "{:>20.6f}".format(row[key])
+                for key in keys
+            )
+        )
+
+
+if __name__ == "__main__":
+    report(benchmark_lcs())
+    report(benchmark_pool())
+    report(benchmark_add_case())
+    report(benchmark_dedup())
+    report(benchmark_memory())
@@ -0,0 +1,378 @@
+from array import array
+from typing import Union
+
+TARGET_TYPES = ("metrics", "traces", "logs", "cmds")
+
+# Order of clues without one, -1 being a valid order
+NO_ORDER = -(2 ** 63)
+
+
+def clue_name(clue: tuple) -> str:
+    """Clue name, as given by ``KB.rename``
+
+    Args:
+        clue (tuple): ``(target_type, category, index, action)``
+
+    Returns:
+        str: "type-index-action"
+    """
+
+    _, category, idx, action = clue
+    return category + "-" + str(idx) + "-" + str(action)
+
+
+class Clue_Interner:
+    def __init__(self) -> None:
+        """Small integer ids for clues
+
+        A clue is the ``(target_type, category, index, action)`` key of one
+        anomaly, e.g. ``("metrics", "cpu", 0, "spikes")``. Ids are given in
+        order of first appearance. Category layouts of cases are interned too,
+        as most cases share one.
+        """
+
+        self.ids = {}
+        self.clues = []
+        self.layouts = {}
+        # Ids by kind of clue and name, built on the first lookup by name
+        self.names = None
+
+    def __len__(self) -> int:
+        return len(self.clues)
+
+    def intern(self, clue: tuple) -> int:
+        """Id of a clue, given a new one if unknown
+
+        Args:
+            clue (tuple): ``(target_type, category, index, action)``
+
+        Returns:
+            int: Clue id
+        """
+
+        clue_id = self.ids.get(clue)
+        if clue_id is None:
+            clue_id = self.ids[clue] = len(self.clues)
+            self.clues.append(clue)
+            if self.names is not None:
+                self.names[clue[0], self.name(clue_id)] = clue_id
+        return clue_id
+
+    def name(self, clue_id: int) -> str:
+        """Clue name, as given by ``KB.rename``
+
+        Args:
+            clue_id (int): Clue id
+
+        Returns:
+            str: "type-index-action"
+        """
+
+        return clue_name(self.clues[clue_id])
+
+    def find(self, target_type: str, name: str) -> Union[int, None]:
+        """Id of a clue given by name, as in the score tables of ``KB``
+
+        Args:
+            target_type (str): Kind of clue, e.g. "metrics"
+            name (str): "type-index-action"
+
+        Returns:
+            Union[int, None]: Clue id, None if unknown
+        """
+
+        if self.names is None:
+            self.names = {
+                (clue[0], self.name(clue_id)): clue_id
+                for clue_id, clue in enumerate(self.clues)
+            }
+        return self.names.get((target_type, name))
+
+    def layout(self, anomalies: dict) -> tuple:
+        """Shared categories of every kind of clue of some anomalies
+
+        Args:
+            anomalies (dict): Anomalies of a case or fingerprint
+
+        Returns:
+            tuple: ``(target_type, categories)`` pairs, in document order
+        """
+
+        layout = tuple(
+            (target_type, tuple(anomalies[target_type]))
+            for target_type in anomalies
+        )
+        return self.layouts.setdefault(layout, layout)
+
+
+class Clues:
+    __slots__ = ("ids", "orders", "offsets", "layout", "unknown")
+
+    def __init__(
+        self, anomalies: Union[dict, None], interner: Clue_Interner, add=True
+    ) -> None:
+        """Clue ids and orders of some anomalies, grouped by kind of clue
+
+        Args:
+            anomalies (dict): Anomalies of a case or fingerprint
+            interner (Clue_Interner): Clue interner
+            add (bool, optional): Intern unknown clues. Defaults to True;
+                otherwise unknown clues get negative ids into
+                ``self.unknown``, so the interner does not grow.
+        """
+
+        anomalies = anomalies or {}
+        self.ids = array("q")
+        self.orders = array("q")
+        self.layout = interner.layout(anomalies)
+        self.unknown = ()
+
+        offsets = [0]
+        unknown = []
+        for target_type in TARGET_TYPES:
+            fingerprint = anomalies.get(target_type) or {}
+            for one in fingerprint:
+                for clue in fingerprint[one]:
+                    key = (target_type, one, clue["index"], clue["action"])
+                    if add:
+                        clue_id = interner.intern(key)
+                    else:
+                        clue_id = interner.ids.get(key)
+                        if clue_id is None:
+                            unknown.append(key)
+                            clue_id = -len(unknown)
+                    self.ids.append(clue_id)
+                    self.orders.append(clue.get("order", NO_ORDER))
+            offsets.append(len(self.ids))
+
+        self.offsets = tuple(offsets)
+        if unknown:
+            self.unknown = tuple(unknown)
+
+    def clues(self, target_type: str, order: Union[int, None] = 0) -> list:
+        """Clue ids of one kind, in document order
+
+        Args:
+            target_type (str): Kind of clue, e.g. "metrics"
+            order (int, optional): Only the clues of this order, clues without
+                one being of order 0. Defaults to 0, None for all.
+
+        Returns:
+            list: Clue ids
+        """
+
+        i = TARGET_TYPES.index(target_type)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if order is None:
+            return self.ids[start:end].tolist()
+        return [
+            clue_id
+            for clue_id, clue_order in zip(
+                self.ids[start:end], self.orders[start:end]
+            )
+            if (0 if clue_order == NO_ORDER else clue_order) == order
+        ]
+
+    def by_order(self, target_type: str) -> dict:
+        """Clue ids of one kind grouped by order, as ``KB.rename`` groups
+        clue names
+
+        Args:
+            target_type (str): Kind of clue, e.g. "metrics"
+
+        Returns:
+            dict: Clue ids of every order, in document order, clues without
+                an order being of order 0
+        """
+
+        i = TARGET_TYPES.index(target_type)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        groups = {}
+        for clue_id, order in zip(self.ids[start:end], self.orders[start:end]):
+            groups.setdefault(0 if order == NO_ORDER else order, []).append(
+                clue_id
+            )
+        return groups
+
+    def key(self, clue_id: int, interner: Clue_Interner) -> tuple:
+        if clue_id < 0:
+            return self.unknown[-clue_id - 1]
+        return interner.clues[clue_id]
+
+    def to_yaml(self, interner: Clue_Interner) -> dict:
+        """Anomalies, in the YAML form
+
+        Args:
+            interner (Clue_Interner): Clue interner
+
+        Returns:
+            dict: Anomalies
+        """
+
+        anomalies = {
+            target_type: {one: [] for one in categories}
+            for target_type, categories in self.layout
+        }
+        for clue_id, order in zip(self.ids, self.orders):
+            target_type, one, idx, action = self.key(clue_id, interner)
+            clue = {"index": idx, "action": action}
+            if order != NO_ORDER:
+                clue["order"] = order
+            anomalies[target_type][one].append(clue)
+
+        return anomalies
+
+
+class Case(Clues):
+    __slots__ = (
+        "chaos_type",
+        "experiment",
+        "index",
+        "instance_related",
+        "order",
+        "duplicates",
+    )
+
+    def __init__(
+        self, chaos_type: str, chaos: dict, interner: Clue_Interner
+    ) -> None:
+        """Knowledge base case with interned clues
+
+        Args:
+            chaos_type (str): Chaos type of the case
+            chaos (dict): Case, in the YAML form
+            interner (Clue_Interner): Clue interner
+        """
+
+        super().__init__(chaos["anomalies"], interner)
+        self.chaos_type = chaos_type
+        self.experiment = chaos["experiment"]
+        self.index = chaos["index"]
+        self.instance_related = chaos["instance_related"]
+        self.order = chaos.get("order")
+        self.duplicates = tuple(
+            (duplicate["index"], duplicate["experiment"])
+            for duplicate in chaos.get("duplicates", ())
+        )
+
+    @classmethod
+    def from_arrays(
+        cls,
+        chaos_type: str,
+        meta: dict,
+        ids,
+        orders,
+        offsets: tuple,
+        layout: tuple,
+    ) -> "Case":
+        """Case record over clue ids and orders already interned, e.g.
+        memory-mapped by ``KB.open_snapshot``
+
+        Args:
+            chaos_type (str): Chaos type of the case
+            meta (dict): Case, in the YAML form, without anomalies
+            ids (Sequence): Clue ids, grouped by kind of clue
+            orders (Sequence): Clue orders
+            offsets (tuple): Start of every kind of clue in ids, and the end
+            layout (tuple): Categories, see ``Clue_Interner.layout``
+
+        Returns:
+            Case: Case record
+        """
+
+        record = cls.__new__(cls)
+        record.ids = ids
+        record.orders = orders
+        record.offsets = offsets
+        record.layout = layout
+        record.unknown = ()
+        record.chaos_type = chaos_type
+        record.experiment = meta["experiment"]
+        record.index = meta["index"]
+        record.instance_related = meta["instance_related"]
+        record.order = meta.get("order")
+        record.duplicates = tuple(
+            (duplicate["index"], duplicate["experiment"])
+            for duplicate in meta.get("duplicates", ())
+        )
+        return record
+
+    @property
+    def multiplicity(self) -> int:
+        """Number of cases the case stands for, see ``kb.multiplicity``"""
+
+        return 1 + len(self.duplicates)
+
+    def members(self) -> list:
+        """Index and experiment of the case and of its duplicates
+
+        Returns:
+            list: ``(index, experiment)`` pairs, the case first
+        """
+
+        return [(self.index, self.experiment)] + list(self.duplicates)
+
+    def to_yaml(self, interner: Clue_Interner) -> dict:
+        """Case, in the YAML form
+
+        Args:
+            interner (Clue_Interner): Clue interner
+
+        Returns:
+            dict: Case
+        """
+
+        chaos = {
+            "index": self.index,
+            "experiment": self.experiment,
+            "instance_related": self.instance_related,
+        }
+        if self.order is not None:
+            chaos["order"] = self.order
+        chaos["anomalies"] = super().to_yaml(interner)
+        if self.duplicates:
+            chaos["duplicates"] = [
+                {"index": idx, "experiment": experiment}
+                for idx, experiment in self.duplicates
+            ]
+
+        return chaos
+
+
+class Fingerprint(Clues):
+    __slots__ = ("groundtruth", "order")
+
+    def __init__(
+        self, fingerprint: Union[dict, None], interner: Clue_Interner
+    ) -> None:
+        """Fingerprint with clues interned against a knowledge base
+
+        Clues unknown to the knowledge base are kept aside, so the interner
+        of a serving knowledge base does not grow with every fingerprint.
+
+        Args:
+            fingerprint (dict): Fingerprint, in the YAML form
+            interner (Clue_Interner): Clue interner of the knowledge base
+        """
+
+        fingerprint = fingerprint or {}
+        super().__init__(fingerprint.get("anomalies"), interner, add=False)
+        self.groundtruth = fingerprint.get("groundtruth")
+        self.order = fingerprint.get("order")
+
+    def to_yaml(self, interner: Clue_Interner) -> dict:
+        """Fingerprint, in the YAML form
+
+        Args:
+            interner (Clue_Interner): Clue interner of the knowledge base
+
+        Returns:
+            dict: Fingerprint
+        """
+
+        fingerprint = {"groundtruth": self.groundtruth}
+        if self.order is not None:
+            fingerprint["order"] = self.order
+        fingerprint["anomalies"] = super().to_yaml(interner)
+
+        return fingerprint
@@ -0,0 +1,186 @@
+import argparse
+import copy
+import logging
+import yaml
+from kb import KB, members
+from loader import load_yaml
+from clue import TARGET_TYPES
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def signature(kb: KB, chaos: dict) -> tuple:
+    """Renamed clues of a case, as seen by similarity and weights
+
+    Args:
+        kb (KB): Knowledge base renaming clues
+        chaos (dict): Knowledge base case
+
+    Returns:
+        tuple: Sorted renamed clues of every order, for each kind of clue
+    """
+
+    anomalies = chaos["anomalies"]
+    return tuple(
+        tuple(
+            sorted(
+                (order, tuple(sorted(clues)))
+                for order, clues in kb.rename(
+                    anomalies[target_type] if target_type in anomalies else None
+                ).items()
+            )
+        )
+        for target_type in TARGET_TYPES
+    )
+
+
+def clue_set(key: tuple) -> frozenset:
+    """Clues of a signature, whatever their order and count
+
+    Args:
+        key (tuple): Signature from ``signature``
+
+    Returns:
+        frozenset: ``(target_type, clue)`` pairs
+    """
+
+    return frozenset(
+        (target_type, clue)
+        for target_type, renamed in zip(TARGET_TYPES, key)
+        for _, clues in renamed
+        for clue in clues
+    )
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    """Jaccard similarity of two clue sets
+
+    Args:
+        a (frozenset): Clues
+        b (frozenset): Clues
+
+    Returns:
+        float: Intersection over union, 1 for two empty sets
+    """
+
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def deduplicate(kb: dict, threshold: float = 1.0) -> tuple:
+    """Merge duplicate cases of each chaos type into representative cases
+
+    Going through the cases of a chaos type in order, a case joins the first
+    representative with the same renamed clues, counts and orders, or with
+    ``threshold < 1``, the first one whose clue set is at least that
+    Jaccard-similar. Otherwise it becomes a representative. Representatives
+    list the index and experiment of the cases they replaced under
+    "duplicates", and ``KB`` counts them that many times in weights and
+    chaos types, and scores them once for all their experiments.
+
+    Only exact duplicates (the default) leave every score, and so every
+    ranking, unchanged: a near duplicate is scored as its representative.
+    Chaos types whose case indexes are not increasing are left as they are,
+    as indexes order the experiments of merged cases.
+
+    Args:
+        kb (dict): Knowledge base, possibly deduplicated already
+        threshold (float, optional): Jaccard similarity for near duplicates.
+            Defaults to 1.0, exact duplicates only.
+
+    Returns:
+        tuple: Deduplicated knowledge base, and a report of the case number
+            before and after, merged and near duplicate cases and the size
+            reduction
+    """
+
+    renamer = KB()
+    deduplicated = {}
+    report = {"cases": 0, "representatives": 0, "merged": 0, "near": 0}
+
+    for chaos_type, cases in kb.items():
+        report["cases"] += len(cases)
+        indexes = [idx for chaos in cases for idx, _ in members(chaos)]
+        if len(set(indexes)) != len(indexes) or any(
+            a["index"] >= b["index"] for a, b in zip(cases, cases[1:])
+        ):
+            _LOGGER.warning(
+                "Case indexes of {} are not increasing, keep its "
+                "cases".format(chaos_type)
+            )
+            deduplicated[chaos_type] = cases
+            report["representatives"] += len(cases)
+            continue
+
+        representatives = []
+        exact = {}
+        for chaos in cases:
+            key = (
+                signature(renamer, chaos),
+                chaos["instance_related"],
+                chaos.get("order"),
+            )
+            representative = exact.get(key)
+            if representative is None and threshold < 1:
+                clues = clue_set(key[0])
+                for other, other_key in representatives:
+                    if other_key[1:] == key[1:] and (
+                        jaccard(clue_set(other_key[0]), clues) >= threshold
+                    ):
+                        representative = other
+                        report["near"] += 1
+                        break
+
+            if representative is None:
+                representative = copy.deepcopy(chaos)
+                representative.setdefault("duplicates", [])
+                representatives.append((representative, key))
+                exact[key] = representative
+                continue
+
+            representative["duplicates"] += [
+                {"index": idx, "experiment": experiment}
+                for idx, experiment in members(chaos)
+            ]
+            report["merged"] += 1
+
+        for representative, _ in representatives:
+            if not representative["duplicates"]:
+                del representative["duplicates"]
+        deduplicated[chaos_type] = [chaos for chaos, _ in representatives]
+        report["representatives"] += len(representatives)
+
+    report["reduction"] = (
+        1 - report["representatives"] / report["cases"]
+        if report["cases"]
+        else 0.0
+    )
+
+    return deduplicated, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge duplicate Knowledge Base cases"
+    )
+    parser.add_argument("kb", help="Knowledge Base path")
+    parser.add_argument("output", help="Deduplicated Knowledge Base path")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.0,
+        help="Jaccard similarity of near duplicates, 1 for exact ones only",
+    )
+    args = parser.parse_args()
+
+    kb, report = deduplicate(load_yaml(args.kb), args.threshold)
+    with open(args.output, "w", encoding="utf-8") as f:
+        yaml.safe_dump(kb, f, default_flow_style=False, sort_keys=False)
+
+    print(
+        "{cases} cases, {representatives} after deduplication ({merged} "
+        "merged, {near} near duplicates), {reduction:.1%} fewer".format(
+            **report
+        )
+    )
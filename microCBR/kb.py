@@ -1,13 +1,197 @@
-import yaml
 import os
+import copy
+import yaml
+import json
+import mmap
+import struct
+import hashlib
 import logging
-from weight import Weight
-from schema import Schema, SchemaError, Optional
-from typing import Union
+import tempfile
+from array import array
+from collections import Counter
+from collections.abc import Mapping, Sequence
+from scipy import sparse
+import numpy as np
+from loader import YAML_CACHE, load_yaml
+from weight import Weight, Incremental_Weight, Sparse_Weight
+from validation import validate_kb
+from clue import Clue_Interner, Case, TARGET_TYPES
+from schema import SchemaError
+from typing import Callable, Union
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.DEBUG)
 
+SNAPSHOT_MAGIC = b"MCBRSNAP"
+SNAPSHOT_VERSION = 2
+# Magic, version and header length, then the JSON header
+SNAPSHOT_PREFIX = struct.Struct("<8sIQ")
+
+SCORES = [
+    "metrics_score",
+    "traces_score",
+    "logs_score",
+    "cmds_score",
+    "type_metrics_score",
+    "type_traces_score",
+    "type_logs_score",
+    "type_cmds_score",
+]
+
+# Posting of clues no case holds: cases, counts and orders
+EMPTY_POSTING = (array("q"), array("q"), array("q"))
+
+
+def kind(score: str) -> str:
+    """Kind of clue a score table weighs
+
+    Args:
+        score (str): Score table, e.g. "type_metrics_score"
+
+    Returns:
+        str: Kind of clue, e.g. "metrics"
+    """
+
+    return score[: -len("_score")].replace("type_", "")
+
+
+def digest(data: str) -> str:
+    """Hash of a knowledge base source
+
+    Args:
+        data (str): Knowledge base file content
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def write_atomic(path: str, write: Callable):
+    """Write a text file aside and move it in place, so a reader never sees
+    half a file
+
+    The file is written to a unique temporary file in the same directory,
+    so concurrent writers do not overwrite each other's, which is removed
+    if writing fails. The file keeps the mode of the one it replaces.
+
+    Args:
+        path (str): File path
+        write (Callable): Called with the text stream of the file, e.g.
+            ``lambda f: f.write(data)``
+    """
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+    )
+    try:
+        mode = os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644
+        os.chmod(tmp_path, mode)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def multiplicity(chaos: dict) -> int:
+    """Number of cases a knowledge base case stands for
+
+    A case merged by ``dedup.deduplicate`` lists the cases it replaced under
+    "duplicates", and counts for all of them in weights and chaos types.
+
+    Args:
+        chaos (dict): Knowledge base case
+
+    Returns:
+        int: One, plus its duplicates
+    """
+
+    return 1 + len(chaos.get("duplicates", ()))
+
+
+def members(chaos: dict) -> list:
+    """Index and experiment of a case and of its duplicates
+
+    Args:
+        chaos (dict): Knowledge base case
+
+    Returns:
+        list: ``(index, experiment)`` pairs, the case first
+    """
+
+    return [(chaos["index"], chaos["experiment"])] + [
+        (duplicate["index"], duplicate["experiment"])
+        for duplicate in chaos.get("duplicates", ())
+    ]
+
+
+class Score_Table(Mapping):
+    def __init__(self, kb: "KB", score: str) -> None:
+        """Read-only score table of a knowledge base, by clue name
+
+        Weights are only stored by clue id, in ``kb.weight_arrays``, and this
+        view looks them up by the names ``KB.rename`` gives.
+
+        Args:
+            kb (KB): Knowledge base
+            score (str): Score table, e.g. "metrics_score"
+        """
+
+        self.kb = kb
+        self.score = score
+        self.target_type = kind(score)
+
+    def __getitem__(self, name: str) -> float:
+        clue_id = self.kb.interner.find(self.target_type, name)
+        weights = self.kb.weight_arrays[self.score]
+        if clue_id is None or weights[clue_id] != weights[clue_id]:
+            raise KeyError(name)
+        return weights[clue_id]
+
+    def __iter__(self):
+        for clue_id, weight in enumerate(self.kb.weight_arrays[self.score]):
+            if weight == weight:
+                yield self.kb.interner.name(clue_id)
+
+    def __len__(self) -> int:
+        return sum(
+            weight == weight for weight in self.kb.weight_arrays[self.score]
+        )
+
+
+class Postings(Sequence):
+    def __init__(self, ptr, cases, counts, orders) -> None:
+        """Postings of every clue id, over arrays delimited by ``ptr``, as
+        memory-mapped by ``KB.open_snapshot``
+
+        Args:
+            ptr (Sequence): Start of the postings of every clue id, and the end
+            cases (Sequence): Case indexes of all postings
+            counts (Sequence): Clue counts of all postings
+            orders (Sequence): Clue orders of all postings
+        """
+
+        self.ptr = ptr
+        self.cases = cases
+        self.counts = counts
+        self.orders = orders
+
+    def __getitem__(self, clue_id: int) -> tuple:
+        first, last = self.ptr[clue_id], self.ptr[clue_id + 1]
+        return (
+            self.cases[first:last],
+            self.counts[first:last],
+            self.orders[first:last],
+        )
+
+    def __len__(self) -> int:
+        return len(self.ptr) - 1
+
 
 class KB_Chaos:
     def __init__(self, chaos_path):
@@ -17,16 +201,15 @@ class KB_Chaos:
     def is_instance_related(self):
         """Check whether chaos is instance related"""
 
-        if len(os.listdir(self.chaos_path)) == 0:
+        chaos_names = os.listdir(self.chaos_path)
+        if len(chaos_names) == 0:
             _LOGGER.error("No chaos found in {}".format(self.chaos_path))
             return True, None
 
-        for chaos in os.listdir(self.chaos_path):
+        for chaos in chaos_names:
             if chaos.endswith(".yaml"):
-                f = open(self.chaos_path + "/" + chaos)
-                data = f.read()
-                f.close()
-                data = yaml.safe_load(data)
+                # Every run file is read once, keep it out of the cache
+                data = load_yaml(self.chaos_path + "/" + chaos, cache=False)
                 if self.last_chaos is None:
                     self.last_chaos = data
 
@@ -36,7 +219,7 @@ class KB_Chaos:
                     else:
                         return True, data
 
-        if len(os.listdir(self.chaos_path)) <= 2:
+        if len(chaos_names) <= 2:
             return True, data
 
         return False, data
@@ -67,38 +250,123 @@ class KB:
         self.type_logs_score = None
         self.type_cmds_score = None
 
-    def load(self, kb_path: str) -> Union[dict, None]:
+        # Weighting engines behind each score table, only kept once cases
+        # are added, see ``learn``
+        self.weights = {}
+
+        # Cases, and their index and weights by interned clue id
+        self.interner = Clue_Interner()
+        self.cases = []
+        self.winners = []
+        self.experiments = {}
+        self.ranks = {}
+        self.positions = {}
+        self.postings = []
+        self.lengths = {}
+        self.bounds = {}
+        self.types = {}
+        self.weight_arrays = {}
+        self.matrix = None
+
+        # Score tables to normalize again, and whether experiments are to be
+        # ordered again, after adding cases, see ``refresh``
+        self.stale = set()
+        self.unordered = False
+
+        # Knowledge base file, and hash of its content
+        self.source = None
+        self.source_hash = None
+        self.snapshot = None
+
+        # Write-ahead log of added cases
+        self.log = None
+        self.log_path = None
+        self.log_entries = 0
+        self.compact_every = None
+        self.snapshot_path = None
+
+    @property
+    def kb(self) -> Union[dict, None]:
+        """Knowledge base document
+
+        Loaded knowledge bases only keep their case records, see ``load``
+        and ``open_snapshot``, so the document is built from them on first
+        use.
+        """
+
+        if self._kb is None and self.source_hash is not None:
+            self._kb = {chaos_type: [] for chaos_type in self.types}
+            for record in self.cases:
+                self._kb[record.chaos_type].append(
+                    record.to_yaml(self.interner)
+                )
+        return self._kb
+
+    @kb.setter
+    def kb(self, kb: Union[dict, None]):
+        self._kb = kb
+
+    def load(
+        self,
+        kb_path: str,
+        backend: str = "incremental",
+        validate_once: bool = False,
+    ) -> Union[dict, None]:
         """Load knowledge base
 
+        A knowledge base file is parsed again, out of the YAML cache. Once
+        indexed and weighted, the document is dropped: reasoning only reads
+        the case records and weights by clue id, and ``self.kb`` builds the
+        document again from the records when used. A given document is
+        never modified.
+
         Args:
             kb_path (str): Knowledge base path
+            backend (str, optional): Weighting backend, see
+                ``score_fingerprint``. Defaults to "incremental".
+            validate_once (bool, optional): Skip validating a knowledge base
+                file whose content was already validated. Defaults to False.
 
         Raises:
             Exception: Knowledge base check
 
         Returns:
-            dict: Knowledge base
+            dict: Knowledge base document
         """
 
+        self.snapshot = None
         if type(kb_path) is str:
-            f = open(kb_path)
-            data = f.read()
-            f.close()
-            self.kb = yaml.safe_load(data)
+            # Not cached, the document is only used while loading
+            self.kb, self.source_hash = YAML_CACHE.read(kb_path, cache=False)
+            self.source = os.path.abspath(kb_path)
         elif type(kb_path) is dict:
             self.kb = kb_path
+            self.source = None
+            self.source_hash = digest(json.dumps(kb_path, sort_keys=True))
 
-        is_checked = self.check_kb()
+        is_checked = self.check_kb(
+            self.source_hash
+            if validate_once and type(kb_path) is str
+            else None
+        )
 
         if is_checked:
-            self.score_fingerprint()
-            return self.kb
+            self.interner = Clue_Interner()
+            self.build_index()
+            self.score_fingerprint(backend)
+            document = self.kb
+            self.kb = None
+            return document
         else:
             raise Exception("Knowledge Base check failed")
 
-    def check_kb(self) -> bool:
+    def check_kb(self, digest: str = None) -> bool:
         """Check knowledge base config
 
+        Args:
+            digest (str, optional): Content hash of the knowledge base, to
+                skip checking it again once valid. Defaults to None.
+
         Raises:
             se: Schema error
 
@@ -109,73 +377,39 @@ class KB:
             _LOGGER.error("Knowledge Base is not loaded")
             return False
 
-        anomaly_schema = [{"index": int, "action": str, Optional("order"): int}]
-        custom_metrics_schema = {
-            Optional("network"): anomaly_schema,
-            Optional("cpu"): anomaly_schema,
-            Optional("memory"): anomaly_schema,
-            Optional("io"): anomaly_schema,
-            Optional("container"): anomaly_schema,
-            Optional("mongo"): anomaly_schema,
-            Optional("mysql"): anomaly_schema,
-            Optional("icmp"): anomaly_schema,
-            Optional("time"): anomaly_schema,
-            Optional("jvm"): anomaly_schema,
-            Optional("http"): anomaly_schema,
-        }
-
-        custom_traces_schema = {
-            Optional("onehop"): anomaly_schema,
-        }
-
-        custom_logs_schema = {
-            Optional("pod"): anomaly_schema,
-        }
-
-        custom_cmds_schema = {
-            Optional("config"): anomaly_schema,
-            Optional("exec"): anomaly_schema,
-        }
-
-        custom_schema = [
-            {
-                "index": int,
-                "experiment": str,
-                "instance_related": bool,
-                Optional("order"): bool,
-                "anomalies": {
-                    Optional("metrics"): custom_metrics_schema,
-                    Optional("traces"): custom_traces_schema,
-                    Optional("logs"): custom_logs_schema,
-                    Optional("cmds"): custom_cmds_schema,
-                },
-            }
-        ]
-
-        config_schema = Schema(
-            {
-                Optional("network"): custom_schema,
-                Optional("pod"): custom_schema,
-                Optional("stress"): custom_schema,
-                Optional("time"): custom_schema,
-                Optional("jvm"): custom_schema,
-                Optional("dns"): custom_schema,
-                Optional("http"): custom_schema,
-                Optional("io"): custom_schema,
-                Optional("config"): custom_schema,
-            }
-        )
-
         try:
-            config_schema.validate(self.kb)
+            validate_kb(self.kb, digest)
             _LOGGER.info("Configuration is valid.")
         except SchemaError as se:
             raise se
 
         return True
 
-    def score_fingerprint(self):
-        """Score fingerprint"""
+    def score_fingerprint(
+        self, backend: str = "incremental", keep_weights: bool = False
+    ):
+        """Score fingerprint
+
+        Weights are stored by clue id, see ``store_weights``, so the
+        knowledge base must be indexed first. Clue name lists are dropped
+        once weighted, and so are the weighting engines unless kept.
+
+        Args:
+            backend (str, optional): Weighting backend: "python" for
+                ``Weight``, "incremental" for ``Incremental_Weight``, or
+                "sparse" for ``Sparse_Weight`` on very large knowledge bases.
+                All give the same scores. Defaults to "incremental".
+            keep_weights (bool, optional): Keep the engines in
+                ``self.weights``, for ``learn``. Defaults to False.
+        """
+
+        backends = {
+            "python": Weight,
+            "incremental": Incremental_Weight,
+            "sparse": Sparse_Weight,
+        }
+        if backend not in backends:
+            raise Exception("Unknown weighting backend {}".format(backend))
 
         # Two hierarchies for our experiment
 
@@ -196,23 +430,26 @@ class KB:
                 logs = anomalies["logs"] if "logs" in anomalies else None
                 cmds = anomalies["cmds"] if "cmds" in anomalies else None
 
-                (
-                    metrics_instance,
-                    traces_instance,
-                    logs_instance,
-                    cmds_instance,
-                ) = self.analyse(metrics, traces, logs, cmds)
+                # A merged case counts for each case it replaced
+                for _ in range(multiplicity(chaos)):
+                    (
+                        metrics_instance,
+                        traces_instance,
+                        logs_instance,
+                        cmds_instance,
+                    ) = self.analyse(metrics, traces, logs, cmds)
 
-                type_metrics += metrics_instance
-                type_traces += traces_instance
-                type_logs += logs_instance
-                type_cmds += cmds_instance
+                    type_metrics += metrics_instance
+                    type_traces += traces_instance
+                    type_logs += logs_instance
+                    type_cmds += cmds_instance
 
             self.type_metrics.append(type_metrics) if type_metrics else None
             self.type_traces.append(type_traces) if type_traces else None
             self.type_logs.append(type_logs) if type_logs else None
             self.type_cmds.append(type_cmds) if type_cmds else None
 
+        tables = {}
         for (data, score) in zip(
             [
                 self.metrics,
@@ -224,23 +461,884 @@ class KB:
                 self.type_logs,
                 self.type_cmds,
             ],
-            [
-                "metrics_score",
-                "traces_score",
-                "logs_score",
-                "cmds_score",
-                "type_metrics_score",
-                "type_traces_score",
-                "type_logs_score",
-                "type_cmds_score",
-            ],
+            SCORES,
         ):
-            weight = Weight(data)
-            weighted_score = weight()
-            max_score = max(weighted_score.values())
-            for key in weighted_score:
-                weighted_score[key] = weighted_score[key] / max_score
-            setattr(self, score, weighted_score)
+            weight = backends[backend](data)
+            self.weights[score] = weight
+            tables[score] = self.normalize(weight())
+
+        if not keep_weights:
+            self.weights = {}
+        self.clear_items()
+        self.store_weights(tables)
+
+    def clear_items(self):
+        """Drop the clue name lists gathered by ``analyse``"""
+
+        for item_list in [
+            self.metrics,
+            self.traces,
+            self.logs,
+            self.cmds,
+            self.type_metrics,
+            self.type_traces,
+            self.type_logs,
+            self.type_cmds,
+        ]:
+            item_list.clear()
+
+    def normalize(self, weighted_score: dict) -> dict:
+        """Divide the scores of a table by the largest one
+
+        Args:
+            weighted_score (dict): Score of every clue name
+
+        Returns:
+            dict: Normalized scores
+        """
+
+        max_score = max(weighted_score.values())
+        for key in weighted_score:
+            weighted_score[key] = weighted_score[key] / max_score
+        return weighted_score
+
+    def store_weights(self, tables: dict):
+        """Store normalized score tables as weight arrays by clue id
+
+        ``self.weight_arrays`` holds, for every score table, the weight of
+        every interned clue, NaN for clues of other kinds, and the score table
+        attributes are ``Score_Table`` views of it. Tables not given are
+        only extended to new clues.
+
+        Args:
+            tables (dict): Normalized score of every clue name, by table
+        """
+
+        nan = float("nan")
+        names = [
+            self.interner.name(clue_id) for clue_id in range(len(self.interner))
+        ]
+        for score in SCORES:
+            if score not in tables:
+                weights = self.weight_arrays.get(score, array("d"))
+                weights.extend([nan] * (len(self.interner) - len(weights)))
+            else:
+                table = tables[score]
+                target_type = kind(score)
+                weights = array("d", [nan]) * len(self.interner)
+                for clue_id, clue in enumerate(self.interner.clues):
+                    if clue[0] == target_type:
+                        weights[clue_id] = table.get(names[clue_id], nan)
+            self.weight_arrays[score] = weights
+            setattr(self, score, Score_Table(self, score))
+
+    def build_index(self):
+        """Build the inverted index from clue id to knowledge base cases
+
+        Every case is interned once into a ``Case`` record of ``self.cases``,
+        and ``self.postings`` gives, for every clue id, the cases holding it
+        as arrays of case indexes, counts and orders, one entry for each
+        order, so reasoning only needs to score cases sharing a clue with the
+        fingerprint. ``self.lengths`` gives the order 0 clue number of every
+        case, for each kind of clue, and ``self.bounds`` per-clue statistics
+        bounding the score of any case, see ``update_bounds``.
+
+        ``self.experiments`` maps an experiment name to its last case, the one
+        that ends up in ``Reasoner.case_scores``, and ``self.ranks`` to its
+        position in there. ``self.positions`` gives the position of that last
+        case in the knowledge base before deduplication, and
+        ``self.winners`` the experiments every case is the last case of.
+
+        A case merged by ``dedup.deduplicate`` is scored once for all its
+        "experiments", which are ordered by case index within their chaos
+        type, as they were before deduplication.
+
+        ``self.types`` keeps, for every chaos type of the first hierarchy, its
+        cases, case number, order 0 clue number and order 0 clue counts by
+        clue id under "counts", so chaos types can be scored without walking
+        their cases.
+        """
+
+        self.index_cases(
+            {
+                chaos_type: [
+                    Case(chaos_type, chaos, self.interner)
+                    for chaos in self.kb[chaos_type]
+                ]
+                for chaos_type in self.kb.keys()
+            }
+        )
+
+    def index_cases(self, records: dict):
+        """Build the index from interned cases, see ``build_index``
+
+        Args:
+            records (dict): Case records of every chaos type, in knowledge base
+                order
+        """
+
+        self.cases = []
+        self.postings = []
+        self.lengths = {target_type: array("q") for target_type in TARGET_TYPES}
+        self.bounds = {
+            "ratio": array("d"),
+            "count": array("q"),
+            "ordered": array("d"),
+        }
+        self.types = {}
+        self.matrix = None
+
+        for chaos_type, chaos_records in records.items():
+            self.add_type(chaos_type)
+            for record in chaos_records:
+                self.index_case(record)
+
+        self.order_experiments()
+
+    def add_type(self, chaos_type: str):
+        """Add a chaos type without cases to ``self.types``
+
+        Args:
+            chaos_type (str): Chaos type
+        """
+
+        self.types[chaos_type] = {
+            "cases": array("q"),
+            "case_num": 0,
+            "length": dict.fromkeys(TARGET_TYPES, 0),
+            "counts": {target_type: Counter() for target_type in TARGET_TYPES},
+        }
+
+    def index_case(self, record: Case):
+        """Add an interned case to the index
+
+        Args:
+            record (Case): Case record, of a chaos type in ``self.types``
+        """
+
+        case_idx = len(self.cases)
+        self.cases.append(record)
+
+        grown = len(self.interner) - len(self.postings)
+        self.postings.extend([EMPTY_POSTING] * grown)
+        for bound in self.bounds.values():
+            bound.extend([0] * grown)
+
+        kb_type = self.types[record.chaos_type]
+        kb_type["cases"].append(case_idx)
+        kb_type["case_num"] += record.multiplicity
+
+        for target_type in TARGET_TYPES:
+            clues = record.clues(target_type)
+            self.lengths[target_type].append(len(clues))
+            kb_type["length"][target_type] += record.multiplicity * len(clues)
+            counts = kb_type["counts"][target_type]
+            for clue_id, count in Counter(clues).items():
+                counts[clue_id] += record.multiplicity * count
+
+            for order, ids in record.by_order(target_type).items():
+                for clue_id, count in Counter(ids).items():
+                    if self.postings[clue_id] is EMPTY_POSTING:
+                        self.postings[clue_id] = (
+                            array("q"),
+                            array("q"),
+                            array("q"),
+                        )
+                    cases, case_counts, case_orders = self.postings[clue_id]
+                    cases.append(case_idx)
+                    case_counts.append(count)
+                    case_orders.append(order)
+
+            self.update_bounds(record, target_type)
+
+    def order_experiments(self):
+        """Order experiments as in the knowledge base, see ``build_index``"""
+
+        self.unordered = False
+        self.experiments = {}
+        self.ranks = {}
+        self.positions = {}
+        self.winners = [[] for _ in self.cases]
+        position = 0
+
+        for kb_type in self.types.values():
+            experiments = [
+                (idx, experiment, case_idx)
+                for case_idx in kb_type["cases"]
+                for idx, experiment in self.cases[case_idx].members()
+            ]
+            if len(experiments) > len(kb_type["cases"]):
+                experiments.sort(key=lambda member: member[0])
+            for _, experiment, case_idx in experiments:
+                self.ranks.setdefault(experiment, len(self.ranks))
+                self.experiments[experiment] = case_idx
+                self.positions[experiment] = position
+                position += 1
+
+        for experiment, case_idx in self.experiments.items():
+            self.winners[case_idx].append(experiment)
+
+    def update_bounds(self, record: Case, target_type: str):
+        """Update per-clue statistics bounding the score of any case
+
+        For each clue id, ``self.bounds`` keeps under "ratio" the largest
+        count over clue number ratio among order 0 clues, under "count" the
+        largest order 0 count, and under "ordered" the largest ratio over
+        clues of all orders, as used by ordered metrics.
+
+        Args:
+            record (Case): Case record
+            target_type (str): Kind of clue
+        """
+
+        clues = record.clues(target_type)
+        for clue_id, count in Counter(clues).items():
+            self.bounds["ratio"][clue_id] = max(
+                self.bounds["ratio"][clue_id], count / len(clues)
+            )
+            self.bounds["count"][clue_id] = max(
+                self.bounds["count"][clue_id], count
+            )
+
+        clues = record.clues(target_type, order=None)
+        for clue_id, count in Counter(clues).items():
+            self.bounds["ordered"][clue_id] = max(
+                self.bounds["ordered"][clue_id], count / len(clues)
+            )
+
+    def refresh(self):
+        """Normalize the score tables and order the experiments again after
+        adding cases
+
+        ``learn`` indexes every added case at once, but leaves the score
+        tables it touched and the experiment ranks stale, as updating them
+        costs as much for one case as for many. Reasoning refreshes them
+        first, so adding many cases only pays for it once.
+        """
+
+        if self.stale:
+            self.store_weights(
+                {
+                    score: self.normalize(self.weights[score]())
+                    for score in self.stale
+                }
+            )
+            self.stale = set()
+        if self.unordered:
+            self.order_experiments()
+
+    def build_matrix(self):
+        """Encode the knowledge base as sparse weighted clue matrices
+
+        ``self.matrix[hierarchy][target_type]`` holds, for the "case" and
+        "type" hierarchies, a CSR matrix of clue weight times clue count for
+        every case (or chaos type), with a column for every clue id, and the
+        clue count of every row. Like ``Reasoner.cal_similarity``, only clues
+        of order 0 are encoded.
+        """
+
+        self.refresh()
+
+        def encode(rows, weights, length):
+            data, indices, indptr = [], [], [0]
+            for counts in rows:
+                for clue_id, count in counts.items():
+                    indices.append(clue_id)
+                    data.append(weights[clue_id] * count)
+                indptr.append(len(indices))
+
+            matrix = sparse.csr_matrix(
+                (data, indices, indptr), shape=(len(rows), len(self.interner))
+            )
+            return {
+                "matrix": matrix,
+                "length": np.array(length, dtype=float),
+            }
+
+        kb_types = list(self.types.values())
+        self.matrix = {
+            "case": {},
+            "type": {},
+            "case_num": np.array(
+                [kb_type["case_num"] for kb_type in kb_types], dtype=float
+            ),
+        }
+
+        for target_type in TARGET_TYPES:
+            self.matrix["case"][target_type] = encode(
+                [Counter(case.clues(target_type)) for case in self.cases],
+                self.weight_arrays[target_type + "_score"],
+                self.lengths[target_type],
+            )
+            self.matrix["type"][target_type] = encode(
+                [kb_type["counts"][target_type] for kb_type in kb_types],
+                self.weight_arrays["type_" + target_type + "_score"],
+                [kb_type["length"][target_type] for kb_type in kb_types],
+            )
+
+    def compile(self, path: str):
+        """Write a binary snapshot of the loaded knowledge base
+
+        The snapshot holds a magic number, a format version and a JSON header
+        with the source path and hash, the interned clue table, the category
+        layouts and the case metadata, followed by 8-byte aligned arrays:
+        the clue ids and orders of all case records, delimited by
+        ``case_ptr``, with their offsets by kind of clue, the postings of
+        every clue delimited by ``posting_ptr``, clue lengths, bounds and
+        weights as in ``build_index`` and ``store_weights``, and the cases
+        and clue counts of every chaos type. The file is written aside and
+        moved in place, so a reader never sees half a snapshot.
+
+        Args:
+            path (str): Snapshot path
+
+        Raises:
+            Exception: Knowledge base is not loaded
+        """
+
+        if not self.weight_arrays:
+            raise Exception("Knowledge Base is not loaded")
+        self.refresh()
+
+        layouts = {}
+        cases = []
+        arrays = {
+            "case_ptr": array("q", [0]),
+            "case_ids": array("q"),
+            "case_orders": array("q"),
+            "case_offsets": array("q"),
+        }
+        for record in self.cases:
+            meta = record.to_yaml(self.interner)
+            del meta["anomalies"]
+            meta["chaos_type"] = record.chaos_type
+            meta["layout"] = layouts.setdefault(record.layout, len(layouts))
+            cases.append(meta)
+            arrays["case_ids"].extend(record.ids)
+            arrays["case_orders"].extend(record.orders)
+            arrays["case_offsets"].extend(record.offsets)
+            arrays["case_ptr"].append(len(arrays["case_ids"]))
+
+        arrays["posting_ptr"] = array("q", [0])
+        for name in ["posting_cases", "posting_counts", "posting_orders"]:
+            arrays[name] = array("q")
+        for posting in self.postings:
+            for name, values in zip(
+                ["posting_cases", "posting_counts", "posting_orders"], posting
+            ):
+                arrays[name].extend(values)
+            arrays["posting_ptr"].append(len(arrays["posting_cases"]))
+
+        for target_type in TARGET_TYPES:
+            arrays[target_type + "_lengths"] = self.lengths[target_type]
+        for bound, values in self.bounds.items():
+            arrays["bound_" + bound] = values
+        for score in SCORES:
+            arrays[score] = self.weight_arrays[score]
+
+        types = {}
+        arrays["type_cases"] = array("q")
+        arrays["type_ptr"] = array("q", [0])
+        arrays["type_clues"] = array("q")
+        arrays["type_counts"] = array("q")
+        for chaos_type, kb_type in self.types.items():
+            types[chaos_type] = {
+                "cases": len(kb_type["cases"]),
+                "case_num": kb_type["case_num"],
+                "length": kb_type["length"],
+            }
+            arrays["type_cases"].extend(kb_type["cases"])
+            for target_type in TARGET_TYPES:
+                counts = kb_type["counts"][target_type]
+                arrays["type_clues"].extend(counts.keys())
+                arrays["type_counts"].extend(counts.values())
+                arrays["type_ptr"].append(len(arrays["type_clues"]))
+
+        offset = 0
+        specs = {}
+        for name, values in arrays.items():
+            specs[name] = {
+                "format": values.typecode,
+                "count": len(values),
+                "offset": offset,
+            }
+            offset += len(values) * values.itemsize
+
+        header = json.dumps(
+            {
+                "source": self.source,
+                "source_hash": self.source_hash,
+                "clues": self.interner.clues,
+                "layouts": list(layouts),
+                "cases": cases,
+                "types": types,
+                "arrays": specs,
+            }
+        ).encode("utf-8")
+        prefix = SNAPSHOT_PREFIX.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)
+        )
+        start = -(-(len(prefix) + len(header)) // 8) * 8
+
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(prefix + header)
+                f.seek(start)
+                for values in arrays.values():
+                    f.write(values.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        _LOGGER.info(
+            "Compiled {} cases and {} clues to {}".format(
+                len(cases), len(self.interner), path
+            )
+        )
+
+    def open_snapshot(
+        self, path: str, kb_path: str = None, check: bool = True
+    ):
+        """Load knowledge base from a snapshot written by ``compile``
+
+        Arrays are memory-mapped read-only, and shared with any process
+        opening the same snapshot: case records, postings, bounds, lengths
+        and weights are views of them, read as they are by reasoning. Score
+        tables are read back as they were compiled, without validation or
+        weighting, so ``self.weights`` stays empty. The knowledge base
+        document is only built from the case records when ``self.kb`` is
+        first used.
+
+        Args:
+            path (str): Snapshot path
+            kb_path (str, optional): Knowledge base the snapshot should be
+                up to date with. Defaults to the one it was compiled from.
+            check (bool, optional): Check the snapshot is not stale.
+                Defaults to True.
+
+        Raises:
+            Exception: Not a snapshot, unsupported version or stale snapshot
+        """
+
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, length = SNAPSHOT_PREFIX.unpack_from(buffer)
+        if magic != SNAPSHOT_MAGIC:
+            raise Exception("{} is not a Knowledge Base snapshot".format(path))
+        if version != SNAPSHOT_VERSION:
+            raise Exception(
+                "Unsupported snapshot version {} in {}".format(version, path)
+            )
+
+        header = json.loads(
+            buffer[SNAPSHOT_PREFIX.size : SNAPSHOT_PREFIX.size + length]
+        )
+        start = -(-(SNAPSHOT_PREFIX.size + length) // 8) * 8
+
+        kb_path = kb_path or header["source"]
+        if check and kb_path is not None:
+            if not os.path.exists(kb_path):
+                _LOGGER.warning(
+                    "Cannot check snapshot, {} not found".format(kb_path)
+                )
+            else:
+                f = open(kb_path)
+                data = f.read()
+                f.close()
+                if digest(data) != header["source_hash"]:
+                    raise Exception(
+                        "Snapshot {} is stale, {} changed".format(path, kb_path)
+                    )
+
+        view = memoryview(buffer)
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            first = start + spec["offset"]
+            last = first + spec["count"] * struct.calcsize(spec["format"])
+            arrays[name] = view[first:last].cast(spec["format"])
+        self.snapshot = arrays
+
+        self.interner = Clue_Interner()
+        for clue in header["clues"]:
+            self.interner.intern(tuple(clue))
+        layouts = [
+            tuple((target_type, tuple(one)) for target_type, one in layout)
+            for layout in header["layouts"]
+        ]
+
+        kinds = len(TARGET_TYPES) + 1
+        self.cases = []
+        for case_idx, meta in enumerate(header["cases"]):
+            first, last = arrays["case_ptr"][case_idx : case_idx + 2]
+            self.cases.append(
+                Case.from_arrays(
+                    meta["chaos_type"],
+                    meta,
+                    arrays["case_ids"][first:last],
+                    arrays["case_orders"][first:last],
+                    tuple(
+                        arrays["case_offsets"][
+                            case_idx * kinds : (case_idx + 1) * kinds
+                        ]
+                    ),
+                    layouts[meta["layout"]],
+                )
+            )
+
+        self.postings = Postings(
+            arrays["posting_ptr"],
+            arrays["posting_cases"],
+            arrays["posting_counts"],
+            arrays["posting_orders"],
+        )
+        self.lengths = {
+            target_type: arrays[target_type + "_lengths"]
+            for target_type in TARGET_TYPES
+        }
+        self.bounds = {
+            bound: arrays["bound_" + bound]
+            for bound in ["ratio", "count", "ordered"]
+        }
+
+        self.types = {}
+        first = 0
+        ptr = iter(arrays["type_ptr"])
+        clue_first = next(ptr)
+        for chaos_type, kb_type in header["types"].items():
+            counts = {}
+            for target_type, clue_last in zip(TARGET_TYPES, ptr):
+                counts[target_type] = Counter(
+                    dict(
+                        zip(
+                            arrays["type_clues"][clue_first:clue_last],
+                            arrays["type_counts"][clue_first:clue_last],
+                        )
+                    )
+                )
+                clue_first = clue_last
+            last = first + kb_type["cases"]
+            self.types[chaos_type] = {
+                "cases": arrays["type_cases"][first:last],
+                "case_num": kb_type["case_num"],
+                "length": kb_type["length"],
+                "counts": counts,
+            }
+            first = last
+        self.order_experiments()
+
+        self.weight_arrays = {}
+        for score in SCORES:
+            self.weight_arrays[score] = arrays[score]
+            setattr(self, score, Score_Table(self, score))
+
+        self.kb = None
+        self.matrix = None
+        self.weights = {}
+        self.source = header["source"]
+        self.source_hash = header["source_hash"]
+
+    def add_case(self, chaos_type: str, case: dict) -> dict:
+        """Add a case, updating weights and indexes incrementally
+
+        The case is validated, written to the write-ahead log if one is
+        attached, then learnt: the ``Incremental_Weight`` engines behind the
+        score tables get the clues of the case, and the clues of its chaos
+        type replaced, instead of ``score_fingerprint`` weighting the whole
+        knowledge base again, and the case alone is indexed. Loaded
+        knowledge bases only keep their weights by clue id, so the first
+        added case weights the knowledge base once with "incremental" to get
+        the engines, and snapshots are indexed again too. Score tables are
+        normalized again by ``refresh``, once for any number of added cases.
+
+        The knowledge base is modified in place, see ``load``. Reasoning over
+        it from another thread while adding cases is not safe.
+
+        Args:
+            chaos_type (str): Chaos type of the case
+            case (dict): Case in the knowledge base schema, or a confirmed
+                fingerprint, whose groundtruth becomes the experiment
+
+        Raises:
+            SchemaError: Invalid case
+
+        Returns:
+            dict: Added case
+        """
+
+        if "groundtruth" in case:
+            case = {
+                "index": 1
+                + max(
+                    (
+                        idx
+                        for chaos in (self.kb or {}).get(chaos_type, [])
+                        for idx, _ in members(chaos)
+                    ),
+                    default=-1,
+                ),
+                "experiment": case["groundtruth"],
+                "instance_related": False,
+                **({"order": case["order"]} if "order" in case else {}),
+                "anomalies": case["anomalies"],
+            }
+        case = copy.deepcopy(case)
+        validate_kb({chaos_type: [case]})
+
+        if self.log is not None:
+            self.log.write(
+                json.dumps({"chaos_type": chaos_type, "case": case}) + "\n"
+            )
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.log_entries += 1
+
+        self.learn(chaos_type, case)
+
+        if self.compact_every and self.log_entries >= self.compact_every:
+            self.compact()
+
+        return case
+
+    def learn(self, chaos_type: str, case: dict):
+        """Add a valid case to the knowledge base, its weights and indexes
+
+        Args:
+            chaos_type (str): Chaos type of the case
+            case (dict): Case
+        """
+
+        if not all(
+            isinstance(self.weights.get(score), Incremental_Weight)
+            for score in SCORES
+        ):
+            if self.kb:
+                if self.snapshot is not None:
+                    # Mapped arrays are read-only, index the document instead
+                    self.snapshot = None
+                    self.build_index()
+                self.score_fingerprint("incremental", keep_weights=True)
+            else:
+                self.kb = {}
+                self.index_cases({})
+                self.weights = {score: Incremental_Weight() for score in SCORES}
+
+        cases = self.kb.get(chaos_type, [])
+        anomalies = case["anomalies"]
+        num = multiplicity(case)
+        for _ in range(num):
+            instances = self.analyse(
+                *[
+                    anomalies[target_type] if target_type in anomalies else None
+                    for target_type in TARGET_TYPES
+                ]
+            )
+        self.clear_items()
+
+        touched = set()
+        for target_type, instance in zip(TARGET_TYPES, instances):
+            if not instance:
+                continue
+
+            # Like analyse_fingerprint, every instance also goes to logs
+            for _ in range(num):
+                self.weights[target_type + "_score"].add(instance)
+                self.weights["logs_score"].add(instance)
+            touched.update([target_type + "_score", "logs_score"])
+
+            score = "type_" + target_type + "_score"
+            old = [
+                name
+                for chaos in cases
+                for _ in range(multiplicity(chaos))
+                for name in self.clue_names(chaos["anomalies"].get(target_type))
+            ]
+            if old:
+                self.weights[score].remove(old)
+            self.weights[score].add(old + instance * num)
+            touched.add(score)
+
+        self.kb.setdefault(chaos_type, []).append(case)
+        if chaos_type not in self.types:
+            self.add_type(chaos_type)
+        self.index_case(Case(chaos_type, case, self.interner))
+        self.matrix = None
+        self.stale.update(touched)
+        self.unordered = True
+
+    def attach_log(
+        self,
+        log_path: str,
+        compact_every: int = None,
+        snapshot_path: str = None,
+    ) -> int:
+        """Log added cases ahead of learning them, replaying the log first
+
+        The log is a JSON line file. Its first line holds the hash of the
+        knowledge base file it applies to, and every other line a case added
+        since. A log based on the loaded knowledge base is replayed. A log
+        whose cases ``compact`` already wrote into the loaded knowledge base
+        before being interrupted is started again empty. Any other log
+        applies to another knowledge base, and is refused. A last line cut
+        short by a crash is dropped.
+
+        Args:
+            log_path (str): Write-ahead log path
+            compact_every (int, optional): Compact the log once it holds this
+                many cases. Defaults to None, never.
+            snapshot_path (str, optional): Snapshot compiled on compaction.
+                Defaults to None.
+
+        Raises:
+            Exception: Log of another knowledge base
+
+        Returns:
+            int: Number of replayed cases
+        """
+
+        replayed = 0
+        if os.path.exists(log_path):
+            f = open(log_path)
+            lines = f.read().split("\n")
+            f.close()
+
+            if lines[-1]:
+                _LOGGER.warning(
+                    "Drop unfinished last entry of {}".format(log_path)
+                )
+            lines = lines[:-1]
+
+            header = json.loads(lines[0]) if lines else {}
+            if header.get("base") == self.source_hash:
+                for line in lines[1:]:
+                    entry = json.loads(line)
+                    self.learn(entry["chaos_type"], entry["case"])
+                    replayed += 1
+                _LOGGER.info(
+                    "Replayed {} cases from {}".format(replayed, log_path)
+                )
+            elif header.get("compacted") == self.source_hash:
+                _LOGGER.info(
+                    "{} was already compacted into the loaded Knowledge "
+                    "Base".format(log_path)
+                )
+            elif lines:
+                raise Exception(
+                    "{} is not based on the loaded Knowledge Base".format(
+                        log_path
+                    )
+                )
+
+        self.log_path = log_path
+        self.compact_every = compact_every
+        self.snapshot_path = snapshot_path
+        self.write_log(replayed)
+        self.log_entries = replayed
+
+        return replayed
+
+    def write_log(self, keep: int = 0, compacted: str = None):
+        """Rewrite the write-ahead log on the current knowledge base file
+
+        Args:
+            keep (int, optional): Number of last added cases kept in the log.
+                Defaults to 0.
+            compacted (str, optional): Hash of the knowledge base file the
+                cases are being compacted into, see ``compact``. Defaults to
+                None.
+        """
+
+        if self.log is not None:
+            self.log.close()
+
+        entries = []
+        if keep:
+            f = open(self.log_path)
+            entries = f.read().split("\n")[1:-1][-keep:]
+            f.close()
+
+        header = {"base": self.source_hash}
+        if compacted is not None:
+            header["compacted"] = compacted
+        write_atomic(
+            self.log_path,
+            lambda f: f.write(
+                json.dumps(header)
+                + "\n"
+                + "".join(entry + "\n" for entry in entries)
+            ),
+        )
+
+        self.log = open(self.log_path, "a")
+
+    def compact(self, kb_path: str = None):
+        """Write the knowledge base with its added cases, and empty the log
+
+        The knowledge base file is written aside, the log marked as being
+        compacted into it, then the file is moved in place, the snapshot is
+        compiled if one was given to ``attach_log``, and the log is emptied
+        and based on the new file. Interrupted, the log is either replayed
+        onto the old file or started again on the new one by ``attach_log``.
+
+        Args:
+            kb_path (str, optional): Knowledge base path. Defaults to the
+                loaded one.
+
+        Raises:
+            Exception: No knowledge base file to write
+        """
+
+        kb_path = kb_path or self.source
+        if kb_path is None:
+            raise Exception("No Knowledge Base file to compact into")
+
+        data = yaml.safe_dump(
+            self.kb, default_flow_style=False, sort_keys=False
+        )
+        source_hash = digest(data)
+        if self.log_path is not None:
+            self.write_log(self.log_entries, compacted=source_hash)
+        write_atomic(kb_path, lambda f: f.write(data))
+
+        self.source = os.path.abspath(kb_path)
+        self.source_hash = source_hash
+        if self.snapshot_path is not None:
+            self.compile(self.snapshot_path)
+        if self.log_path is not None:
+            self.write_log()
+        self.log_entries = 0
+
+        _LOGGER.info("Compacted Knowledge Base into {}".format(kb_path))
+
+    def rename(self, fingerprint: Union[dict, None]) -> dict:
+        """Rename clues to "type-index-action", grouped by order
+
+        Args:
+            fingerprint (dict): Clues of one kind, e.g. metrics
+
+        Returns:
+            dict: Renamed clues for each order
+        """
+        rename_instance = dict()
+        if fingerprint is None:
+            return rename_instance
+        types = fingerprint.keys()
+
+        for one in types:
+            for clue in fingerprint[one]:
+                idx = clue["index"]
+                action = clue["action"]
+                order = clue["order"] if "order" in clue else 0
+                clue_name = one + "-" + str(idx) + "-" + str(action)
+                rename_instance.setdefault(order, [])
+                rename_instance[order].append(clue_name)
+        return rename_instance
 
     def analyse(
         self, metrics: list, traces: list, logs: list, cmds: list
@@ -264,6 +1362,30 @@ class KB:
 
         return metrics_instance, traces_instance, logs_instance, cmds_instance
 
+    def clue_names(self, fingerprint: Union[dict, None]) -> list:
+        """Names of clues of one kind, of all orders, in document order
+
+        Args:
+            fingerprint (dict): Clues of one kind, e.g. metrics
+
+        Returns:
+            list: Clue names
+        """
+
+        if fingerprint is None:
+            return []
+
+        types = fingerprint.keys()
+        new_instance = []
+        for one_type in types:
+            for clue in fingerprint[one_type]:
+                idx = clue["index"]
+                action = clue["action"]
+                clue_name = one_type + "-" + str(idx) + "-" + action
+                new_instance.append(clue_name)
+
+        return new_instance
+
     def analyse_fingerprint(
         self, fingerprint: list, target_type: str = ""
     ) -> list:
@@ -281,14 +1403,7 @@ class KB:
             _LOGGER.info("No {} found in Knowledge Base".format(target_type))
             return []
 
-        types = fingerprint.keys()
-        new_instance = []
-        for one_type in types:
-            for clue in fingerprint[one_type]:
-                idx = clue["index"]
-                action = clue["action"]
-                clue_name = one_type + "-" + str(idx) + "-" + action
-                new_instance.append(clue_name)
+        new_instance = self.clue_names(fingerprint)
 
         if new_instance:
             if target_type == "metrics":
@@ -0,0 +1,169 @@
+import os
+import copy
+import datetime
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+_LOGGER = logging.getLogger(__name__)
+
+# Values of parsed YAML that copies can share
+SCALARS = (str, int, float, bool, type(None), datetime.date, datetime.datetime)
+
+
+def copy_tree(document):
+    """Copy a parsed YAML document
+
+    Dicts and lists are copied, immutable scalars shared, which is several
+    times faster than ``copy.deepcopy`` on large documents.
+
+    Args:
+        document (Any): Parsed YAML document
+
+    Returns:
+        Any: Copy, that can be modified without touching the document
+    """
+
+    kind = type(document)
+    if kind is dict:
+        return {key: copy_tree(value) for key, value in document.items()}
+    if kind is list:
+        return [copy_tree(value) for value in document]
+    if kind in SCALARS:
+        return document
+    return copy.deepcopy(document)
+
+
+class YAML_Cache:
+    def __init__(self, maxsize: int = 1024) -> None:
+        """Parsed YAML documents, least recently used evicted first
+
+        Documents are parsed with the libyaml loader when PyYAML was built
+        with it, and keyed by absolute path, modification time and size, so
+        an edited file is parsed again. Files read once, or copied as soon as
+        they are read like knowledge bases, are better read with
+        ``cache=False``, so the cache does not keep a second copy of them.
+
+        Args:
+            maxsize (int, optional): Number of documents kept.
+                Defaults to 1024.
+        """
+
+        self.maxsize = maxsize
+        self.documents = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def read(self, f_path: str, cache: bool = True) -> tuple:
+        """Parse a YAML file, or get it from the cache
+
+        Args:
+            f_path (str): YAML file path
+            cache (bool, optional): Look the file up in the cache, and keep
+                it there. Defaults to True; otherwise the file is parsed
+                again, and the document belongs to the caller.
+
+        Returns:
+            tuple: Document, shared when cached, and SHA-256 hex digest of
+                the file content
+        """
+
+        if cache:
+            stat = os.stat(f_path)
+            key = (os.path.abspath(f_path), stat.st_mtime_ns, stat.st_size)
+
+            with self.lock:
+                if key in self.documents:
+                    self.hits += 1
+                    self.documents.move_to_end(key)
+                    return self.documents[key]
+                self.misses += 1
+
+        f = open(f_path, encoding="utf-8")
+        data = f.read()
+        f.close()
+        entry = (
+            yaml.load(data, Loader=SafeLoader),
+            hashlib.sha256(data.encode("utf-8")).hexdigest(),
+        )
+        if not cache:
+            return entry
+
+        with self.lock:
+            self.documents[key] = entry
+            while len(self.documents) > self.maxsize:
+                self.documents.popitem(last=False)
+
+        return entry
+
+    def load(
+        self, f_path: str, copy_document: bool = False, cache: bool = True
+    ):
+        """Load a YAML file
+
+        Args:
+            f_path (str): YAML file path
+            copy_document (bool, optional): Return a deep copy, for callers
+                modifying the document. Defaults to False, where the cached
+                document is shared and must not be modified.
+            cache (bool, optional): Go through the cache, see ``read``.
+                Defaults to True; otherwise the document is never shared,
+                nor copied.
+
+        Returns:
+            Any: Document
+        """
+
+        document, _ = self.read(f_path, cache)
+        return copy_tree(document) if copy_document and cache else document
+
+    def stats(self) -> dict:
+        """Hit and miss counts
+
+        Returns:
+            dict: Hits, misses, cached documents and capacity
+        """
+
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.documents),
+                "maxsize": self.maxsize,
+            }
+
+    def clear(self):
+        """Drop every document and reset the counts"""
+
+        with self.lock:
+            self.documents.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Cache shared by every loader of the process
+YAML_CACHE = YAML_Cache()
+
+
+def load_yaml(f_path: str, copy_document: bool = False, cache: bool = True):
+    """Load a YAML file through the shared cache
+
+    Args:
+        f_path (str): YAML file path
+        copy_document (bool, optional): Return a deep copy. Defaults to False.
+        cache (bool, optional): Go through the cache, see
+            ``YAML_Cache.read``. Defaults to True.
+
+    Returns:
+        Any: Document
+    """
+
+    return YAML_CACHE.load(f_path, copy_document, cache)
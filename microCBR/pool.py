@@ -0,0 +1,127 @@
+import gc
+import os
+import logging
+import multiprocessing
+from reasoning import Reasoner
+
+_LOGGER = logging.getLogger(__name__)
+
+# Reasoner of the pool the worker belongs to, set by ``init_worker``
+_REASONER = None
+
+
+def init_worker(reasoner: Reasoner):
+    """Keep the reasoner handed over by the pool, in a new worker
+
+    Under fork the reasoner is inherited with the parent's memory, not
+    pickled. The worker's objects are moved to the permanent generation
+    first, so the garbage collector never touches, and so copies, the pages
+    of the shared knowledge base: this holds for workers the pool respawns
+    later too.
+
+    Args:
+        reasoner (Reasoner): Reasoner of the pool
+    """
+
+    global _REASONER
+
+    gc.freeze()
+    _REASONER = reasoner
+
+
+def reason_one(fingerprint) -> dict:
+    """Reason one fingerprint with the worker's inherited reasoner
+
+    Args:
+        fingerprint (Union[str, dict]): Fingerprint file path or content
+
+    Returns:
+        dict: ``{"case_scores": dict, "type_scores": dict, "kb_hash": str}``
+    """
+
+    result = _REASONER.reason(fingerprint)
+
+    return {
+        "case_scores": dict(result.case_scores),
+        "type_scores": dict(result.type_scores),
+        "kb_hash": result.kb_hash,
+    }
+
+
+class Reasoner_Pool:
+    def __init__(self, kb, processes: int = None, **kwargs) -> None:
+        """Worker processes reasoning over one loaded knowledge base
+
+        The knowledge base and its indexes are built once in the parent and
+        inherited by forked workers, so they are shared copy-on-write and never
+        pickled; only fingerprints and score dicts cross process boundaries.
+        Each pool hands its own reasoner to its workers, so several pools
+        can run at once.
+
+        Args:
+            kb (KB): Loaded knowledge base
+            processes (int, optional): Number of workers. Defaults to the
+                number of CPUs.
+            kwargs: Reasoner options, e.g. use_logs
+        """
+
+        self.kb = kb
+        self.processes = processes or os.cpu_count()
+        self.kwargs = kwargs
+        self.pool = None
+
+    def start(self):
+        """Fork the workers"""
+
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise Exception("Reasoner_Pool needs the fork start method")
+
+        if self.pool is not None:
+            _LOGGER.warning("Reasoner pool is already started")
+            return
+
+        reasoner = Reasoner(self.kb, **self.kwargs)
+
+        # Workers forked now start with a frozen heap, and those the pool
+        # respawns later freeze theirs in init_worker
+        gc.freeze()
+        self.pool = multiprocessing.get_context("fork").Pool(
+            self.processes, initializer=init_worker, initargs=(reasoner,)
+        )
+        gc.unfreeze()
+
+    def reason(self, fingerprints: list, chunksize: int = None) -> list:
+        """Fan fingerprints out across the workers
+
+        Args:
+            fingerprints (list): Fingerprint file paths or contents
+            chunksize (int, optional): Fingerprints sent to a worker at once.
+                Defaults to spreading them evenly, four chunks per worker.
+
+        Returns:
+            list: ``{"case_scores": dict, "type_scores": dict}`` per
+                fingerprint, in order
+        """
+
+        if self.pool is None:
+            self.start()
+
+        if chunksize is None:
+            chunksize = max(1, len(fingerprints) // (self.processes * 4))
+
+        return self.pool.map(reason_one, fingerprints, chunksize)
+
+    def close(self):
+        """Stop the workers"""
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
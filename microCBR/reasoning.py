@@ -1,8 +1,17 @@
+import json
+import hashlib
 import logging
-import yaml
-from schema import Schema, SchemaError, Optional
-from collections import Counter
-from util import weighted_LCS
+import threading
+from loader import YAML_CACHE
+import numpy as np
+from scipy import sparse
+from schema import SchemaError
+from validation import validate_fingerprint
+from collections import Counter, OrderedDict
+from types import MappingProxyType
+from typing import NamedTuple, Mapping, Union
+from util import weighted_LCS, weighted_LCS_bound
+from clue import TARGET_TYPES, Clues, Fingerprint, clue_name
 import heapq
 from difflib import SequenceMatcher
 
@@ -10,6 +19,91 @@ _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.DEBUG)
 
 
+# Compiled detail tables by content digest, least recently used evicted first
+_DETAILS_CACHE = OrderedDict()
+_DETAILS_CACHE_SIZE = 16
+_DETAILS_LOCK = threading.Lock()
+
+
+def compile_details(details: dict, digest: str = None) -> dict:
+    """Compile a CMD or LOG detail table for similarity lookups
+
+    Every query is split into a token tuple once, and the similarity of every
+    ordered pair of queries of a category, the longest common block of tokens
+    over the longer query, is computed up front. The latest compiled tables
+    are cached by content digest, so reloading the same table costs no
+    recompilation.
+
+    Args:
+        details (dict): Detail table, e.g. loaded from LOG.yaml
+        digest (str, optional): Digest of the table content, e.g. from
+            ``YAML_CACHE.read``. Defaults to a hash of the table.
+
+    Returns:
+        dict: ``{category: {"tokens": {index: tuple},
+            "similarity": {index: {index: float}}}}``
+    """
+
+    if digest is None:
+        digest = hashlib.sha256(
+            json.dumps(details, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+    with _DETAILS_LOCK:
+        if digest in _DETAILS_CACHE:
+            _DETAILS_CACHE.move_to_end(digest)
+            return _DETAILS_CACHE[digest]
+
+    compiled = {}
+    for key, queries in details.items():
+        tokens = {}
+        for detail in queries:
+            # The first query of an index wins, as in a linear scan
+            tokens.setdefault(
+                detail["index"], tuple(detail["query"].split(" "))
+            )
+
+        similarity = {}
+        for f_index, f_tokens in tokens.items():
+            similarity[f_index] = {}
+            for c_index, c_tokens in tokens.items():
+                size = (
+                    SequenceMatcher(None, f_tokens, c_tokens)
+                    .find_longest_match(0, len(f_tokens), 0, len(c_tokens))
+                    .size
+                )
+                similarity[f_index][c_index] = size / max(
+                    len(f_tokens), len(c_tokens)
+                )
+
+        compiled[key] = {"tokens": tokens, "similarity": similarity}
+
+    with _DETAILS_LOCK:
+        _DETAILS_CACHE[digest] = compiled
+        while len(_DETAILS_CACHE) > _DETAILS_CACHE_SIZE:
+            _DETAILS_CACHE.popitem(last=False)
+
+    return compiled
+
+
+class Reasoning_Result(NamedTuple):
+    """Immutable result of ``Reasoner.reason``
+
+    Attributes:
+        case_scores (Mapping): Score of every experiment
+        type_scores (Mapping): Score of every chaos type
+        matched (Mapping): Fingerprint clues found in the knowledge base, for
+            each kind of clue
+        groundtruth (str): Groundtruth of the fingerprint, if any
+        kb_hash (str): Hash of the knowledge base it was scored against
+    """
+
+    case_scores: Mapping[str, float]
+    type_scores: Mapping[str, float]
+    matched: Mapping[str, tuple]
+    groundtruth: Union[str, None]
+    kb_hash: Union[str, None]
+
+
 class Reasoner:
     def __init__(
         self,
@@ -18,6 +112,9 @@ class Reasoner:
         use_traces=True,
         use_cmds=True,
         use_logs=True,
+        lcs_kernel="dp",
+        use_details_sim=True,
+        validate_once=False,
     ) -> None:
         self.kb = kb
         self.fingerprint = None
@@ -33,6 +130,15 @@ class Reasoner:
         self.use_cmds = use_cmds
         self.use_logs = use_logs
 
+        # Ordered metrics kernel, "dp" or "bitparallel"
+        self.lcs_kernel = lcs_kernel
+
+        # Score chaos types by log and cmd query similarity of their cases
+        self.use_details_sim = use_details_sim
+
+        # Skip validating fingerprint files whose content was validated
+        self.validate_once = validate_once
+
         self.score = 0
 
         self.type_scores = {}
@@ -40,6 +146,8 @@ class Reasoner:
 
         self.cmds_detail = {}
         self.logs_detail = {}
+        self.cmds_index = {}
+        self.logs_index = {}
 
     def load_fingerprint(
         self, f_path: str, cmds_f_path="./CMD.yaml", logs_f_path="./LOG.yaml"
@@ -56,98 +164,103 @@ class Reasoner:
             bool: Success loaded
         """
 
-        if type(f_path) is str:
-            f = open(f_path)
-            fingerprint = f.read()
-            f.close()
-            self.fingerprint = yaml.safe_load(fingerprint)
-        elif type(f_path) is dict:
-            self.fingerprint = f_path
-
-        f = open(cmds_f_path)
-        self.cmds_detail = yaml.safe_load(f.read())
-        f.close()
-
-        f = open(logs_f_path)
-        self.logs_detail = yaml.safe_load(f.read())
-        f.close()
-
-        anomaly_schema = [{"index": int, "action": str, Optional("order"): int}]
-        custom_metrics_schema = {
-            Optional("network"): anomaly_schema,
-            Optional("cpu"): anomaly_schema,
-            Optional("memory"): anomaly_schema,
-            Optional("io"): anomaly_schema,
-            Optional("container"): anomaly_schema,
-            Optional("mongo"): anomaly_schema,
-            Optional("mysql"): anomaly_schema,
-            Optional("icmp"): anomaly_schema,
-            Optional("time"): anomaly_schema,
-            Optional("jvm"): anomaly_schema,
-            Optional("http"): anomaly_schema,
-        }
+        parsed = self.parse_fingerprint(f_path)
+        self.fingerprint = parsed["fingerprint"]
 
-        custom_traces_schema = {
-            Optional("onehop"): anomaly_schema,
-        }
+        self.cmds_detail, cmds_digest = YAML_CACHE.read(cmds_f_path)
+        self.logs_detail, logs_digest = YAML_CACHE.read(logs_f_path)
 
-        custom_logs_schema = {
-            Optional("pod"): anomaly_schema,
-        }
+        self.cmds_index = compile_details(self.cmds_detail, cmds_digest)
+        self.logs_index = compile_details(self.logs_detail, logs_digest)
 
-        custom_cmds_schema = {
-            Optional("config"): anomaly_schema,
-            Optional("exec"): anomaly_schema,
-        }
+        if parsed["order"] is True:
+            self.metrics_order = True
 
-        custom_schema = Schema(
-            {
-                "groundtruth": str,
-                Optional("order"): bool,
-                "anomalies": {
-                    Optional("metrics"): custom_metrics_schema,
-                    Optional("traces"): custom_traces_schema,
-                    Optional("logs"): custom_logs_schema,
-                    Optional("cmds"): custom_cmds_schema,
-                },
-            }
-        )
+        self.f_metrics = parsed["metrics"]
+        self.f_traces = parsed["traces"]
+        self.f_cmds = parsed["cmds"]
+        self.f_logs = parsed["logs"]
+
+        self.ground_truth = parsed["groundtruth"]
+
+        return True
+
+    def parse_fingerprint(self, f_path: Union[str, dict]) -> dict:
+        """Validate a fingerprint and rename its clues, without loading it
+
+        Args:
+            f_path (Union[str, dict]): Fingerprint file path or content
+
+        Raises:
+            se: Fingerprint yaml file config error
+
+        Returns:
+            dict: Renamed metrics, traces, logs and cmds, with the order flag
+                and groundtruth
+        """
+
+        fingerprint = None
+        digest = None
+        if type(f_path) is str:
+            fingerprint, digest = YAML_CACHE.read(f_path)
+        elif type(f_path) is dict:
+            fingerprint = f_path
 
         try:
-            custom_schema.validate(self.fingerprint)
+            validate_fingerprint(
+                fingerprint, digest if self.validate_once else None
+            )
             _LOGGER.info("Configuration is valid.")
         except SchemaError as se:
             raise se
 
-        anomalies = self.fingerprint["anomalies"]
-
-        if "order" in self.fingerprint and self.fingerprint["order"] is True:
-            self.metrics_order = self.fingerprint["order"]
+        anomalies = fingerprint["anomalies"]
+        self.kb.refresh()
+
+        return {
+            "fingerprint": fingerprint,
+            "record": Fingerprint(fingerprint, self.kb.interner),
+            "order": "order" in fingerprint and fingerprint["order"] is True,
+            "metrics": self.rename(
+                anomalies["metrics"] if "metrics" in anomalies else None
+            ),
+            "traces": self.rename(
+                anomalies["traces"] if "traces" in anomalies else None
+            ),
+            "logs": self.rename(
+                anomalies["logs"] if "logs" in anomalies else None
+            ),
+            "cmds": self.rename(
+                anomalies["cmds"] if "cmds" in anomalies else None
+            ),
+            "groundtruth": (
+                fingerprint["groundtruth"]
+                if "groundtruth" in fingerprint
+                else None
+            ),
+        }
 
-        self.f_metrics = (
-            anomalies["metrics"] if "metrics" in anomalies else None
-        )
-        self.f_traces = anomalies["traces"] if "traces" in anomalies else None
-        self.f_logs = anomalies["logs"] if "logs" in anomalies else None
-        self.f_cmds = anomalies["cmds"] if "cmds" in anomalies else None
+    def reasoning(self, top_types=None):
+        """Score chaos types and cases against the loaded fingerprint
 
-        if self.metrics_order is True:
-            self.f_metrics = self.rename(self.f_metrics, order=True)
-        else:
-            self.f_metrics = self.rename(self.f_metrics, order=False)
-        self.f_traces = self.rename(self.f_traces)
-        self.f_cmds = self.rename(self.f_cmds)
-        self.f_logs = self.rename(self.f_logs)
-
-        self.ground_truth = (
-            self.fingerprint["groundtruth"]
-            if "groundtruth" in self.fingerprint
-            else None
-        )
+        With ``top_types``, chaos types are ranked first and only the cases
+        of the ``top_types`` best ones are scored, so ``case_scores`` then
+        only holds the experiments of those types. Otherwise, with
+        ``use_details_sim``, chaos types are then scored by the similarity of
+        their best cases, log and cmd queries compared by content.
 
-        return True
+        Args:
+            top_types (int, optional): Number of chaos types whose cases are
+                scored. Defaults to None, scoring every case.
+        """
 
-    def reasoning(self):
+        if top_types is not None:
+            self.analyse_type_by_fingerprint()
+            best_types = heapq.nlargest(
+                top_types, self.type_scores, key=self.type_scores.get
+            )
+            self.analyse_case(chaos_types=best_types)
+            return
 
         # For one fault fingerprint
         self.analyse_case()
@@ -159,137 +272,281 @@ class Reasoner:
         # self.analyse_type_by_case()
 
         # For fault type using partial fingerprint similarity
+        if self.use_details_sim:
+            self.analyse_type_by_case_sim()
+
+    def reason(self, fingerprint, top_types=None) -> Reasoning_Result:
+        """Reason one fingerprint without touching the reasoner's state
+
+        Unlike ``load_fingerprint`` and ``reasoning``, nothing is stored on
+        the reasoner, so one instance bound to a knowledge base can serve
+        concurrent requests from threads or coroutines. Chaos types are
+        scored by fingerprint, as by ``reasoning`` without
+        ``use_details_sim``.
+
+        Args:
+            fingerprint (Union[str, dict]): Fingerprint file path or content
+            top_types (int, optional): Number of chaos types whose cases are
+                scored, as in ``reasoning``. Defaults to None, scoring every
+                case.
+
+        Returns:
+            Reasoning_Result: Case scores, type scores and matched clues
+        """
+
+        fingerprint = self.parse_fingerprint(fingerprint)
+
+        type_scores = self.score_types(fingerprint)
+        chaos_types = None
+        if top_types is not None:
+            chaos_types = heapq.nlargest(
+                top_types, type_scores, key=type_scores.get
+            )
+        case_scores = self.score_cases(fingerprint, chaos_types)
+
+        return Reasoning_Result(
+            case_scores=MappingProxyType(case_scores),
+            type_scores=MappingProxyType(type_scores),
+            matched=MappingProxyType(self.matched_clues(fingerprint)),
+            groundtruth=fingerprint["groundtruth"],
+            kb_hash=self.kb.source_hash,
+        )
+
+    def in_use(self) -> list:
+        """Kinds of clue the reasoner scores
+
+        Returns:
+            list: Kinds of clue, in ``TARGET_TYPES`` order
+        """
+
+        return [
+            target_type
+            for target_type in TARGET_TYPES
+            if getattr(self, "use_" + target_type)
+        ]
+
+    def matched_clues(self, fingerprint: dict) -> dict:
+        """Fingerprint clues found in the knowledge base
+
+        Args:
+            fingerprint (dict): Fingerprint from ``parse_fingerprint``
+
+        Returns:
+            dict: Matched clues for each kind of clue in use
+        """
+
+        record = fingerprint["record"]
+        matched = {}
+        for target_type in self.in_use():
+            matched[target_type] = tuple(
+                dict.fromkeys(
+                    self.kb.interner.name(clue_id)
+                    for clues in record.by_order(target_type).values()
+                    for clue_id in clues
+                    if clue_id >= 0
+                )
+            )
+
+        return matched
+
+    def reason_many(self, fingerprints: list) -> list:
+        """Reason over a batch of fingerprints with sparse matrix products
+
+        The knowledge base is encoded once by ``KB.build_matrix``, then every
+        kind of clue costs one sparse product per hierarchy for the whole
+        batch. Ordered metrics are still scored by weighted LCS, on the cases
+        sharing a clue with them. Scores match ``reasoning`` up to float
+        rounding.
+
+        Args:
+            fingerprints (list): Fingerprint file paths or contents
 
-        # self.analyse_type_by_case_sim()
+        Returns:
+            list: ``{"case_scores": dict, "type_scores": dict, "kb_hash":
+                str}`` per fingerprint
+        """
+
+        if self.kb.matrix is None:
+            self.kb.build_matrix()
+
+        parsed = [self.parse_fingerprint(f) for f in fingerprints]
+        case_scores = np.zeros((len(self.kb.cases), len(parsed)))
+        type_scores = np.zeros((len(self.kb.types), len(parsed)))
+
+        for target_type in self.in_use():
+            for hierarchy, scores in [
+                ("case", case_scores),
+                ("type", type_scores),
+            ]:
+                encoded = self.kb.matrix[hierarchy][target_type]
+
+                # One column of clue counts per fingerprint
+                data, indices, indptr, length = [], [], [0], []
+                for one in parsed:
+                    clues = one["record"].clues(target_type)
+                    if (
+                        target_type == "metrics"
+                        and hierarchy == "case"
+                        and one["order"]
+                    ):
+                        # Scored by weighted LCS below
+                        clues = []
+                    for clue_id, count in Counter(clues).items():
+                        if clue_id >= 0:
+                            indices.append(clue_id)
+                            data.append(count)
+                    indptr.append(len(indices))
+                    length.append(len(clues))
+
+                f_matrix = sparse.csc_matrix(
+                    (data, indices, indptr),
+                    shape=(len(self.kb.interner), len(parsed)),
+                )
+                weighted = (encoded["matrix"] @ f_matrix).toarray()
+                denominator = np.maximum(
+                    encoded["length"][:, None], np.array(length)[None, :]
+                )
+                scores += np.divide(
+                    weighted,
+                    denominator,
+                    out=np.zeros_like(weighted),
+                    where=denominator > 0,
+                )
+
+        if self.use_metrics:
+            for col, one in enumerate(parsed):
+                if not one["order"] or not one["metrics"]:
+                    continue
+                f_metrics = self.ordered_metrics(one["record"])
+                for case_idx in self.candidate_cases(one, ["metrics"]):
+                    case_scores[case_idx, col] += self.order_similarity(
+                        f_metrics, self.ordered_metrics(self.kb.cases[case_idx])
+                    )
+
+        type_scores /= self.kb.matrix["case_num"][:, None]
+
+        winners = list(self.kb.experiments.values())
+        chaos_types = list(self.kb.types)
+        results = []
+        for col in range(len(parsed)):
+            results.append(
+                {
+                    "case_scores": dict(
+                        zip(
+                            self.kb.experiments,
+                            case_scores[winners, col].tolist(),
+                        )
+                    ),
+                    "type_scores": dict(
+                        zip(chaos_types, type_scores[:, col].tolist())
+                    ),
+                    "kb_hash": self.kb.source_hash,
+                }
+            )
+
+        return results
 
     def analyse_type_by_case_sim(self):
 
-        kb_case_types = self.kb.kb.keys()
+        interner = self.kb.interner
+        record = Fingerprint(self.fingerprint, interner)
 
         type_scores = dict()
         self.target_case_score = 0
 
-        def update_score_equal_match(case, scores, fingerprint):
-            case = case[0] if case else []
+        def update_score_equal_match(case, weights, target_type):
+            case = case.clues(target_type)
+            fingerprint = record.clues(target_type)
             counter = Counter(case)
-            for item in fingerprint[0]:
-                if item in case:
-                    weight = scores[item]
+            for item in fingerprint:
+                if item in counter:
+                    weight = weights[item]
                     # global score
                     self.target_case_score += (
                         weight
                         * counter[item]
-                        / max(len(case), len(fingerprint[0]))
+                        / max(len(case), len(fingerprint))
                     )
 
-        def update_score_sim_match(case, scores, fingerprint, type_="logs"):
+        def update_score_sim_match(case, weights, fingerprint, type_="logs"):
 
             if type_ == "logs":
-                details = self.logs_detail
+                details = self.logs_index
             elif type_ == "cmds":
-                details = self.cmds_detail
+                details = self.cmds_index
+
+            # Case clues of all orders, by category
+            clues = {}
+            for clue_id in case.clues(type_, order=None):
+                clues.setdefault(interner.clues[clue_id][1], []).append(clue_id)
+
+            length = max(
+                sum([len(x) for x in clues.values()]),
+                sum([len(x) for x in fingerprint.values()]),
+            )
 
             keys = fingerprint.keys()
             for key in keys:
+                # Queries missing from the detail table are like no other
+                if key not in clues or key not in details:
+                    continue
+                similarity = details[key]["similarity"]
                 for f in fingerprint[key]:
-                    for deatil in details[key]:
-                        if f["index"] == deatil["index"]:
-                            f_details = deatil["query"]
-                            break
+                    f_similarity = similarity.get(f["index"], {})
 
                     max_c_score = 0
 
-                    if key not in case:
-                        key
-                        continue
-                    for c in case[key]:
-                        for detail in details[key]:
-                            if c["index"] == detail["index"]:
-                                c_detailts = detail["query"]
-                                break
-
-                        f_split_detail = f_details.split(" ")
-                        c_split_detail = c_detailts.split(" ")
-                        s = SequenceMatcher(
-                            None, f_split_detail, c_split_detail
-                        )
-                        size = s.find_longest_match(
-                            0, len(f_split_detail), 0, len(c_split_detail)
-                        ).size
-
-                        score = size / max(
-                            len(f_split_detail), len(c_split_detail)
-                        )
+                    for clue_id in clues[key]:
+                        weight = weights[clue_id]
 
-                        name = (
-                            key + "-" + str(c["index"]) + "-" + str(c["action"])
+                        score = (
+                            f_similarity.get(interner.clues[clue_id][2], 0)
+                            * weight
                         )
-                        weight = scores[name]
-
-                        score = score * weight
 
                         if score > max_c_score:
                             max_c_score = score
 
-                    self.target_case_score += score / max(
-                        sum([len(x) for x in case.values()]),
-                        sum([len(x) for x in fingerprint.values()]),
-                    )
+                    self.target_case_score += max_c_score / length
 
-        for kb_case_type in kb_case_types:
+        weights = self.kb.weight_arrays
+        f_logs = (
+            self.fingerprint["anomalies"]["logs"]
+            if "logs" in self.fingerprint["anomalies"]
+            else None
+        )
+        f_cmds = (
+            self.fingerprint["anomalies"]["cmds"]
+            if "cmds" in self.fingerprint["anomalies"]
+            else None
+        )
+
+        for kb_case_type, kb_type in self.kb.types.items():
 
             type_scores.setdefault(kb_case_type, {})
-            for kb_case in self.kb.kb[kb_case_type]:
+            for case_idx in kb_type["cases"]:
                 self.target_case_score = 0
-                experiment = kb_case["experiment"]
-
-                kb_anomalies = kb_case["anomalies"]
-
-                kb_metrics = (
-                    kb_anomalies["metrics"]
-                    if "metrics" in kb_anomalies
-                    else None
-                )
-                kb_traces = (
-                    kb_anomalies["traces"] if "traces" in kb_anomalies else None
-                )
-                kb_logs = (
-                    kb_anomalies["logs"] if "logs" in kb_anomalies else None
-                )
-                kb_cmds = (
-                    kb_anomalies["cmds"] if "cmds" in kb_anomalies else None
-                )
-
-                kb_metrics = self.rename(kb_metrics)
-                kb_traces = self.rename(kb_traces)
+                kb_case = self.kb.cases[case_idx]
 
                 update_score_equal_match(
-                    kb_metrics, self.kb.type_metrics_score, self.f_metrics
+                    kb_case, weights["type_metrics_score"], "metrics"
                 ) if self.f_metrics and self.use_metrics else None
                 update_score_equal_match(
-                    kb_traces, self.kb.type_traces_score, self.f_traces
+                    kb_case, weights["type_traces_score"], "traces"
                 ) if self.f_traces and self.use_traces else None
 
-                f_logs = (
-                    self.fingerprint["anomalies"]["logs"]
-                    if "logs" in self.fingerprint["anomalies"]
-                    else None
-                )
-                f_cmds = (
-                    self.fingerprint["anomalies"]["cmds"]
-                    if "cmds" in self.fingerprint["anomalies"]
-                    else None
-                )
-
                 update_score_sim_match(
-                    kb_logs, self.kb.type_logs_score, f_logs, type_="logs"
-                ) if f_logs and self.use_logs and kb_logs else None
+                    kb_case, weights["type_logs_score"], f_logs, type_="logs"
+                ) if f_logs and self.use_logs else None
 
                 update_score_sim_match(
-                    kb_cmds, self.kb.type_cmds_score, f_cmds, type_="cmds"
-                ) if f_cmds and self.use_cmds and kb_cmds else None
+                    kb_case, weights["type_cmds_score"], f_cmds, type_="cmds"
+                ) if f_cmds and self.use_cmds else None
 
-                type_scores[kb_case_type][experiment] = self.target_case_score
+                for _, experiment in kb_case.members():
+                    type_scores[kb_case_type][experiment] = (
+                        self.target_case_score
+                    )
 
         for key, value in type_scores.items():
             top3_case = heapq.nlargest(3, value, key=value.get)
@@ -297,21 +554,21 @@ class Reasoner:
             for item in top3_case:
                 top_score += value[item]
 
-            self.type_scores[key] = top_score / len(top3_case)
+            self.type_scores[key] = (
+                top_score / len(top3_case) if top3_case else 0.0
+            )
 
     def analyse_type_by_case(self):
 
-        kb_case_types = self.kb.kb.keys()
-
         type_scores = dict()
 
-        for kb_case_type in kb_case_types:
+        for kb_case_type, kb_type in self.kb.types.items():
             type_scores.setdefault(kb_case_type, {})
-            for kb_case in self.kb.kb[kb_case_type]:
-                experiment = kb_case["experiment"]
-                type_scores[kb_case_type][experiment] = self.case_scores[
-                    experiment
-                ]
+            for case_idx in kb_type["cases"]:
+                for _, experiment in self.kb.cases[case_idx].members():
+                    type_scores[kb_case_type][experiment] = self.case_scores[
+                        experiment
+                    ]
 
         for key, value in type_scores.items():
             top3_case = heapq.nlargest(3, value, key=value.get)
@@ -323,190 +580,555 @@ class Reasoner:
 
     def analyse_type_by_fingerprint(self):
 
-        kb_case_types = self.kb.kb.keys()
+        self.type_scores.update(self.score_types(self.loaded()))
 
-        for kb_case_type in kb_case_types:
+    def score_types(self, fingerprint: dict) -> dict:
+        """Score every chaos type against a parsed fingerprint
 
-            kb_type_metrics = {0: []}
-            kb_type_traces = {0: []}
-            kb_type_logs = {0: []}
-            kb_type_cmds = {0: []}
-            for kb_case in self.kb.kb[kb_case_type]:
-                kb_anomalies = kb_case["anomalies"]
+        Args:
+            fingerprint (dict): Fingerprint from ``parse_fingerprint``
 
-                kb_metrics = (
-                    kb_anomalies["metrics"]
-                    if "metrics" in kb_anomalies
-                    else None
-                )
-                kb_traces = (
-                    kb_anomalies["traces"] if "traces" in kb_anomalies else None
-                )
-                kb_logs = (
-                    kb_anomalies["logs"] if "logs" in kb_anomalies else None
-                )
-                kb_cmds = (
-                    kb_anomalies["cmds"] if "cmds" in kb_anomalies else None
-                )
+        Returns:
+            dict: Score of every chaos type
+        """
 
-                kb_rename_metrics = self.rename(kb_metrics)
-                kb_rename_traces = self.rename(kb_traces)
-                kb_rename_logs = self.rename(kb_logs)
-                kb_rename_cmds = self.rename(kb_cmds)
-
-                kb_type_metrics[0].extend(
-                    kb_rename_metrics[0]
-                ) if kb_rename_metrics else None
-
-                kb_type_traces[0].extend(
-                    kb_rename_traces[0]
-                ) if kb_rename_traces else None
-                kb_type_logs[0].extend(
-                    kb_rename_logs[0]
-                ) if kb_rename_logs else None
-                kb_type_cmds[0].extend(
-                    kb_rename_cmds[0]
-                ) if kb_rename_cmds else None
-
-            case_num = len(self.kb.kb[kb_case_type])
-            self.cal_similarity(
-                kb_type_metrics,
-                kb_type_traces,
-                kb_type_logs,
-                kb_type_cmds,
-                case_num,
+        record = fingerprint["record"]
+        kinds = [
+            (
+                target_type,
+                self.kb.weight_arrays["type_" + target_type + "_score"],
+                record.clues(target_type),
             )
-            self.type_scores[kb_case_type] = self.score
+            for target_type in self.in_use()
+            if fingerprint[target_type]
+        ]
+        type_scores = {}
+
+        for kb_case_type, kb_type in self.kb.types.items():
+            score = 0
+
+            for target_type, weights, clues in kinds:
+                counter = kb_type["counts"][target_type]
+                length = max(kb_type["length"][target_type], len(clues))
+                for item in clues:
+                    if item in counter:
+                        score += weights[item] * counter[item] / length
+
+            type_scores[kb_case_type] = score / kb_type["case_num"]
+
+        return type_scores
 
     def cal_similarity(
         self, metrics, traces, logs, cmds, case_num=1, hierarchy="type"
     ):
 
-        self.score = 0
+        self.score = self.similarity(
+            self.loaded(), metrics, traces, logs, cmds, case_num, hierarchy
+        )
+
+        return self.score
+
+    def similarity(
+        self,
+        fingerprint: dict,
+        metrics: dict,
+        traces: dict,
+        logs: dict,
+        cmds: dict,
+        case_num=1,
+        hierarchy="type",
+    ) -> float:
+        """Similarity of a parsed fingerprint and renamed case clues
+
+        Args:
+            fingerprint (dict): Fingerprint from ``parse_fingerprint``
+            metrics (dict): Renamed metrics of the case or chaos type
+            traces (dict): Renamed traces of the case or chaos type
+            logs (dict): Renamed logs of the case or chaos type
+            cmds (dict): Renamed cmds of the case or chaos type
+            case_num (int, optional): Number of cases. Defaults to 1.
+            hierarchy (str, optional): "case" or "type". Defaults to "type".
+
+        Returns:
+            float: Similarity score
+        """
+
+        score = 0
 
         def update_score(case, scores, fingerprint):
+            nonlocal score
 
             case = case[0] if case else []
             counter = Counter(case)
+            clues = fingerprint[0] if 0 in fingerprint else []
 
-            for item in fingerprint[0]:
+            for item in clues:
                 if item in case:
                     weight = scores[item]
                     # global score
-                    self.score += (
-                        weight
-                        * counter[item]
-                        / max(len(case), len(fingerprint[0]))
+                    score += (
+                        weight * counter[item] / max(len(case), len(clues))
                     )
 
+        f_metrics = fingerprint["metrics"]
+        f_traces = fingerprint["traces"]
+        f_logs = fingerprint["logs"]
+        f_cmds = fingerprint["cmds"]
+
         if hierarchy == "type":
             update_score(
-                metrics, self.kb.type_metrics_score, self.f_metrics
-            ) if self.f_metrics and self.use_metrics else None
+                metrics, self.kb.type_metrics_score, f_metrics
+            ) if f_metrics and self.use_metrics else None
             update_score(
-                traces, self.kb.type_traces_score, self.f_traces
-            ) if self.f_traces and self.use_traces else None
+                traces, self.kb.type_traces_score, f_traces
+            ) if f_traces and self.use_traces else None
             update_score(
-                logs, self.kb.type_logs_score, self.f_logs
-            ) if self.f_logs and self.use_logs else None
+                logs, self.kb.type_logs_score, f_logs
+            ) if f_logs and self.use_logs else None
             update_score(
-                cmds, self.kb.type_cmds_score, self.f_cmds
-            ) if self.f_cmds and self.use_cmds else None
+                cmds, self.kb.type_cmds_score, f_cmds
+            ) if f_cmds and self.use_cmds else None
 
         if hierarchy == "case":
 
-            if self.f_metrics and self.metrics_order and self.use_metrics:
-                # TODO: finish this temporal code
-                f_metrics_reorder = [
-                    i
-                    for item in dict(sorted(self.f_metrics.items())).values()
-                    for i in sorted(item)
-                ]
-
-                case_metrics_reorder = [
-                    i
-                    for item in dict(sorted(metrics.items())).values()
-                    for i in sorted(item)
-                ]
-
-                metrics = weighted_LCS(
-                    f_metrics_reorder,
-                    case_metrics_reorder,
+            if f_metrics and fingerprint["order"] and self.use_metrics:
+                score += self.order_similarity(
+                    self.reorder(f_metrics),
+                    self.reorder(metrics),
                     self.kb.metrics_score,
                 )
-
-                for item in metrics:
-                    weight = self.kb.metrics_score[item]
-                    self.score += weight / max(
-                        len(f_metrics_reorder), len(case_metrics_reorder)
-                    )
-            elif self.f_metrics and self.use_metrics:
-                update_score(metrics, self.kb.metrics_score, self.f_metrics)
+            elif f_metrics and self.use_metrics:
+                update_score(metrics, self.kb.metrics_score, f_metrics)
 
             update_score(
-                traces, self.kb.traces_score, self.f_traces
-            ) if self.f_traces and self.use_traces else None
+                traces, self.kb.traces_score, f_traces
+            ) if f_traces and self.use_traces else None
             update_score(
-                logs, self.kb.logs_score, self.f_logs
-            ) if self.f_logs and self.use_logs else None
+                logs, self.kb.logs_score, f_logs
+            ) if f_logs and self.use_logs else None
             update_score(
-                cmds, self.kb.cmds_score, self.f_cmds
-            ) if self.f_cmds and self.use_cmds else None
+                cmds, self.kb.cmds_score, f_cmds
+            ) if f_cmds and self.use_cmds else None
 
-        self.score /= case_num
+        return score / case_num
 
-        return self.score
+    def case_similarity(self, fingerprint: dict, case_idx: int) -> float:
+        """Similarity of a parsed fingerprint and a knowledge base case
+
+        The same as ``similarity`` with the "case" hierarchy, from the clue
+        ids of the case record and the weights by clue id.
+
+        Args:
+            fingerprint (dict): Fingerprint from ``parse_fingerprint``
+            case_idx (int): Case index in ``self.kb.cases``
+
+        Returns:
+            float: Similarity score
+        """
+
+        record = fingerprint["record"]
+        case = self.kb.cases[case_idx]
+        score = 0
+
+        for target_type in self.in_use():
+            if not fingerprint[target_type]:
+                continue
+
+            if target_type == "metrics" and fingerprint["order"]:
+                score += self.order_similarity(
+                    self.ordered_metrics(record), self.ordered_metrics(case)
+                )
+                continue
+
+            weights = self.kb.weight_arrays[target_type + "_score"]
+            case_clues = case.clues(target_type)
+            counter = Counter(case_clues)
+            clues = record.clues(target_type)
+            for item in clues:
+                if item in counter:
+                    score += (
+                        weights[item]
+                        * counter[item]
+                        / max(len(case_clues), len(clues))
+                    )
+
+        return score
+
+    def order_similarity(
+        self, f_metrics: list, metrics: list, weights=None
+    ) -> float:
+        """Similarity of ordered metrics by weighted LCS
+
+        Args:
+            f_metrics (list): Fingerprint metrics, from ``ordered_metrics``
+            metrics (list): Case metrics, from ``ordered_metrics``
+            weights (optional): Weight of every clue. Defaults to the metrics
+                weights by clue id; metrics flattened by ``reorder`` need
+                ``KB.metrics_score``.
+
+        Returns:
+            float: Metrics score of the case
+        """
+
+        if weights is None:
+            weights = self.kb.weight_arrays["metrics_score"]
+
+        # TODO: finish this temporal code
+        length = max(len(f_metrics), len(metrics))
+
+        if self.lcs_kernel == "bitparallel":
+            bound, is_exact = weighted_LCS_bound(f_metrics, metrics, weights)
+            if is_exact:
+                return bound / length
+
+        score = weighted_LCS(f_metrics, metrics, weights)
+
+        return score / length
+
+    def reorder(self, metrics: dict) -> list:
+        """Flatten renamed metrics by order, sorted within each order
+
+        Args:
+            metrics (dict): Renamed metrics
+
+        Returns:
+            list: Ordered metrics
+        """
+
+        return [
+            i
+            for item in dict(sorted(metrics.items())).values()
+            for i in sorted(item)
+        ]
+
+    def ordered_metrics(self, record: Clues) -> list:
+        """Metric clue ids of a record, flattened as ``reorder`` does
+
+        Args:
+            record (Clues): Case or fingerprint record
+
+        Returns:
+            list: Clue ids by order, sorted by clue name within each order
+        """
+
+        def name(clue_id):
+            return clue_name(record.key(clue_id, self.kb.interner))
+
+        groups = record.by_order("metrics")
+        return [
+            clue_id
+            for order in sorted(groups)
+            for clue_id in sorted(groups[order], key=name)
+        ]
 
     def rename(self, fingerprint, order=False):
-        rename_instance = dict()
+        return self.kb.rename(fingerprint)
+
+    def loaded(self) -> dict:
+        """The loaded fingerprint, in the form of ``parse_fingerprint``
+
+        Returns:
+            dict: Loaded fingerprint
+        """
+
+        self.kb.refresh()
+        return {
+            "fingerprint": self.fingerprint,
+            "record": Fingerprint(self.fingerprint, self.kb.interner),
+            "order": self.metrics_order,
+            "metrics": self.f_metrics or {},
+            "traces": self.f_traces or {},
+            "logs": self.f_logs or {},
+            "cmds": self.f_cmds or {},
+            "groundtruth": self.ground_truth,
+        }
+
+    def candidate_cases(self, fingerprint: dict = None, kinds=None) -> set:
+        """Find cases sharing at least one scored clue with the fingerprint
+
+        Args:
+            fingerprint (dict, optional): Fingerprint from
+                ``parse_fingerprint``. Defaults to the loaded one.
+            kinds (list, optional): Kinds of clue to look up. Defaults to
+                those in use.
+
+        Returns:
+            set: Candidate case indexes in ``self.kb.cases``
+        """
+
         if fingerprint is None:
-            return rename_instance
-        types = fingerprint.keys()
+            fingerprint = self.loaded()
 
-        for one in types:
-            for clue in fingerprint[one]:
-                idx = clue["index"]
-                action = clue["action"]
-                order = clue["order"] if "order" in clue else 0
-                clue_name = one + "-" + str(idx) + "-" + str(action)
-                rename_instance.setdefault(order, [])
-                rename_instance[order].append(clue_name)
-        return rename_instance
+        record = fingerprint["record"]
+        candidates = set()
 
-    def analyse_case(self):
+        for target_type in kinds or self.in_use():
+            if not fingerprint[target_type]:
+                continue
 
-        kb_case_types = self.kb.kb.keys()
+            # The ordered path compares clues across all orders
+            ordered = target_type == "metrics" and fingerprint["order"]
+            clues = record.clues(target_type, None if ordered else 0)
 
-        for kb_case_type in kb_case_types:
+            for clue_id in set(clues):
+                if clue_id < 0:
+                    continue
+                cases, _, orders = self.kb.postings[clue_id]
+                for case_idx, order in zip(cases, orders):
+                    if ordered or order == 0:
+                        candidates.add(case_idx)
 
-            for kb_case in self.kb.kb[kb_case_type]:
-                kb_anomalies = kb_case["anomalies"]
+        return candidates
 
-                kb_metrics = (
-                    kb_anomalies["metrics"]
-                    if "metrics" in kb_anomalies
-                    else None
-                )
-                kb_traces = (
-                    kb_anomalies["traces"] if "traces" in kb_anomalies else None
+    def analyse_case(self, chaos_types=None):
+
+        case_scores = self.score_cases(self.loaded(), chaos_types)
+
+        if chaos_types is None:
+            self.case_scores.update(case_scores)
+        else:
+            self.case_scores = case_scores
+
+    def score_cases(self, fingerprint: dict, chaos_types=None) -> dict:
+        """Score cases against a parsed fingerprint
+
+        Scores are accumulated clue by clue over the order 0 postings of
+        ``KB.postings``, in the order ``similarity`` adds them up case by
+        case, so the order 0 terms are the same to the last bit. Ordered
+        metrics are scored by weighted LCS over clue ids, and may differ
+        from ``similarity`` in the last bit.
+
+        Args:
+            fingerprint (dict): Fingerprint from ``parse_fingerprint``
+            chaos_types (list, optional): Only score the cases of these chaos
+                types. Defaults to None, scoring every case.
+
+        Returns:
+            dict: Score of every experiment
+        """
+
+        record = fingerprint["record"]
+        scores = {}
+
+        for target_type in self.in_use():
+            if not fingerprint[target_type]:
+                continue
+
+            if target_type == "metrics" and fingerprint["order"]:
+                f_metrics = self.ordered_metrics(record)
+                cases = self.candidate_cases(fingerprint, ["metrics"])
+                for case_idx in sorted(cases):
+                    scores[case_idx] = scores.get(
+                        case_idx, 0
+                    ) + self.order_similarity(
+                        f_metrics,
+                        self.ordered_metrics(self.kb.cases[case_idx]),
+                    )
+                continue
+
+            weights = self.kb.weight_arrays[target_type + "_score"]
+            lengths = self.kb.lengths[target_type]
+            clues = record.clues(target_type)
+            for clue_id in clues:
+                if clue_id < 0:
+                    continue
+                weight = weights[clue_id]
+                for case_idx, count, order in zip(*self.kb.postings[clue_id]):
+                    if order:
+                        continue
+                    length = lengths[case_idx]
+                    scores[case_idx] = scores.get(case_idx, 0) + (
+                        weight
+                        * count
+                        / (length if length > len(clues) else len(clues))
+                    )
+
+        if chaos_types is None:
+            # Cases sharing no clue with the fingerprint always score 0
+            case_scores = dict.fromkeys(self.kb.experiments, 0.0)
+        else:
+            cases = set()
+            for chaos_type in chaos_types:
+                cases.update(self.kb.types[chaos_type]["cases"])
+            scores = {
+                case_idx: score
+                for case_idx, score in scores.items()
+                if case_idx in cases
+            }
+
+            experiments = [
+                experiment
+                for case_idx in cases
+                for experiment in self.kb.winners[case_idx]
+            ]
+            case_scores = dict.fromkeys(
+                sorted(experiments, key=self.kb.positions.get), 0.0
+            )
+
+        for case_idx, score in scores.items():
+            # Cases overwritten by a later case of the same experiment have
+            # no winner
+            for experiment in self.kb.winners[case_idx]:
+                case_scores[experiment] = float(score)
+
+        return case_scores
+
+    def top_k(self, k: int = 3, fingerprint=None) -> tuple:
+        """Retrieve the k best cases, pruning cases that cannot reach them
+
+        Each clue of the loaded fingerprint gets an upper bound on what it can
+        add to a case score, from the normalized weights of
+        ``KB.score_fingerprint`` and the per-clue statistics of
+        ``KB.bounds``. Going through candidate cases in index order, clues
+        whose bounds sum below the current k-th score are no longer used to
+        find candidates, and a candidate is only scored when its own bound can
+        still reach the k-th score (MaxScore). Ties are broken like
+        ``heapq.nlargest`` over ``case_scores``.
+
+        Args:
+            k (int, optional): Number of cases. Defaults to 3.
+            fingerprint (Union[str, dict], optional): Fingerprint file path or
+                content. Defaults to the loaded fingerprint.
+
+        Returns:
+            tuple: ``[(experiment, score)]`` best first, and the number of
+                candidate cases pruned without scoring
+        """
+
+        if fingerprint is None:
+            fingerprint = self.loaded()
+        else:
+            fingerprint = self.parse_fingerprint(fingerprint)
+
+        record = fingerprint["record"]
+        bounds = self.kb.bounds
+        terms = []
+        for target_type in self.in_use():
+            if not fingerprint[target_type]:
+                continue
+
+            weights = self.kb.weight_arrays[target_type + "_score"]
+            ordered = target_type == "metrics" and fingerprint["order"]
+            if ordered:
+                clues = [
+                    i
+                    for item in record.by_order(target_type).values()
+                    for i in item
+                ]
+            else:
+                clues = record.clues(target_type)
+
+            for clue_id, count in Counter(clues).items():
+                if clue_id < 0:
+                    continue
+                cases, _, orders = self.kb.postings[clue_id]
+                if ordered:
+                    bound = min(count / len(clues), bounds["ordered"][clue_id])
+                    cases = list(cases)
+                else:
+                    bound = count * min(
+                        bounds["ratio"][clue_id],
+                        bounds["count"][clue_id] / len(clues),
+                    )
+                    cases = [
+                        case_idx
+                        for case_idx, order in zip(cases, orders)
+                        if order == 0
+                    ]
+                if cases:
+                    terms.append((weights[clue_id] * bound, cases, ordered))
+
+        # Clues with the smallest bounds are the first to stop finding cases
+        terms.sort(key=lambda x: x[0])
+        prefix = []
+        for bound, _, _ in terms:
+            prefix.append(bound + (prefix[-1] if prefix else 0))
+
+        candidates = {case_idx for _, cases, _ in terms for case_idx in cases}
+        cursors = [0] * len(terms)
+        essential = 0
+        threshold = 0
+        scored = 0
+        heap = []
+
+        while True:
+            heads = [
+                terms[t][1][cursors[t]]
+                for t in range(essential, len(terms))
+                if cursors[t] < len(terms[t][1])
+            ]
+            if not heads:
+                break
+            case_idx = min(heads)
+
+            bound = prefix[essential - 1] if essential else 0
+            order_bound = 0
+            for t in range(essential, len(terms)):
+                cases = terms[t][1]
+                if cursors[t] < len(cases) and cases[cursors[t]] == case_idx:
+                    bound += terms[t][0]
+                    order_bound += terms[t][0] if terms[t][2] else 0
+                while cursors[t] < len(cases) and cases[cursors[t]] == case_idx:
+                    cursors[t] += 1
+
+            winners = self.kb.winners[case_idx]
+            if not winners:
+                continue
+            if len(heap) == k and bound * (1 + 1e-9) < threshold:
+                continue
+            if len(heap) == k and order_bound and self.lcs_kernel != "dp":
+                # Tighter bound of the ordered metrics from the LCS length
+                f_metrics_reorder = self.ordered_metrics(record)
+                case_metrics_reorder = self.ordered_metrics(
+                    self.kb.cases[case_idx]
                 )
-                kb_logs = (
-                    kb_anomalies["logs"] if "logs" in kb_anomalies else None
+                lcs_bound, _ = weighted_LCS_bound(
+                    f_metrics_reorder,
+                    case_metrics_reorder,
+                    self.kb.weight_arrays["metrics_score"],
                 )
-                kb_cmds = (
-                    kb_anomalies["cmds"] if "cmds" in kb_anomalies else None
+                lcs_bound /= max(
+                    len(f_metrics_reorder), len(case_metrics_reorder)
                 )
+                bound -= order_bound - min(order_bound, lcs_bound)
+                if bound * (1 + 1e-9) < threshold:
+                    continue
+
+            score = self.case_similarity(fingerprint, case_idx)
+            scored += 1
+
+            for experiment in winners:
+                entry = (score, -self.kb.ranks[experiment], experiment)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while (
+                    essential < len(terms)
+                    and prefix[essential] * (1 + 1e-9) < threshold
+                ):
+                    essential += 1
+
+        top = [(x[2], x[0]) for x in sorted(heap, reverse=True)]
+
+        # Cases sharing no clue score 0, in case_scores order
+        for experiment in self.kb.experiments:
+            if len(top) >= k:
+                break
+            if all(experiment != x[0] for x in top):
+                top.append((experiment, 0.0))
+
+        pruned = (
+            len(
+                [
+                    case_idx
+                    for case_idx in candidates
+                    if self.kb.winners[case_idx]
+                ]
+            )
+            - scored
+        )
 
-                kb_rename_metrics = self.rename(kb_metrics)
-                kb_rename_traces = self.rename(kb_traces)
-                kb_rename_logs = self.rename(kb_logs)
-                kb_rename_cmds = self.rename(kb_cmds)
-
-                self.score = self.cal_similarity(
-                    kb_rename_metrics,
-                    kb_rename_traces,
-                    kb_rename_logs,
-                    kb_rename_cmds,
-                    hierarchy="case",
-                )
-                self.case_scores[kb_case["experiment"]] = self.score
+        return top, pruned
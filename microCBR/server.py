@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Union
+from urllib.parse import urlsplit, parse_qs
+from schema import SchemaError
+from kb import KB
+from reasoning import Reasoner
+from validation import validate_fingerprint
+from watcher import KB_Watcher
+
+_LOGGER = logging.getLogger(__name__)
+
+STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+class Reasoning_Server:
+    def __init__(
+        self,
+        kb: Union[KB, KB_Watcher],
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_batch: int = 64,
+        max_latency: float = 0.005,
+        window: int = 10000,
+        **kwargs
+    ) -> None:
+        """Local HTTP server reasoning over a warm knowledge base
+
+        ``POST /reason`` takes one fingerprint, or a list of them, in the
+        schema of ``Reasoner.load_fingerprint`` and answers with ranked cases
+        and chaos types. Fingerprints of concurrent requests are coalesced
+        into one ``Reasoner.reason_many`` batch, sent once ``max_batch``
+        fingerprints are waiting or the first of them has waited
+        ``max_latency`` seconds. ``GET /metrics`` reports counters and
+        latency percentiles.
+
+        Given a ``KB_Watcher``, each batch is scored by the reasoner serving
+        when it is sent, so a reloaded knowledge base is picked up without a
+        restart, and every answer carries the hash of the knowledge base it
+        was scored against.
+
+        Args:
+            kb (Union[KB, KB_Watcher]): Loaded or watched knowledge base
+            host (str, optional): Host. Defaults to "127.0.0.1".
+            port (int, optional): Port, 0 for any free one. Defaults to 8000.
+            max_batch (int, optional): Largest batch. Defaults to 64.
+            max_latency (float, optional): Longest wait, in seconds, before a
+                batch is sent. Defaults to 0.005.
+            window (int, optional): Number of latest requests the latency
+                percentiles are computed over. Defaults to 10000.
+            kwargs: Reasoner options, e.g. use_logs, for a loaded
+                knowledge base
+        """
+
+        if isinstance(kb, KB_Watcher):
+            self.watcher = kb
+            self.static_reasoner = None
+        else:
+            self.watcher = None
+            self.static_reasoner = Reasoner(kb, **kwargs)
+        self.host = host
+        self.port = port
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+
+        self.queue = None
+        self.server = None
+        self.batcher = None
+
+        self.latency = deque(maxlen=window)
+        self.counters = {
+            "requests": 0,
+            "errors": 0,
+            "fingerprints": 0,
+            "batches": 0,
+        }
+
+    @property
+    def reasoner(self) -> Reasoner:
+        """Reasoner serving now"""
+
+        if self.watcher is not None:
+            return self.watcher.reasoner
+        return self.static_reasoner
+
+    async def start(self):
+        """Start serving, and batching in the background"""
+
+        if self.watcher is not None:
+            self.watcher.start()
+        elif self.reasoner.kb.matrix is None:
+            self.reasoner.kb.build_matrix()
+
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.ensure_future(self.batch())
+        self.server = await asyncio.start_server(
+            self.handle, self.host, self.port
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        _LOGGER.info("Serving on {}:{}".format(self.host, self.port))
+
+    async def stop(self):
+        """Stop serving"""
+
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        if self.watcher is not None:
+            self.watcher.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def reason(self, fingerprints: list) -> list:
+        """Queue fingerprints for the next batch and wait for their scores
+
+        Args:
+            fingerprints (list): Validated fingerprints
+
+        Returns:
+            list: ``{"case_scores": dict, "type_scores": dict, "kb_hash":
+                str}`` per fingerprint
+        """
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for fingerprint in fingerprints:
+            future = loop.create_future()
+            self.queue.put_nowait((fingerprint, future))
+            futures.append(future)
+
+        return await asyncio.gather(*futures)
+
+    async def batch(self):
+        """Coalesce queued fingerprints into batches and score them"""
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            pending = [await self.queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(pending) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(
+                        await asyncio.wait_for(self.queue.get(), timeout)
+                    )
+                except asyncio.TimeoutError:
+                    break
+
+            fingerprints = [fingerprint for fingerprint, _ in pending]
+            # The whole batch is scored against one knowledge base version
+            reasoner = self.reasoner
+            try:
+                results = await loop.run_in_executor(
+                    None, reasoner.reason_many, fingerprints
+                )
+            except Exception as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.counters["batches"] += 1
+            self.counters["fingerprints"] += len(pending)
+            for (_, future), result in zip(pending, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def handle(self, reader, writer):
+        """Serve one HTTP request"""
+
+        start = time.perf_counter()
+        method = None
+        try:
+            try:
+                method, target, body = await self.read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                status = 400
+                response = {"error": "Malformed request: {}".format(e)}
+            else:
+                status, response = await self.route(method, target, body)
+        except Exception as e:
+            _LOGGER.exception("Failed to serve request")
+            status, response = 500, {"error": str(e)}
+
+        self.counters["requests"] += 1
+        if status != 200:
+            self.counters["errors"] += 1
+        if method == "POST":
+            self.latency.append(time.perf_counter() - start)
+
+        data = json.dumps(response).encode("utf-8")
+        writer.write(
+            (
+                "HTTP/1.1 {} {}\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            .format(status, STATUS[status], len(data))
+            .encode("latin-1")
+            + data
+        )
+        await writer.drain()
+        writer.close()
+
+    async def read_request(self, reader) -> tuple:
+        """Read one HTTP request
+
+        Args:
+            reader (asyncio.StreamReader): Connection
+
+        Raises:
+            ValueError: Malformed request line, header or content length
+            asyncio.IncompleteReadError: Body shorter than its content length
+
+        Returns:
+            tuple: Method, request target and body
+        """
+
+        request_line = await reader.readline()
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, value = line.decode("latin-1").split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+
+        body = b""
+        if "content-length" in headers:
+            length = int(headers["content-length"])
+            if length < 0:
+                raise ValueError("Negative content length")
+            body = await reader.readexactly(length)
+
+        return method, target, body
+
+    async def route(self, method: str, target: str, body: bytes) -> tuple:
+        """Dispatch a request
+
+        Args:
+            method (str): HTTP method
+            target (str): Request target, with query string
+            body (bytes): Request body
+
+        Returns:
+            tuple: HTTP status and JSON response
+        """
+
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if url.path == "/metrics":
+            return 200, self.metrics()
+        if url.path != "/reason":
+            return 404, {"error": "Unknown path {}".format(url.path)}
+        if method != "POST":
+            return 405, {"error": "Use POST /reason"}
+
+        try:
+            data = json.loads(body)
+            fingerprints = data if type(data) is list else [data]
+            for fingerprint in fingerprints:
+                if type(fingerprint) is not dict:
+                    raise SchemaError("Fingerprint must be a mapping")
+                # Parsed once in the batch, against the KB serving then
+                validate_fingerprint(fingerprint)
+            k = int(query["k"][0]) if "k" in query else None
+            if k is not None and k < 1:
+                raise ValueError("k must be at least 1, not {}".format(k))
+        except (ValueError, SchemaError) as e:
+            return 400, {"error": str(e)}
+
+        results = await self.reason(fingerprints)
+        ranked = [self.rank(result, k) for result in results]
+
+        return 200, ranked if type(data) is list else ranked[0]
+
+    def rank(self, result: dict, k: int = None) -> dict:
+        """Rank cases and chaos types, best first
+
+        Args:
+            result (dict): Scores of one fingerprint
+            k (int, optional): Number of cases kept. Defaults to all.
+
+        Returns:
+            dict: Ranked ``[name, score]`` lists, and the knowledge base hash
+        """
+
+        cases = sorted(result["case_scores"].items(), key=lambda x: -x[1])
+        types = sorted(result["type_scores"].items(), key=lambda x: -x[1])
+
+        return {
+            "cases": cases[:k] if k is not None else cases,
+            "types": types,
+            "kb_hash": result["kb_hash"],
+        }
+
+    def metrics(self) -> dict:
+        """Counters and latency percentiles, in milliseconds
+
+        Returns:
+            dict: Server metrics
+        """
+
+        latency = sorted(self.latency)
+
+        def percentile(p):
+            if not latency:
+                return None
+            return 1000 * latency[min(len(latency) - 1, int(p * len(latency)))]
+
+        metrics = dict(self.counters)
+        metrics["p50_ms"] = percentile(0.50)
+        metrics["p99_ms"] = percentile(0.99)
+        metrics["mean_batch"] = (
+            metrics["fingerprints"] / metrics["batches"]
+            if metrics["batches"]
+            else None
+        )
+        if self.watcher is not None:
+            metrics["kb"] = self.watcher.metrics()
+
+        return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MicroCBR reasoning server")
+    parser.add_argument("--kb", default="./KNOWLEDGE_BASE.yaml")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-latency", type=float, default=0.005)
+    parser.add_argument(
+        "--watch",
+        type=float,
+        default=None,
+        help="Reload the knowledge base when changed, checking every WATCH s",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.watch is not None:
+        kb = KB_Watcher(args.kb, interval=args.watch)
+    else:
+        kb = KB()
+        kb.load(args.kb)
+    server = Reasoning_Server(
+        kb,
+        host=args.host,
+        port=args.port,
+        max_batch=args.max_batch,
+        max_latency=args.max_latency,
+    )
+    asyncio.run(server.serve_forever())
@@ -0,0 +1,347 @@
+import heapq
+import logging
+import multiprocessing
+import zlib
+from kb import KB, SCORES, Score_Table
+from reasoning import Reasoner
+
+_LOGGER = logging.getLogger(__name__)
+
+# Shard inherited by a forked shard process, set right before it starts
+_SHARD = None
+
+
+class KB_Shard:
+    def __init__(self, kb: KB, case_ids: list, parent: KB, **kwargs) -> None:
+        """Part of a knowledge base, scored with the weights of the whole
+
+        Args:
+            kb (KB): Knowledge base of the shard, indexed, holding the score
+                tables of ``parent``
+            case_ids (list): Case index in ``parent`` of every shard case
+            parent (KB): Whole knowledge base
+            kwargs: Reasoner options, e.g. use_logs
+        """
+
+        self.reasoner = Reasoner(kb, **kwargs)
+        self.kb = kb
+        # Global rank of the experiments ending up in case_scores, by case
+        self.ranks = {}
+        for case_idx, case_id in enumerate(case_ids):
+            for experiment in parent.winners[case_id]:
+                self.ranks.setdefault(case_idx, []).append(
+                    (parent.ranks[experiment], experiment)
+                )
+
+    def score(self, fingerprint: dict, k: int = None) -> dict:
+        """Partial scores of a fingerprint over the shard
+
+        A case is scored exactly as by the whole knowledge base. A chaos type
+        score is a weighted clue count divided by the clue number of the type
+        and its case number, so each shard sends its weighted clue counts,
+        clue numbers and case numbers for the coordinator to add up.
+
+        Args:
+            fingerprint (dict): Fingerprint from ``parse_fingerprint``
+            k (int, optional): Number of cases. Defaults to all.
+
+        Returns:
+            dict: Best ``(score, rank, experiment)`` cases, and the partial
+                score of every chaos type of the shard
+        """
+
+        reasoner = self.reasoner
+        candidates = reasoner.candidate_cases(fingerprint)
+
+        cases = []
+        for case_idx in candidates:
+            if case_idx not in self.ranks:
+                continue
+            score = reasoner.case_similarity(fingerprint, case_idx)
+            cases += [
+                (score, rank, experiment)
+                for rank, experiment in self.ranks[case_idx]
+            ]
+
+        # Cases sharing no clue with the fingerprint score 0, best ranked first
+        unscored = sorted(
+            (rank, experiment)
+            for case_idx, winners in self.ranks.items()
+            if case_idx not in candidates
+            for rank, experiment in winners
+        )
+        if k is not None:
+            unscored = unscored[:k]
+        cases += [(0.0, rank, experiment) for rank, experiment in unscored]
+
+        key = lambda case: (-case[0], case[1])  # noqa: E731
+        cases = (
+            heapq.nsmallest(k, cases, key=key)
+            if k is not None
+            else sorted(cases, key=key)
+        )
+
+        record = fingerprint["record"]
+        types = {}
+        for chaos_type, kb_type in self.kb.types.items():
+            numerator = {}
+            for target_type in reasoner.in_use():
+                if not fingerprint[target_type]:
+                    continue
+
+                weights = self.kb.weight_arrays[
+                    "type_" + target_type + "_score"
+                ]
+                counter = kb_type["counts"][target_type]
+                numerator[target_type] = sum(
+                    weights[item] * counter[item]
+                    for item in record.clues(target_type)
+                    if item in counter
+                )
+
+            types[chaos_type] = {
+                "numerator": numerator,
+                "length": kb_type["length"],
+                "case_num": kb_type["case_num"],
+            }
+
+        return {"cases": cases, "types": types}
+
+
+def partition(kb: KB, shards: int, by: str = "type", **kwargs) -> list:
+    """Split a loaded knowledge base into shards
+
+    With ``by="type"``, whole chaos types are spread over the shards, the
+    largest first, each to the shard with the fewest cases. With
+    ``by="experiment"``, cases go to the shard given by a hash of their
+    experiment, so cases of one experiment stay together. Shards share the
+    case records, clue ids and weights of the whole knowledge base, so
+    weights are global.
+
+    Args:
+        kb (KB): Loaded knowledge base
+        shards (int): Number of shards
+        by (str, optional): "type" or "experiment". Defaults to "type".
+        kwargs: Reasoner options, e.g. use_logs
+
+    Returns:
+        list: ``KB_Shard`` of every non-empty shard
+    """
+
+    kb.refresh()
+
+    if by == "type":
+        sizes = [0] * shards
+        assigned = {}
+        for chaos_type in sorted(
+            kb.types, key=lambda t: -len(kb.types[t]["cases"])
+        ):
+            shard = sizes.index(min(sizes))
+            assigned[chaos_type] = shard
+            sizes[shard] += len(kb.types[chaos_type]["cases"])
+
+        def assign(chaos_type, case):
+            return assigned[chaos_type]
+
+    elif by == "experiment":
+
+        def assign(chaos_type, case):
+            return zlib.crc32(case.experiment.encode("utf-8")) % shards
+
+    else:
+        raise Exception("Unknown sharding {}".format(by))
+
+    parts = [({}, []) for _ in range(shards)]
+    for chaos_type, kb_type in kb.types.items():
+        if by == "type":
+            parts[assign(chaos_type, None)][0][chaos_type] = []
+        for case_id in kb_type["cases"]:
+            case = kb.cases[case_id]
+            part, case_ids = parts[assign(chaos_type, case)]
+            part.setdefault(chaos_type, []).append(case)
+            case_ids.append(case_id)
+
+    results = []
+    for part, case_ids in parts:
+        if not part:
+            continue
+        shard_kb = KB()
+        shard_kb.interner = kb.interner
+        shard_kb.weight_arrays = kb.weight_arrays
+        for score in SCORES:
+            setattr(shard_kb, score, Score_Table(shard_kb, score))
+        shard_kb.source = kb.source
+        shard_kb.source_hash = kb.source_hash
+        shard_kb.index_cases(part)
+        results.append(KB_Shard(shard_kb, case_ids, kb, **kwargs))
+
+    return results
+
+
+def score_one(fingerprint: dict, k: int = None) -> dict:
+    """Score one fingerprint with the process's inherited shard"""
+
+    return _SHARD.score(fingerprint, k)
+
+
+class Sharded_Reasoner:
+    def __init__(
+        self,
+        kb: KB,
+        shards: int = 2,
+        by: str = "type",
+        processes: bool = True,
+        **kwargs
+    ) -> None:
+        """Scatter-gather reasoning over a sharded knowledge base
+
+        Each shard is served by its own forked process, or in process
+        without ``processes``. Fingerprints are validated and renamed once,
+        sent to every shard, and the partial results merged into the best
+        cases and the chaos type scores. Case scores are those of a single
+        ``Reasoner``, and chaos type scores match up to float rounding.
+
+        Args:
+            kb (KB): Loaded knowledge base
+            shards (int, optional): Number of shards. Defaults to 2.
+            by (str, optional): Sharding, see ``partition``.
+                Defaults to "type".
+            processes (bool, optional): Run shards in their own process.
+                Defaults to True.
+            kwargs: Reasoner options, e.g. use_logs
+        """
+
+        self.kb = kb
+        self.reasoner = Reasoner(kb, **kwargs)
+        self.shards = partition(kb, shards, by, **kwargs)
+        self.processes = processes
+        self.pools = None
+
+    def start(self):
+        """Fork a process for every shard"""
+
+        global _SHARD
+
+        if not self.processes or self.pools is not None:
+            return
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise Exception("Sharded_Reasoner needs the fork start method")
+
+        context = multiprocessing.get_context("fork")
+        self.pools = []
+        for shard in self.shards:
+            _SHARD = shard
+            self.pools.append(context.Pool(1))
+        _SHARD = None
+
+    def reason(self, fingerprints: list, k: int = 3) -> list:
+        """Reason over a batch of fingerprints
+
+        Args:
+            fingerprints (list): Fingerprint file paths or contents
+            k (int, optional): Number of cases. Defaults to 3, None for all.
+
+        Returns:
+            list: ``{"cases": [(experiment, score)], "type_scores": dict,
+                "kb_hash": str}`` per fingerprint, cases best first
+        """
+
+        parsed = []
+        for fingerprint in fingerprints:
+            fingerprint = self.reasoner.parse_fingerprint(fingerprint)
+            # Shards share the clue ids of the whole knowledge base, and do
+            # not need the raw document
+            fingerprint.pop("fingerprint")
+            parsed.append(fingerprint)
+
+        if self.processes:
+            self.start()
+            pending = [
+                pool.starmap_async(score_one, [(f, k) for f in parsed])
+                for pool in self.pools
+            ]
+            partials = [p.get() for p in pending]
+        else:
+            partials = [
+                [shard.score(f, k) for f in parsed] for shard in self.shards
+            ]
+
+        return [
+            self.merge(fingerprint, [shard[i] for shard in partials], k)
+            for i, fingerprint in enumerate(parsed)
+        ]
+
+    def merge(self, fingerprint: dict, partials: list, k: int = None) -> dict:
+        """Merge the partial results of every shard for one fingerprint
+
+        Args:
+            fingerprint (dict): Fingerprint from ``parse_fingerprint``
+            partials (list): ``KB_Shard.score`` of every shard
+            k (int, optional): Number of cases. Defaults to all.
+
+        Returns:
+            dict: Best cases and chaos type scores
+        """
+
+        cases = heapq.merge(
+            *[partial["cases"] for partial in partials],
+            key=lambda case: (-case[0], case[1]),
+        )
+        cases = [(experiment, score) for score, _, experiment in cases]
+
+        types = {}
+        for partial in partials:
+            for chaos_type, part in partial["types"].items():
+                if chaos_type not in types:
+                    types[chaos_type] = {
+                        "numerator": dict(part["numerator"]),
+                        "length": dict(part["length"]),
+                        "case_num": part["case_num"],
+                    }
+                    continue
+                merged = types[chaos_type]
+                for target_type, numerator in part["numerator"].items():
+                    merged["numerator"][target_type] += numerator
+                for target_type, length in part["length"].items():
+                    merged["length"][target_type] += length
+                merged["case_num"] += part["case_num"]
+
+        type_scores = {}
+        for chaos_type in self.kb.types:
+            merged = types.get(chaos_type)
+            # Chaos types without any case match nothing
+            if merged is None or not merged["case_num"]:
+                type_scores[chaos_type] = 0.0
+                continue
+            score = 0
+            for target_type, numerator in merged["numerator"].items():
+                clues = fingerprint[target_type]
+                clues = clues[0] if 0 in clues else []
+                if not clues:
+                    continue
+                score += numerator / max(
+                    merged["length"][target_type], len(clues)
+                )
+            type_scores[chaos_type] = score / merged["case_num"]
+
+        return {
+            "cases": cases[:k] if k is not None else cases,
+            "type_scores": type_scores,
+            "kb_hash": self.kb.source_hash,
+        }
+
+    def close(self):
+        """Stop the shard processes"""
+
+        if self.pools is not None:
+            for pool in self.pools:
+                pool.close()
+                pool.join()
+            self.pools = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
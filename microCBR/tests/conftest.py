@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path[:0] = [HERE, os.path.dirname(HERE)]
+
+
+@pytest.fixture(autouse=True)
+def microcbr_dir(monkeypatch):
+    """Run in microCBR, where the example files are"""
+
+    monkeypatch.chdir(HERE)
@@ -0,0 +1,120 @@
+import pytest
+
+from dedup import deduplicate
+from kb import KB
+from loader import load_yaml
+from reasoning import Reasoner
+from test_reasoning import sample_fingerprints
+from validation import validate_kb
+
+
+def runs(copies: int) -> dict:
+    """The example knowledge base with every case repeated as other
+    experiments, like the runs of one experiment on several pods"""
+
+    kb = load_yaml("./KNOWLEDGE_BASE.yaml", cache=False)
+    return {
+        chaos_type: [
+            dict(
+                chaos,
+                index=i * len(cases) + j,
+                experiment=chaos["experiment"] + ("#{}".format(i) if i else ""),
+            )
+            for i in range(copies)
+            for j, chaos in enumerate(cases)
+        ]
+        for chaos_type, cases in kb.items()
+    }
+
+
+def reasoners(*kbs) -> list:
+    loaded = []
+    for kb in kbs:
+        loaded.append(KB())
+        loaded[-1].load(kb)
+    return [Reasoner(kb) for kb in loaded]
+
+
+@pytest.mark.parametrize("copies", [1, 3])
+def test_scores_unchanged(copies):
+    grown = runs(copies)
+    deduplicated, report = deduplicate(grown)
+    validate_kb(deduplicated)
+    assert report["cases"] == sum(len(cases) for cases in grown.values())
+    assert report["representatives"] == sum(
+        len(cases) for cases in deduplicated.values()
+    )
+    assert report["merged"] == report["cases"] - report["representatives"]
+    if copies > 1:
+        assert report["reduction"] > 1 - 1 / copies - 1e-9
+
+    original, merged = reasoners(grown, deduplicated)
+    fingerprints = sample_fingerprints()
+    for fingerprint in fingerprints:
+        expected = original.reason(fingerprint)
+        result = merged.reason(fingerprint)
+        assert list(result.case_scores.items()) == list(
+            expected.case_scores.items()
+        )
+        assert result.type_scores == expected.type_scores
+        top, _ = merged.top_k(5, fingerprint)
+        assert top == original.top_k(5, fingerprint)[0]
+
+        # Chaos types also scored by their best cases
+        for reasoner in [original, merged]:
+            reasoner.load_fingerprint(fingerprint)
+            reasoner.reasoning()
+        assert merged.case_scores == original.case_scores
+        assert merged.type_scores == original.type_scores
+
+    for expected, result in zip(
+        original.reason_many(fingerprints), merged.reason_many(fingerprints)
+    ):
+        assert result["case_scores"] == expected["case_scores"]
+        assert result["type_scores"] == expected["type_scores"]
+
+
+def test_idempotent():
+    deduplicated, _ = deduplicate(runs(3))
+    again, report = deduplicate(deduplicated)
+
+    assert again == deduplicated
+    assert report["merged"] == 0 and report["reduction"] == 0.0
+
+
+def test_unordered_indexes_kept():
+    grown = runs(2)
+    grown["network"].reverse()
+    deduplicated, _ = deduplicate(grown)
+
+    assert deduplicated["network"] == grown["network"]
+    assert len(deduplicated["io"]) < len(grown["io"])
+
+
+def test_near_duplicates():
+    kb = {
+        "network": [
+            {
+                "index": i,
+                "experiment": "e{}".format(i),
+                "instance_related": False,
+                "anomalies": {
+                    "metrics": {
+                        "network": [
+                            {"index": j, "action": "dips"} for j in clues
+                        ]
+                    }
+                },
+            }
+            for i, clues in enumerate([[0, 1, 2, 3], [0, 1, 2], [4, 5]])
+        ]
+    }
+
+    exact, report = deduplicate(kb)
+    assert exact == kb and report["near"] == 0
+
+    near, report = deduplicate(kb, threshold=0.75)
+    assert report["near"] == 1 and report["representatives"] == 2
+    assert near["network"][0]["duplicates"] == [
+        {"index": 1, "experiment": "e1"}
+    ]
@@ -0,0 +1,100 @@
+import datetime
+import shutil
+
+import pytest
+import yaml
+
+from kb import KB, digest
+from loader import YAML_CACHE, copy_tree, load_yaml
+from reasoning import Reasoner
+
+
+def test_copy_tree():
+    document = {
+        "a": [{"b": 1, "c": [2.0, "x"]}, None],
+        "d": datetime.date(2022, 1, 1),
+        "e": {1, 2},
+    }
+    copied = copy_tree(document)
+
+    assert copied == document
+    assert copied["a"] is not document["a"]
+    assert copied["a"][0]["c"] is not document["a"][0]["c"]
+    assert copied["e"] is not document["e"]
+
+
+def test_cache():
+    YAML_CACHE.clear()
+    first = load_yaml("./fingerprint.yaml")
+    copied = load_yaml("./fingerprint.yaml", copy_document=True)
+
+    assert load_yaml("./fingerprint.yaml") is first
+    assert copied == first and copied is not first
+    assert YAML_CACHE.stats()["hits"] == 2
+
+
+def test_kb_copy():
+    YAML_CACHE.clear()
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    # Neither the cache nor the knowledge base keep the document
+    assert YAML_CACHE.stats()["size"] == 0
+    assert kb._kb is None
+    kb.kb["network"].clear()
+
+    document, _ = YAML_CACHE.read("./KNOWLEDGE_BASE.yaml")
+    assert document["network"]
+    other = KB()
+    other.load("./KNOWLEDGE_BASE.yaml")
+    assert other.kb == document
+
+
+def test_snapshot(tmp_path):
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    kb.compile(str(tmp_path / "kb.snap"))
+    assert [path.name for path in tmp_path.iterdir()] == ["kb.snap"]
+
+    snapshot = KB()
+    snapshot.open_snapshot(str(tmp_path / "kb.snap"))
+    fingerprint = load_yaml("./fingerprint.yaml")
+    expected = Reasoner(kb).reason(fingerprint)
+    assert Reasoner(snapshot).reason(fingerprint) == expected
+    # Reasoning reads the mapped arrays, not the document
+    assert snapshot._kb is None
+    assert snapshot.kb == kb.kb
+
+
+def test_log(tmp_path):
+    kb_path = str(tmp_path / "kb.yaml")
+    log_path = str(tmp_path / "kb.log")
+    shutil.copy("./KNOWLEDGE_BASE.yaml", kb_path)
+    kb = KB()
+    kb.load(kb_path)
+    kb.attach_log(log_path)
+    kb.add_case("network", load_yaml("./fingerprint.yaml", copy_document=True))
+    kb.log.close()
+
+    replayed = KB()
+    replayed.load(kb_path)
+    assert replayed.attach_log(log_path) == 1
+    assert replayed.kb == kb.kb
+
+    # Compaction interrupted after moving the knowledge base in place
+    data = yaml.safe_dump(
+        replayed.kb, default_flow_style=False, sort_keys=False
+    )
+    replayed.write_log(1, compacted=digest(data))
+    replayed.log.close()
+    with open(kb_path, "w") as f:
+        f.write(data)
+    compacted = KB()
+    compacted.load(kb_path)
+    assert compacted.attach_log(log_path) == 0
+    assert compacted.kb == kb.kb
+    compacted.log.close()
+
+    other = KB()
+    other.load("./KNOWLEDGE_BASE.yaml")
+    with pytest.raises(Exception):
+        other.attach_log(log_path)
@@ -0,0 +1,61 @@
+import gc
+import multiprocessing
+
+from kb import KB
+from loader import load_yaml
+from pool import Reasoner_Pool, init_worker, reason_one
+from reasoning import Reasoner
+from test_reasoning import sample_fingerprints
+
+
+def expected(reasoner: Reasoner, fingerprints: list) -> list:
+    results = []
+    for fingerprint in fingerprints:
+        result = reasoner.reason(fingerprint)
+        results.append(
+            {
+                "case_scores": dict(result.case_scores),
+                "type_scores": dict(result.type_scores),
+                "kb_hash": result.kb_hash,
+            }
+        )
+    return results
+
+
+def test_pools():
+    fingerprints = sample_fingerprints()
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    smaller = load_yaml("./KNOWLEDGE_BASE.yaml", cache=False)
+    del smaller["config"]
+    other = KB()
+    other.load(smaller)
+
+    # Two pools at once, each scoring against its own knowledge base
+    with Reasoner_Pool(kb, processes=2) as pool, Reasoner_Pool(
+        other, processes=2, use_logs=False
+    ) as other_pool:
+        assert pool.reason(fingerprints) == expected(Reasoner(kb), fingerprints)
+        assert other_pool.reason(fingerprints) == expected(
+            Reasoner(other, use_logs=False), fingerprints
+        )
+
+
+def test_frozen_workers():
+    fingerprint = load_yaml("./fingerprint.yaml")
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    reasoner = Reasoner(kb)
+
+    with Reasoner_Pool(kb, processes=2) as pool:
+        assert gc.get_freeze_count() == 0
+        assert pool.pool.apply(gc.get_freeze_count) > 0
+
+    # Forked from an unfrozen heap, like the workers a pool respawns
+    with multiprocessing.get_context("fork").Pool(
+        1, initializer=init_worker, initargs=(reasoner,)
+    ) as bare:
+        assert bare.apply(gc.get_freeze_count) > 0
+        assert bare.apply(reason_one, (fingerprint,)) == expected(
+            reasoner, [fingerprint]
+        )[0]
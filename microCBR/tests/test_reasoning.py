@@ -0,0 +1,194 @@
+import heapq
+import pickle
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import reasoning
+from kb import KB
+from loader import load_yaml
+from reasoning import Reasoner, compile_details
+
+
+def test_compile_details():
+    details = load_yaml("./LOG.yaml")
+    compiled = compile_details(details)
+
+    assert compiled is compile_details(details)
+    similarity = compiled["pod"]["similarity"]
+    assert similarity[0][0] == 1.0
+    assert 0 < similarity[0][2] < 1
+    assert similarity[0][2] == similarity[2][0]
+
+
+def test_compile_details_bounded():
+    reasoning._DETAILS_CACHE.clear()
+    for i in range(reasoning._DETAILS_CACHE_SIZE + 5):
+        compile_details({"pod": [{"index": i, "query": "kubectl logs"}]})
+
+    assert len(reasoning._DETAILS_CACHE) == reasoning._DETAILS_CACHE_SIZE
+
+
+def test_details_sim(tmp_path):
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    reasoner = Reasoner(kb)
+    assert reasoner.use_details_sim
+
+    # Detail table without the exec category
+    cmds = tmp_path / "CMD.yaml"
+    cmds.write_text("config:\n- index: 0\n  query: kubectl get pod $pod\n")
+
+    reasoner.load_fingerprint(
+        {
+            "groundtruth": "network-port-occupy-serial.yaml",
+            "order": True,
+            "anomalies": {
+                # No metrics of order 0
+                "metrics": {
+                    "network": [{"index": 0, "action": "dips", "order": 1}]
+                },
+                # Query of another index than the cases'
+                "logs": {"pod": [{"index": 0, "action": "match"}]},
+                "cmds": {"exec": [{"index": 6, "action": "anomaly"}]},
+            },
+        },
+        cmds_f_path=str(cmds),
+    )
+    reasoner.reasoning()
+
+    assert set(reasoner.type_scores) == set(kb.kb)
+    assert max(reasoner.type_scores, key=reasoner.type_scores.get) == (
+        "network"
+    )
+
+
+def sample_fingerprints(seed: int = 0) -> list:
+    """Example fingerprints, and random halves of the first cases of every
+    chaos type, unordered and ordered"""
+
+    rnd = random.Random(seed)
+    fingerprints = [
+        load_yaml("./fingerprint.yaml"),
+        load_yaml("./fingerprint_order.yaml"),
+    ]
+    for cases in load_yaml("./KNOWLEDGE_BASE.yaml").values():
+        for case in cases[:3]:
+            anomalies = {
+                target_type: {
+                    key: rnd.sample(value, max(1, len(value) // 2))
+                    for key, value in clues.items()
+                }
+                for target_type, clues in case["anomalies"].items()
+            }
+            for order in [False, True]:
+                fingerprints.append(
+                    {
+                        "groundtruth": case["experiment"],
+                        "order": order,
+                        "anomalies": anomalies,
+                    }
+                )
+
+    return fingerprints
+
+
+def test_reason_many():
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    reasoner = Reasoner(kb)
+    fingerprints = sample_fingerprints()
+
+    results = reasoner.reason_many(fingerprints)
+
+    assert len(results) == len(fingerprints)
+    for fingerprint, result in zip(fingerprints, results):
+        expected = reasoner.reason(fingerprint)
+        assert list(result["case_scores"]) == list(expected.case_scores)
+        assert result["case_scores"] == pytest.approx(
+            dict(expected.case_scores)
+        )
+        assert result["type_scores"] == pytest.approx(
+            dict(expected.type_scores)
+        )
+        assert result["kb_hash"] == expected.kb_hash == kb.source_hash
+
+
+@pytest.mark.parametrize("lcs_kernel", ["dp", "bitparallel"])
+def test_top_k(lcs_kernel):
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    reasoner = Reasoner(kb, lcs_kernel=lcs_kernel)
+
+    for fingerprint in sample_fingerprints():
+        case_scores = reasoner.reason(fingerprint).case_scores
+        # Many cases tie, at 0 or as copies of one another
+        assert len(set(case_scores.values())) < len(case_scores)
+        for k in [1, 3, 10, len(case_scores)]:
+            top, pruned = reasoner.top_k(k, fingerprint)
+            assert top == heapq.nlargest(
+                k, case_scores.items(), key=lambda x: x[1]
+            )
+            assert pruned >= 0
+
+
+def test_cascade():
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    reasoner = Reasoner(kb)
+    experiments = {
+        chaos_type: {case["experiment"] for case in cases}
+        for chaos_type, cases in load_yaml("./KNOWLEDGE_BASE.yaml").items()
+    }
+
+    for fingerprint in sample_fingerprints():
+        full = reasoner.reason(fingerprint)
+        for top_types in [1, 2, len(experiments)]:
+            cascade = reasoner.reason(fingerprint, top_types=top_types)
+            assert cascade.type_scores == full.type_scores
+
+            best = heapq.nlargest(
+                top_types, full.type_scores, key=full.type_scores.get
+            )
+            kept = set().union(*(experiments[t] for t in best))
+            assert list(cascade.case_scores) == [
+                experiment
+                for experiment in full.case_scores
+                if experiment in kept
+            ]
+            assert all(
+                score == full.case_scores[experiment]
+                for experiment, score in cascade.case_scores.items()
+            )
+
+            stateful = Reasoner(kb)
+            stateful.load_fingerprint(fingerprint)
+            stateful.reasoning(top_types=top_types)
+            assert stateful.type_scores == dict(cascade.type_scores)
+            assert stateful.case_scores == dict(cascade.case_scores)
+
+
+def test_reason_is_stateless():
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    reasoner = Reasoner(kb)
+    fingerprints = sample_fingerprints()
+    expected = [reasoner.reason(fingerprint) for fingerprint in fingerprints]
+
+    def state():
+        return pickle.dumps(kb), pickle.dumps(
+            {key: value for key, value in vars(reasoner).items() if key != "kb"}
+        )
+
+    before = state()
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(reasoner.reason, fingerprints * 4))
+    for fingerprint in fingerprints:
+        reasoner.reason(fingerprint, top_types=2)
+        reasoner.top_k(3, fingerprint)
+    assert state() == before
+
+    assert results == expected * 4
+    with pytest.raises(TypeError):
+        results[0].case_scores["x"] = 1.0
@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+
+from kb import KB
+from loader import load_yaml
+from reasoning import Reasoner
+from server import Reasoning_Server
+
+
+async def request(port: int, data: bytes) -> tuple:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, body = response.split(b"\r\n\r\n", 1)
+    status = int(head.split(b" ")[1])
+    return status, json.loads(body)
+
+
+async def post(port: int, path: str, payload) -> tuple:
+    body = json.dumps(payload).encode("utf-8")
+    return await request(
+        port,
+        "POST {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(
+            path, len(body)
+        ).encode("latin-1")
+        + body,
+    )
+
+
+def serve(kb: KB, *requests) -> list:
+    async def main():
+        server = Reasoning_Server(kb, port=0)
+        await server.start()
+        try:
+            return [await r(server.port) for r in requests], server.metrics()
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def test_reason():
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    fingerprint = load_yaml("./fingerprint.yaml")
+
+    expected = Reasoner(kb).reason("./fingerprint.yaml")
+
+    [(status, result)], metrics = serve(
+        kb, lambda port: post(port, "/reason?k=3", fingerprint)
+    )
+
+    assert status == 200
+    assert len(result["cases"]) == 3
+    assert result["cases"][0][0] == max(
+        expected.case_scores, key=expected.case_scores.get
+    )
+    assert dict(result["types"]) == pytest.approx(expected.type_scores)
+    assert metrics["requests"] == 1 and metrics["errors"] == 0
+
+
+def test_bad_requests():
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    fingerprint = load_yaml("./fingerprint.yaml")
+
+    responses, metrics = serve(
+        kb,
+        lambda port: request(port, b"\r\n"),
+        lambda port: request(port, b"POST\r\n\r\n"),
+        lambda port: post(port, "/reason", {"metrics": 1}),
+        lambda port: post(port, "/reason?k=0", fingerprint),
+        lambda port: post(port, "/reason?k=-1", fingerprint),
+        lambda port: post(port, "/unknown", {}),
+        lambda port: request(port, b"GET /reason HTTP/1.1\r\n\r\n"),
+    )
+
+    assert [status for status, _ in responses] == [400] * 5 + [404, 405]
+    assert "k must be at least 1" in responses[4][1]["error"]
+    assert metrics["requests"] == 7 and metrics["errors"] == 7
@@ -0,0 +1,54 @@
+import heapq
+
+import pytest
+
+from kb import KB
+from reasoning import Reasoner
+from shard import Sharded_Reasoner
+
+FINGERPRINTS = [
+    "./fingerprint.yaml",
+    "./fingerprint_order.yaml",
+    {
+        "groundtruth": "pod-kill-serial.yaml",
+        "anomalies": {
+            "metrics": {"cpu": [{"index": 0, "action": "spikes"}]},
+            "traces": {"onehop": [{"index": 1, "action": "all"}]},
+            "cmds": {"config": [{"index": 2, "action": "anomaly"}]},
+        },
+    },
+    # Metrics without any clue of order 0
+    {
+        "groundtruth": "network-loss-serial.yaml",
+        "order": True,
+        "anomalies": {
+            "metrics": {
+                "network": [
+                    {"index": 0, "action": "dips", "order": 1},
+                    {"index": 1, "action": "dips", "order": 2},
+                ]
+            }
+        },
+    },
+]
+
+
+@pytest.mark.parametrize("by", ["type", "experiment"])
+@pytest.mark.parametrize("shards", [1, 2, 3])
+@pytest.mark.parametrize("k", [3, None])
+def test_parity(by, shards, k):
+    kb = KB()
+    kb.load("./KNOWLEDGE_BASE.yaml")
+    reasoner = Reasoner(kb)
+    sharded = Sharded_Reasoner(kb, shards=shards, by=by, processes=False)
+
+    results = sharded.reason(FINGERPRINTS, k=k)
+
+    for fingerprint, result in zip(FINGERPRINTS, results):
+        expected = reasoner.reason(fingerprint)
+        case_scores = expected.case_scores
+        assert result["cases"] == heapq.nlargest(
+            k or len(case_scores), case_scores.items(), key=lambda x: x[1]
+        )
+        assert list(result["type_scores"]) == list(expected.type_scores)
+        assert result["type_scores"] == pytest.approx(expected.type_scores)
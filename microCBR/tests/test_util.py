@@ -0,0 +1,235 @@
+import datetime
+import io
+import os
+import random
+
+import numpy as np
+import pytest
+import yaml
+
+from loader import YAML_CACHE, copy_tree, load_yaml
+from util import (
+    dump_kb,
+    generateKB_from_chaos,
+    saveKB_to_file,
+    bit_parallel_LCS,
+    weighted_LCS,
+    weighted_LCS_bound,
+)
+
+
+@pytest.fixture
+def chaos_data(tmp_path):
+    """Two runs of every experiment of the example knowledge base"""
+
+    kb = load_yaml("./KNOWLEDGE_BASE.yaml")
+    for chaos_type, cases in kb.items():
+        for case in cases:
+            run_dir = tmp_path / "data" / chaos_type / case["experiment"][:-5]
+            run_dir.mkdir(parents=True)
+            for run in range(2):
+                run_case = {
+                    "experiment": case["experiment"],
+                    "creation_time": datetime.datetime(2022, 1, 1, 0, run),
+                    "anomalies": case["anomalies"],
+                }
+                (run_dir / "run{}.yaml".format(run)).write_text(
+                    yaml.safe_dump(run_case)
+                )
+
+    return str(tmp_path / "data") + "/"
+
+
+def test_incremental(chaos_data, tmp_path):
+    manifest = str(tmp_path / "manifest.json")
+    full = generateKB_from_chaos(chaos_data, "./CHAOS.yaml", processes=1)
+
+    timings = {}
+    first = generateKB_from_chaos(
+        chaos_data, "./CHAOS.yaml", manifest_path=manifest, timings=timings
+    )
+    assert first == full
+    assert all(timing["reused"] == 0 for timing in timings.values())
+    assert sorted(os.listdir(tmp_path)) == ["data", "manifest.json"]
+
+    timings = {}
+    second = generateKB_from_chaos(
+        chaos_data, "./CHAOS.yaml", manifest_path=manifest, timings=timings
+    )
+    assert second == full
+    assert all(timing["parsed"] == 0 for timing in timings.values())
+
+    # A run different from the others of its experiment
+    run_dir = os.path.join(chaos_data, "io", os.listdir(chaos_data + "io")[0])
+    with open(os.path.join(run_dir, "run0.yaml")) as f:
+        run_case = yaml.safe_load(f)
+    run_case["anomalies"] = {"logs": {"pod": [{"index": 9, "action": "match"}]}}
+    with open(os.path.join(run_dir, "run2.yaml"), "w") as f:
+        yaml.safe_dump(run_case, f)
+    YAML_CACHE.clear()
+
+    timings = {}
+    third = generateKB_from_chaos(
+        chaos_data, "./CHAOS.yaml", manifest_path=manifest, timings=timings
+    )
+    assert third == generateKB_from_chaos(
+        chaos_data, "./CHAOS.yaml", processes=1
+    )
+    assert third != full
+    assert timings["io"]["parsed"] == 1
+
+
+@pytest.mark.parametrize(
+    "kb",
+    [
+        {},
+        {"network": []},
+        {
+            "b": [
+                {
+                    "experiment": "a: b #c",
+                    "index": 1,
+                    "when": datetime.date(2022, 1, 1),
+                    "ratio": 0.1,
+                    "flags": [True, None, "yes", "0o10", ""],
+                    "query": "kubectl logs $pod\n  | grep 'é\t'\n",
+                    "empty": {},
+                    "long": " ".join(["word"] * 40),
+                }
+            ],
+            "a": [{"anomalies": {"logs": {"pod": []}}}, 3, "x"],
+        },
+    ],
+)
+def test_dump_kb(kb):
+    stream = io.StringIO()
+    dump_kb(kb, stream)
+
+    assert stream.getvalue() == yaml.safe_dump(
+        kb, default_flow_style=False, line_break=0
+    )
+
+
+def test_dump_example_kb():
+    kb = copy_tree(load_yaml("./KNOWLEDGE_BASE.yaml"))
+    stream = io.StringIO()
+    dump_kb(kb, stream)
+
+    assert stream.getvalue() == yaml.safe_dump(
+        kb, default_flow_style=False, line_break=0
+    )
+
+
+def test_save_kb(tmp_path):
+    kb = copy_tree(load_yaml("./KNOWLEDGE_BASE.yaml"))
+    kb_path = str(tmp_path / "kb.yaml")
+    saveKB_to_file(kb, kb_path, snapshot_path=str(tmp_path / "kb.snapshot"))
+    assert sorted(os.listdir(tmp_path)) == ["kb.snapshot", "kb.yaml"]
+    assert load_yaml(kb_path, cache=False) == kb
+
+    # A failed dump leaves the previous file and no temporary file
+    with open(kb_path) as f:
+        saved = f.read()
+    with pytest.raises(yaml.YAMLError):
+        saveKB_to_file({"network": [object()]}, kb_path)
+    assert sorted(os.listdir(tmp_path)) == ["kb.snapshot", "kb.yaml"]
+    with open(kb_path) as f:
+        assert f.read() == saved
+
+
+def dp_weighted_LCS(fingerprint, case, weight) -> tuple:
+    """The former weighted_LCS: full tables and a recursive traceback"""
+
+    WLCS = []
+
+    def get_path(d, fingerprint, i, j):
+        if i == 0 or j == 0:
+            return []
+        if d[i][j] == 0:
+            get_path(d, fingerprint, i - 1, j - 1)
+            WLCS.append(fingerprint[i - 1])
+        elif d[i][j] == 1:
+            return get_path(d, fingerprint, i - 1, j)
+        else:
+            return get_path(d, fingerprint, i, j - 1)
+
+    path = [
+        [0 for i in range(len(case) + 1)] for j in range(len(fingerprint) + 1)
+    ]
+
+    d = [[0 for i in range(len(case) + 1)] for j in range(len(fingerprint) + 1)]
+
+    for idx_f, f in enumerate(fingerprint):
+        for idx_c, c in enumerate(case):
+            if f == c:
+                path[idx_f + 1][idx_c + 1] = path[idx_f][idx_c] + weight[f]
+                d[idx_f + 1][idx_c + 1] = 0
+            elif path[idx_f][idx_c + 1] > path[idx_f + 1][idx_c]:
+                path[idx_f + 1][idx_c + 1] = path[idx_f][idx_c + 1]
+                d[idx_f + 1][idx_c + 1] = 1
+            else:
+                path[idx_f + 1][idx_c + 1] = path[idx_f + 1][idx_c]
+                d[idx_f + 1][idx_c + 1] = -1
+
+    get_path(d, fingerprint, len(fingerprint), len(case))
+
+    return path[-1][-1], WLCS
+
+
+def random_clues(rnd, alphabet: int, num: int = 200) -> list:
+    """Random fingerprint and case pairs of up to 12 clue ids"""
+
+    return [
+        (
+            [rnd.randrange(alphabet) for _ in range(rnd.randrange(13))],
+            [rnd.randrange(alphabet) for _ in range(rnd.randrange(13))],
+        )
+        for _ in range(num)
+    ]
+
+
+@pytest.mark.parametrize("alphabet", [2, 5, 20])
+def test_weighted_LCS(alphabet):
+    rnd = random.Random(alphabet)
+    # Weights by clue name and by clue id, the latter with ties
+    weight = {"c{}".format(i): rnd.random() for i in range(alphabet)}
+    weight_array = np.array([rnd.choice([0.5, 1.0]) for _ in range(alphabet)])
+
+    for fingerprint, case in random_clues(rnd, alphabet):
+        named_f = ["c{}".format(i) for i in fingerprint]
+        named_c = ["c{}".format(i) for i in case]
+        for f, c, w in [
+            (named_f, named_c, weight),
+            (fingerprint, case, weight_array),
+        ]:
+            score, WLCS = dp_weighted_LCS(f, c, w)
+            assert weighted_LCS(f, c, w) == pytest.approx(score)
+            assert weighted_LCS(f, c, w, path=True) == WLCS
+
+
+@pytest.mark.parametrize("alphabet", [2, 5, 20])
+def test_bit_parallel_LCS(alphabet):
+    rnd = random.Random(alphabet)
+    weight = np.array([rnd.random() for _ in range(alphabet)])
+    tied = np.full(alphabet, 0.5)
+    # Cases longer than a machine word too
+    long_clues = [
+        (
+            [rnd.randrange(alphabet) for _ in range(150)],
+            [rnd.randrange(alphabet) for _ in range(130)],
+        )
+    ]
+
+    for fingerprint, case in random_clues(rnd, alphabet) + long_clues:
+        length, _ = dp_weighted_LCS(fingerprint, case, np.ones(alphabet))
+        assert bit_parallel_LCS(fingerprint, case) == length
+
+        score = weighted_LCS(fingerprint, case, weight)
+        bound, is_exact = weighted_LCS_bound(fingerprint, case, weight)
+        assert bound >= score - 1e-12
+        if is_exact:
+            assert bound == pytest.approx(score)
+
+        bound, is_exact = weighted_LCS_bound(fingerprint, case, tied)
+        assert is_exact
+        assert bound == pytest.approx(weighted_LCS(fingerprint, case, tied))
@@ -0,0 +1,140 @@
+import threading
+from collections import OrderedDict
+
+import pytest
+from schema import SchemaError
+
+import validation
+from loader import load_yaml
+from validation import (
+    FINGERPRINT_SCHEMA,
+    KB_SCHEMA,
+    is_fingerprint,
+    is_kb,
+    validate_fingerprint,
+    validate_kb,
+)
+
+
+@pytest.fixture
+def schema_calls(monkeypatch):
+    """Schemas the documents went through"""
+
+    calls = []
+    for schema in [KB_SCHEMA, FINGERPRINT_SCHEMA]:
+
+        def spy(document, schema=schema, validate=schema.validate):
+            calls.append(schema)
+            return validate(document)
+
+        monkeypatch.setattr(schema, "validate", spy)
+
+    return calls
+
+
+def test_fast_path(schema_calls):
+    kb = load_yaml("./KNOWLEDGE_BASE.yaml")
+    fingerprint = load_yaml("./fingerprint_order.yaml")
+    assert is_kb(kb) and is_fingerprint(fingerprint)
+
+    validate_kb(kb)
+    validate_fingerprint(fingerprint)
+
+    assert schema_calls == []
+
+
+def test_fallback(schema_calls):
+    # Mappings the fast check does not know about, valid for the schema
+    fingerprint = OrderedDict(groundtruth="a", anomalies=OrderedDict())
+    kb = {
+        "network": [
+            OrderedDict(
+                index=0,
+                experiment="a",
+                instance_related=False,
+                anomalies={},
+            )
+        ]
+    }
+    assert not is_fingerprint(fingerprint) and not is_kb(kb)
+
+    validate_fingerprint(fingerprint)
+    validate_kb(kb)
+
+    assert schema_calls == [FINGERPRINT_SCHEMA, KB_SCHEMA]
+
+
+@pytest.mark.parametrize(
+    "fingerprint, message",
+    [
+        ({"anomalies": {}}, "Missing key: 'groundtruth'"),
+        (
+            {"groundtruth": "a", "order": 1, "anomalies": {}},
+            "1 should be instance of 'bool'",
+        ),
+        (
+            {"groundtruth": "a", "anomalies": {"logs": {"disk": []}}},
+            "Wrong key 'disk'",
+        ),
+        (
+            {
+                "groundtruth": "a",
+                "anomalies": {"logs": {"pod": [{"index": "0", "action": "a"}]}},
+            },
+            "'0' should be instance of 'int'",
+        ),
+    ],
+)
+def test_errors(fingerprint, message):
+    with pytest.raises(SchemaError, match=message):
+        validate_fingerprint(fingerprint)
+
+
+def test_errors_kb():
+    with pytest.raises(SchemaError, match="Wrong key 'disk'"):
+        validate_kb({"disk": []})
+
+
+def test_validate_once(monkeypatch, schema_calls):
+    monkeypatch.setattr(validation, "_VALIDATED", OrderedDict())
+    monkeypatch.setattr(validation, "_VALIDATED_SIZE", 2)
+    fingerprint = OrderedDict(groundtruth="a", anomalies={})
+
+    validate_fingerprint(fingerprint, "a")
+    validate_fingerprint(fingerprint, "a")
+    assert len(schema_calls) == 1
+
+    # Invalid documents are not remembered
+    with pytest.raises(SchemaError):
+        validate_fingerprint({}, "b")
+    with pytest.raises(SchemaError):
+        validate_fingerprint({}, "b")
+
+    # Least recently used first out
+    validate_fingerprint(fingerprint, "c")
+    validate_fingerprint(fingerprint, "a")
+    validate_fingerprint(fingerprint, "d")
+    assert [digest for _, digest in validation._VALIDATED] == ["a", "d"]
+
+
+def test_validate_once_threads(monkeypatch):
+    monkeypatch.setattr(validation, "_VALIDATED", OrderedDict())
+    monkeypatch.setattr(validation, "_VALIDATED_SIZE", 8)
+    fingerprint = load_yaml("./fingerprint.yaml")
+    errors = []
+
+    def validate(thread):
+        try:
+            for i in range(2000):
+                validate_fingerprint(fingerprint, str((thread + i) % 16))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=validate, args=(t,)) for t in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(validation._VALIDATED) == 8
@@ -0,0 +1,120 @@
+import shutil
+import time
+
+import pytest
+import yaml
+from schema import SchemaError
+
+from loader import load_yaml
+from watcher import KB_Watcher
+
+
+@pytest.fixture
+def kb_path(tmp_path):
+    """Copy of the example knowledge base"""
+
+    path = tmp_path / "kb.yaml"
+    shutil.copy("./KNOWLEDGE_BASE.yaml", path)
+    return path
+
+
+def smaller_kb() -> str:
+    """The example knowledge base without its config cases"""
+
+    kb = load_yaml("./KNOWLEDGE_BASE.yaml", cache=False)
+    del kb["config"]
+    return yaml.safe_dump(kb)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def test_reload(kb_path):
+    watcher = KB_Watcher(str(kb_path))
+    watcher.start()
+    try:
+        first = watcher.reasoner
+        assert watcher.version == 1
+        assert "config" in first.kb.types
+        assert not watcher.reload()
+
+        kb_path.write_text(smaller_kb())
+        assert watcher.reload()
+        assert watcher.version == 2
+        assert "config" not in watcher.kb.types
+        assert watcher.kb.source_hash != first.kb.source_hash
+
+        # A request holding the former reasoner still scores against it
+        fingerprint = load_yaml("./fingerprint.yaml")
+        assert first.reason(fingerprint).kb_hash == first.kb.source_hash
+        assert "config" in first.reason(fingerprint).type_scores
+
+        metrics = watcher.metrics()
+        assert metrics["reloads"] == 2 and metrics["failures"] == 0
+        assert metrics["kb_hash"] == watcher.kb.source_hash
+    finally:
+        watcher.stop()
+
+
+@pytest.mark.parametrize(
+    "content, error",
+    [
+        ("network: [\n", yaml.YAMLError),
+        ("disk: []\n", SchemaError),
+    ],
+)
+def test_reload_failure(kb_path, content, error):
+    watcher = KB_Watcher(str(kb_path))
+    watcher.start()
+    try:
+        serving = watcher.reasoner
+        kb_path.write_text(content)
+
+        with pytest.raises(error):
+            watcher.reload()
+        assert watcher.reasoner is serving and watcher.version == 1
+        assert watcher.metrics()["failures"] == 1
+
+        # Not retried until the file changes again
+        assert not watcher.reload()
+
+        kb_path.write_text(smaller_kb())
+        assert watcher.reload()
+        assert watcher.version == 2
+    finally:
+        watcher.stop()
+
+
+def test_watch(kb_path):
+    with KB_Watcher(str(kb_path), interval=0.01) as watcher:
+        serving = watcher.reasoner
+
+        # A failing file leaves the current version serving
+        kb_path.write_text("disk: []\n")
+        wait_for(lambda: watcher.metrics()["failures"] == 1)
+        assert watcher.reasoner is serving
+
+        kb_path.write_text(smaller_kb())
+        wait_for(lambda: watcher.version == 2)
+        assert "config" not in watcher.kb.types
+        assert watcher.thread.is_alive()
+
+    assert watcher.thread is None
+
+
+def test_watch_snapshot(kb_path, tmp_path):
+    watcher = KB_Watcher(str(kb_path))
+    watcher.reload(force=True)
+    snapshot_path = tmp_path / "kb.snapshot"
+    watcher.kb.compile(str(snapshot_path))
+
+    with KB_Watcher(str(snapshot_path)) as snapshot_watcher:
+        assert snapshot_watcher.kb.source_hash == watcher.kb.source_hash
+        fingerprint = load_yaml("./fingerprint.yaml")
+        assert snapshot_watcher.reasoner.reason(fingerprint) == (
+            watcher.reasoner.reason(fingerprint)
+        )
@@ -0,0 +1,46 @@
+import random
+
+from weight import Incremental_Weight, Sparse_Weight, Weight
+
+ITEMS = [
+    ["a", "b", "c"],
+    ["a", "b", "c", "d", "e"],
+    ["a", "b", "e"],
+    ["f"],
+]
+
+
+def test_sparse_weight():
+    rnd = random.Random(0)
+    for _ in range(50):
+        items = [
+            [rnd.choice("abcdefghij") for _ in range(rnd.randint(0, 6))]
+            for _ in range(rnd.randint(1, 20))
+        ]
+        assert Sparse_Weight(items)() == Weight(items)()
+
+
+def test_incremental_weight():
+    rnd = random.Random(0)
+    items = []
+    weight = Incremental_Weight()
+    for _ in range(200):
+        if items and rnd.random() < 0.3:
+            weight.remove(items.pop(rnd.randrange(len(items))))
+        else:
+            items.append(
+                [rnd.choice("abcdefghij") for _ in range(rnd.randint(0, 6))]
+            )
+            weight.add(items[-1])
+        if items:
+            assert weight() == Weight(items)()
+
+
+def test_incremental_weight_cached():
+    weight = Incremental_Weight(ITEMS)
+    scores = weight()
+    scores["a"] = 0
+
+    assert weight() == Weight(ITEMS)()
+    weight.add(["a", "g"])
+    assert weight() == Weight(ITEMS + [["a", "g"]])()
@@ -1,30 +1,221 @@
-import enum
 import yaml
 import os
-from microCBR.kb import KB_Chaos
+import json
+import time
+import hashlib
+import multiprocessing
+import numpy as np
+from collections import Counter
+from kb import KB, KB_Chaos, write_atomic
+from loader import load_yaml
 import logging
+from yaml.serializer import Serializer
+
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
 
 _LOGGER = logging.getLogger(__name__)
 
 
-def generateKB_from_chaos(chaos_data_dir, chaos_management_file):
+def scan_run(chaos_path: str) -> dict:
+    """List a run directory with the modification time and size of its files
+
+    Args:
+        chaos_path (str): Run directory of an experiment
+
+    Returns:
+        dict: Names in ``os.listdir`` order, and ``[mtime_ns, size]`` by name
+    """
+
+    listing = os.listdir(chaos_path)
+    files = {}
+    for name in listing:
+        stat = os.stat(os.path.join(chaos_path, name))
+        files[name] = [stat.st_mtime_ns, stat.st_size]
+
+    return {"listing": listing, "files": files}
+
+
+def hash_file(f_path: str) -> str:
+    """SHA-256 hex digest of a file, None for a directory"""
+
+    if os.path.isdir(f_path):
+        return None
+
+    sha = hashlib.sha256()
+    with open(f_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def summarize_run(chaos_path: str) -> dict:
+    """Parse the runs of an experiment, as ``KB_Chaos`` does
+
+    Args:
+        chaos_path (str): Run directory of an experiment
+
+    Returns:
+        dict: The content hash of every file, the YAML of whether the
+            experiment is instance related and of its template, and the
+            seconds spent
+    """
+
+    start = time.perf_counter()
+    scan = scan_run(chaos_path)
+    is_related, template = KB_Chaos(chaos_path).is_instance_related()
+    scan["hashes"] = {
+        name: hash_file(os.path.join(chaos_path, name))
+        for name in scan["listing"]
+    }
+    # As YAML, which keeps dates and every other type of the runs
+    scan["summary"] = yaml.dump(
+        [is_related, template], Dumper=SafeDumper, sort_keys=False
+    )
+    scan["seconds"] = time.perf_counter() - start
+
+    return scan
+
+
+def is_unchanged(chaos_path: str, entry: dict, scan: dict) -> bool:
+    """Whether a run directory is the one summarized in the manifest
+
+    Files whose modification time or size changed are hashed again, so
+    touched but identical files do not trigger a new parse.
+
+    Args:
+        chaos_path (str): Run directory of an experiment
+        entry (dict): Manifest entry of the directory
+        scan (dict): Current ``scan_run`` of the directory
+
+    Returns:
+        bool: Whether the listing and file contents are the same, False for
+            entries of manifests written before summaries were YAML
+    """
+
+    if (
+        entry is None
+        or type(entry.get("summary")) is not str
+        or entry["listing"] != scan["listing"]
+    ):
+        return False
+
+    for name, stat in scan["files"].items():
+        if entry["files"][name] == stat:
+            continue
+        if hash_file(os.path.join(chaos_path, name)) != entry["hashes"][name]:
+            return False
+
+    return True
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """Manifest of a previous ``generateKB_from_chaos``, empty if none"""
+
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return {}
 
-    f = open(chaos_management_file)
-    data = f.read()
-    f.close()
-    chaos_manage = yaml.safe_load(data)
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, manifest_path: str):
+    """Write a manifest with ``write_atomic``"""
+
+    write_atomic(manifest_path, lambda f: json.dump(manifest, f))
+
+
+def generateKB_from_chaos(
+    chaos_data_dir,
+    chaos_management_file,
+    processes=None,
+    manifest_path=None,
+    timings=None,
+):
+    """Generate the knowledge base from the runs of every experiment
+
+    Experiment directories are parsed by a pool of worker processes. With a
+    manifest, the listing, file stats, content hashes and parsed summary of
+    every directory are kept between two generations, and only new or
+    changed directories are parsed again. Every summary, new or reused, is
+    read back from its YAML and merged in ``os.listdir`` order, so the
+    knowledge base is the same as a full serial generation.
+
+    Args:
+        chaos_data_dir (str): Directory of chaos types, with a trailing "/"
+        chaos_management_file (str): Chaos management file, e.g. CHAOS.yaml
+        processes (int, optional): Number of worker processes, 1 to parse in
+            process. Defaults to None, the number of CPUs.
+        manifest_path (str, optional): Manifest path. Defaults to None,
+            parsing every directory.
+        timings (dict, optional): Filled with the number of runs, parsed and
+            reused directories, and seconds spent, for each chaos type.
+            Defaults to None.
+
+    Returns:
+        dict: Knowledge base
+    """
+
+    chaos_manage = load_yaml(chaos_management_file)
+    manifest = load_manifest(manifest_path)
+    timings = {} if timings is None else timings
 
     chaos_types = os.listdir(chaos_data_dir)
-    kb = dict()
+    runs = {}
+    pending = []
     for chaos_type in chaos_types:
+        start = time.perf_counter()
         chaos_types_dirs = chaos_data_dir + chaos_type
         chaos_names = os.listdir(chaos_types_dirs)
-        kb_chaos_type_lst = []
+        runs[chaos_type] = []
         for chaos_name in chaos_names:
             chaos_path = chaos_types_dirs + "/" + chaos_name
+            runs[chaos_type].append(chaos_path)
+
+            entry = manifest.get(chaos_path)
+            scan = scan_run(chaos_path)
+            if is_unchanged(chaos_path, entry, scan):
+                entry["files"] = scan["files"]
+            else:
+                manifest.pop(chaos_path, None)
+                pending.append((chaos_type, chaos_path))
 
-            kb_unit = KB_Chaos(chaos_path)
-            is_related, template = kb_unit.is_instance_related()
+        timings[chaos_type] = {
+            "runs": len(chaos_names),
+            "parsed": 0,
+            "reused": len(chaos_names),
+            "seconds": time.perf_counter() - start,
+        }
+
+    paths = [chaos_path for _, chaos_path in pending]
+    if processes == 1 or len(paths) <= 1:
+        summaries = map(summarize_run, paths)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        summaries = pool.imap(summarize_run, paths)
+
+    try:
+        for (chaos_type, chaos_path), summary in zip(pending, summaries):
+            manifest[chaos_path] = summary
+            timing = timings[chaos_type]
+            timing["parsed"] += 1
+            timing["reused"] -= 1
+            timing["seconds"] += summary.pop("seconds")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    kb = dict()
+    for chaos_type in chaos_types:
+        kb_chaos_type_lst = []
+        for chaos_path in runs[chaos_type]:
+            is_related, template = yaml.load(
+                manifest[chaos_path]["summary"], Loader=SafeLoader
+            )
             template["instance_related"] = is_related
 
             for item in chaos_manage["Serial"][chaos_type]:
@@ -36,56 +227,291 @@ def generateKB_from_chaos(chaos_data_dir, chaos_management_file):
 
         kb[chaos_type] = kb_chaos_type_lst
 
+        _LOGGER.info(
+            "{}: {runs} runs, {parsed} parsed, {reused} reused in "
+            "{seconds:.3f} s".format(chaos_type, **timings[chaos_type])
+        )
+
+    if manifest_path is not None:
+        save_manifest(
+            {
+                chaos_path: manifest[chaos_path]
+                for chaos_type in chaos_types
+                for chaos_path in runs[chaos_type]
+            },
+            manifest_path,
+        )
+
     return kb
 
 
-def saveKB_to_file(kb, kb_path):
+class Stream_Dumper(SafeDumper, Serializer):
+    def __init__(self, stream, **kwargs) -> None:
+        """Safe dumper serializing a document one node at a time
+
+        The libyaml dumper when PyYAML was built with it, with the node
+        serialization of the pure-Python one, so events can be emitted by
+        hand around the nodes.
+
+        Args:
+            stream (Any): Text stream
+            kwargs: Dumper options, as for ``yaml.safe_dump``
+        """
+
+        super().__init__(stream, **kwargs)
+        self.serialized_nodes = {}
+        self.anchors = {}
+        self.last_anchor_id = 0
+
+    def dump_node(self, data):
+        """Represent and emit one object
+
+        Anchors and aliases only span the object, which is then dropped.
+
+        Args:
+            data (Any): Object
+        """
+
+        node = self.represent_data(data)
+        self.represented_objects = {}
+        self.object_keeper = []
+        self.alias_key = None
+
+        self.anchor_node(node)
+        self.serialize_node(node, None, None)
+        self.serialized_nodes = {}
+        self.anchors = {}
+
+
+class Hash_Writer:
+    def __init__(self, f) -> None:
+        """Text stream computing the SHA-256 of what is written to it
+
+        Args:
+            f (Any): Text stream
+        """
+
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def write(self, data: str):
+        self.sha.update(data.encode("utf-8"))
+        self.f.write(data)
+
+    def hexdigest(self) -> str:
+        return self.sha.hexdigest()
+
+
+def dump_kb(kb: dict, stream) -> None:
+    """Write a knowledge base as YAML, one case at a time
+
+    The output is the one of ``yaml.safe_dump``, except that objects shared
+    by several cases are written in full for each case instead of being
+    aliased.
+
+    Args:
+        kb (dict): Knowledge base
+        stream (Any): Text stream
+    """
+
+    if not kb:
+        yaml.safe_dump(kb, stream, default_flow_style=False, line_break=0)
+        return
+
+    dumper = Stream_Dumper(stream, default_flow_style=False, line_break=0)
+    try:
+        dumper.open()
+        dumper.emit(yaml.DocumentStartEvent(explicit=False))
+        dumper.emit(
+            yaml.MappingStartEvent(
+                None, "tag:yaml.org,2002:map", True, flow_style=False
+            )
+        )
+        try:
+            chaos_types = sorted(kb)
+        except TypeError:
+            chaos_types = list(kb)
+
+        for chaos_type in chaos_types:
+            dumper.dump_node(chaos_type)
+            dumper.emit(
+                yaml.SequenceStartEvent(
+                    None, "tag:yaml.org,2002:seq", True, flow_style=False
+                )
+            )
+            for chaos in kb[chaos_type]:
+                dumper.dump_node(chaos)
+            dumper.emit(yaml.SequenceEndEvent())
+
+        dumper.emit(yaml.MappingEndEvent())
+        dumper.emit(yaml.DocumentEndEvent(explicit=False))
+        dumper.close()
+    finally:
+        dumper.dispose()
+
+
+def saveKB_to_file(kb, kb_path, snapshot_path=None):
+    """Write a knowledge base file, and optionally its snapshot
+
+    The YAML is streamed one case at a time through the libyaml dumper when
+    available, so memory does not grow with the knowledge base, with
+    ``write_atomic``: a crash leaves the previous file untouched. Its hash is
+    computed as it is written. The snapshot is compiled in a second pass over
+    ``kb``, which ``KB.load`` indexes without copying, and records that hash,
+    so it is up to date with the file.
+
+    Args:
+        kb (dict): Knowledge base
+        kb_path (str): Knowledge base path
+        snapshot_path (str, optional): Snapshot path, see ``KB.compile``.
+            Defaults to None, no snapshot.
+    """
+
     os.makedirs(os.path.dirname(kb_path), exist_ok=True)
-    with open(kb_path, "w") as f:
-        yaml.safe_dump(kb, f, default_flow_style=False, line_break=0)
+    writer = None
 
+    def write(f):
+        nonlocal writer
+        writer = Hash_Writer(f)
+        dump_kb(kb, writer)
 
-def weighted_LCS(fingerprint, case, weight):
+    write_atomic(kb_path, write)
 
-    WLCS = []
+    if snapshot_path is not None:
+        compiled = KB()
+        compiled.load(kb)
+        compiled.source = os.path.abspath(kb_path)
+        compiled.source_hash = writer.hexdigest()
+        compiled.compile(snapshot_path)
+
+
+def weighted_LCS(fingerprint, case, weight, path=False):
+    """Weighted longest common subsequence of two clue lists
 
-    def get_path(d, fingerprint, i, j):
-        if i == 0 or j == 0:
-            return []
-        if d[i][j] == 0:
-            get_path(d, fingerprint, i - 1, j - 1)
+    The dynamic programming table is filled row by row with NumPy. A row of
+    the table is the running maximum of the row above, shifted by the clue
+    weight where the fingerprint clue matches the case, so only two rows are
+    kept unless the subsequence itself is asked for.
+
+    Args:
+        fingerprint (list): Fingerprint clues
+        case (list): Case clues
+        weight (dict): Clue weights
+        path (bool, optional): Return the subsequence instead of its weight.
+            Defaults to False.
+
+    Returns:
+        Union[float, list]: Weighted LCS score, or the subsequence with path
+    """
+
+    vocab = {}
+    case_ids = np.array([vocab.setdefault(c, len(vocab)) for c in case])
+    fingerprint_ids = [vocab.get(f, -1) for f in fingerprint]
+
+    rows = [np.zeros(len(case) + 1)]
+    for f, f_id in zip(fingerprint, fingerprint_ids):
+        prev = rows[-1]
+        row = np.zeros(len(case) + 1)
+        if f_id < 0:
+            row[1:] = prev[1:]
+        else:
+            candidate = prev[1:].copy()
+            match = case_ids == f_id
+            candidate[match] = prev[:-1][match] + weight[f]
+            row[1:] = np.maximum.accumulate(candidate)
+
+        if path:
+            rows.append(row)
+        else:
+            rows[-1] = row
+
+    if not path:
+        return float(rows[-1][-1])
+
+    WLCS = []
+    i, j = len(fingerprint), len(case)
+    while i > 0 and j > 0:
+        if fingerprint[i - 1] == case[j - 1]:
             WLCS.append(fingerprint[i - 1])
-        elif d[i][j] == 1:
-            return get_path(d, fingerprint, i - 1, j)
+            i, j = i - 1, j - 1
+        elif rows[i - 1][j] > rows[i][j - 1]:
+            i -= 1
         else:
-            return get_path(d, fingerprint, i, j - 1)
+            j -= 1
 
-    path = [
-        [0 for i in range(len(case) + 1)] for j in range(len(fingerprint) + 1)
-    ]
+    return WLCS[::-1]
 
-    d = [[0 for i in range(len(case) + 1)] for j in range(len(fingerprint) + 1)]
 
-    for idx_f, f in enumerate(fingerprint):
-        for idx_c, c in enumerate(case):
-            if f == c:
-                path[idx_f + 1][idx_c + 1] = path[idx_f][idx_c] + weight[f]
-                d[idx_f + 1][idx_c + 1] = 0
-            elif path[idx_f][idx_c + 1] > path[idx_f + 1][idx_c]:
-                path[idx_f + 1][idx_c + 1] = path[idx_f][idx_c + 1]
-                d[idx_f + 1][idx_c + 1] = 1
-            else:
-                path[idx_f + 1][idx_c + 1] = path[idx_f + 1][idx_c]
-                d[idx_f + 1][idx_c + 1] = -1
+def bit_parallel_LCS(fingerprint, case):
+    """Length of the longest common subsequence, bit-parallel
+
+    Hyyro's variant of the Allison-Dix algorithm: bit j of ``v`` is cleared
+    once case position j is matched, and each fingerprint clue updates all
+    case positions at once with a few integer operations, a machine word of
+    positions at a time.
+
+    Args:
+        fingerprint (list): Fingerprint clues
+        case (list): Case clues
+
+    Returns:
+        int: LCS length
+    """
+
+    masks = {}
+    for j, c in enumerate(case):
+        masks[c] = masks.get(c, 0) | 1 << j
+
+    full = (1 << len(case)) - 1
+    v = full
+    for f in fingerprint:
+        if f in masks:
+            u = v & masks[f]
+            v = ((v + u) | (v - u)) & full
+
+    return len(case) - bin(v).count("1")
+
+
+def weighted_LCS_bound(fingerprint, case, weight):
+    """Upper bound of weighted_LCS from the bit-parallel LCS length
+
+    A weighted LCS holds at most LCS length clues, all of them shared by the
+    fingerprint and the case, so its score is at most the sum of the LCS
+    length largest weights among the shared clues (counted as many times as
+    they appear in both). The bound is exact when all shared clues weigh the
+    same.
+
+    Args:
+        fingerprint (list): Fingerprint clues
+        case (list): Case clues
+        weight (dict): Clue weights
+
+    Returns:
+        tuple: Upper bound, and whether it is the exact score
+    """
+
+    f_counter = Counter(fingerprint)
+    c_counter = Counter(case)
+    common = [
+        weight[c]
+        for c in f_counter
+        if c in c_counter
+        for _ in range(min(f_counter[c], c_counter[c]))
+    ]
+    if not common:
+        return 0.0, True
 
-    get_path(d, fingerprint, len(fingerprint), len(case))
+    length = bit_parallel_LCS(fingerprint, case)
+    common.sort(reverse=True)
+    if common[0] == common[-1]:
+        return length * common[0], True
 
-    return WLCS
+    return sum(common[:length]), False
 
 
 if __name__ == "__main__":
     weight = {"a": 0.3, "b": 0.2, "c": 0.5, "d": 0.2, "e": 0.7}
     fingerprint = ["a", "b", "c", "e", "d", "e"]
     case = ["c", "d", "a", "e"]
-    WLCS = weighted_LCS(fingerprint, case, weight)
+    WLCS = weighted_LCS(fingerprint, case, weight, path=True)
     print(WLCS)
@@ -0,0 +1,246 @@
+import logging
+import threading
+from collections import OrderedDict
+from schema import Schema, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+# Clue categories of each kind of clue
+CATEGORIES = {
+    "metrics": (
+        "network",
+        "cpu",
+        "memory",
+        "io",
+        "container",
+        "mongo",
+        "mysql",
+        "icmp",
+        "time",
+        "jvm",
+        "http",
+    ),
+    "traces": ("onehop",),
+    "logs": ("pod",),
+    "cmds": ("config", "exec"),
+}
+
+CHAOS_TYPES = (
+    "network",
+    "pod",
+    "stress",
+    "time",
+    "jvm",
+    "dns",
+    "http",
+    "io",
+    "config",
+)
+
+anomaly_schema = [{"index": int, "action": str, Optional("order"): int}]
+anomalies_schema = {
+    Optional(target_type): {
+        Optional(category): anomaly_schema for category in categories
+    }
+    for target_type, categories in CATEGORIES.items()
+}
+
+KB_SCHEMA = Schema(
+    {
+        Optional(chaos_type): [
+            {
+                "index": int,
+                "experiment": str,
+                "instance_related": bool,
+                Optional("order"): bool,
+                "anomalies": anomalies_schema,
+                Optional("duplicates"): [{"index": int, "experiment": str}],
+            }
+        ]
+        for chaos_type in CHAOS_TYPES
+    }
+)
+
+FINGERPRINT_SCHEMA = Schema(
+    {
+        "groundtruth": str,
+        Optional("order"): bool,
+        "anomalies": anomalies_schema,
+    }
+)
+
+# Content hashes of documents already validated, by schema, least recently
+# used evicted first. Server and watcher threads validate concurrently.
+_VALIDATED = OrderedDict()
+_VALIDATED_SIZE = 4096
+_VALIDATED_LOCK = threading.Lock()
+
+
+def is_anomalies(anomalies) -> bool:
+    """Fast check of the anomalies of a case or fingerprint
+
+    Args:
+        anomalies (Any): Anomalies
+
+    Returns:
+        bool: Whether the anomalies are certainly valid
+    """
+
+    if type(anomalies) is not dict:
+        return False
+
+    for target_type, fingerprint in anomalies.items():
+        categories = CATEGORIES.get(target_type)
+        if categories is None or type(fingerprint) is not dict:
+            return False
+        for category, clues in fingerprint.items():
+            if category not in categories or type(clues) is not list:
+                return False
+            for clue in clues:
+                if (
+                    type(clue) is not dict
+                    or type(clue.get("index")) is not int
+                    or type(clue.get("action")) is not str
+                ):
+                    return False
+                if len(clue) != 2 and (
+                    len(clue) != 3 or type(clue.get("order")) is not int
+                ):
+                    return False
+
+    return True
+
+
+def is_duplicates(duplicates) -> bool:
+    """Fast check of the cases merged into a knowledge base case
+
+    Args:
+        duplicates (Any): Duplicates
+
+    Returns:
+        bool: Whether the duplicates are certainly valid
+    """
+
+    if type(duplicates) is not list:
+        return False
+
+    for duplicate in duplicates:
+        if (
+            type(duplicate) is not dict
+            or len(duplicate) != 2
+            or type(duplicate.get("index")) is not int
+            or type(duplicate.get("experiment")) is not str
+        ):
+            return False
+
+    return True
+
+
+def is_kb(kb) -> bool:
+    """Fast check of a knowledge base
+
+    Args:
+        kb (Any): Knowledge base
+
+    Returns:
+        bool: Whether the knowledge base is certainly valid
+    """
+
+    if type(kb) is not dict:
+        return False
+
+    for chaos_type, cases in kb.items():
+        if chaos_type not in CHAOS_TYPES or type(cases) is not list:
+            return False
+        for case in cases:
+            if (
+                type(case) is not dict
+                or type(case.get("index")) is not int
+                or type(case.get("experiment")) is not str
+                or type(case.get("instance_related")) is not bool
+                or not is_anomalies(case.get("anomalies"))
+            ):
+                return False
+            extra = len(case) - 4
+            if "order" in case:
+                if type(case["order"]) is not bool:
+                    return False
+                extra -= 1
+            if "duplicates" in case:
+                if not is_duplicates(case["duplicates"]):
+                    return False
+                extra -= 1
+            if extra:
+                return False
+
+    return True
+
+
+def is_fingerprint(fingerprint) -> bool:
+    """Fast check of a fingerprint
+
+    Args:
+        fingerprint (Any): Fingerprint
+
+    Returns:
+        bool: Whether the fingerprint is certainly valid
+    """
+
+    if (
+        type(fingerprint) is not dict
+        or type(fingerprint.get("groundtruth")) is not str
+        or not is_anomalies(fingerprint.get("anomalies"))
+    ):
+        return False
+
+    return len(fingerprint) == 2 or (
+        len(fingerprint) == 3 and type(fingerprint.get("order")) is bool
+    )
+
+
+def validate(document, schema: Schema, check, digest: str = None):
+    """Validate a document, the fast way when possible
+
+    Documents passing the fast check are valid. The others go through the
+    schema, which accepts the few edge cases the fast check does not know
+    about, or raises the usual precise ``SchemaError``.
+
+    Args:
+        document (Any): Knowledge base or fingerprint
+        schema (Schema): Schema of the document
+        check (callable): Fast check of the document
+        digest (str, optional): Content hash of the document. When given, a
+            document with the same hash is only validated once.
+            Defaults to None.
+
+    Raises:
+        SchemaError: Invalid document
+    """
+
+    key = (id(schema), digest)
+    if digest is not None:
+        with _VALIDATED_LOCK:
+            if key in _VALIDATED:
+                _VALIDATED.move_to_end(key)
+                return
+
+    if not check(document):
+        schema.validate(document)
+
+    if digest is not None:
+        with _VALIDATED_LOCK:
+            _VALIDATED[key] = True
+            while len(_VALIDATED) > _VALIDATED_SIZE:
+                _VALIDATED.popitem(last=False)
+
+
+def validate_kb(kb, digest: str = None):
+    """Validate a knowledge base, see ``validate``"""
+
+    validate(kb, KB_SCHEMA, is_kb, digest)
+
+
+def validate_fingerprint(fingerprint, digest: str = None):
+    """Validate a fingerprint, see ``validate``"""
+
+    validate(fingerprint, FINGERPRINT_SCHEMA, is_fingerprint, digest)
@@ -0,0 +1,183 @@
+import os
+import time
+import logging
+import threading
+from kb import KB, SNAPSHOT_MAGIC
+from reasoning import Reasoner
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def is_snapshot(kb_path: str) -> bool:
+    """Whether a file is a snapshot written by ``KB.compile``
+
+    Args:
+        kb_path (str): Knowledge base or snapshot path
+
+    Returns:
+        bool: Whether it starts with the snapshot magic number
+    """
+
+    with open(kb_path, "rb") as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+class KB_Watcher:
+    def __init__(
+        self,
+        kb_path: str,
+        interval: float = 1.0,
+        backend: str = "incremental",
+        **kwargs
+    ) -> None:
+        """Knowledge base reloaded in the background when its file changes
+
+        A thread polls the knowledge base file, or snapshot, and when it
+        changes builds a new ``KB`` with its weights, indexes and matrices,
+        then a ``Reasoner`` over it, aside from the serving one. The pair is
+        then swapped in with a single assignment. The watcher never adds
+        cases to the knowledge bases it loads, see ``KB.add_case``, so a
+        request holding ``self.reasoner`` keeps scoring against one
+        consistent version until it finishes, and a file failing to load
+        leaves the current version serving.
+
+        Args:
+            kb_path (str): Knowledge base or snapshot path
+            interval (float, optional): Seconds between two checks of the
+                file. Defaults to 1.0.
+            backend (str, optional): Weighting backend, see
+                ``KB.score_fingerprint``. Defaults to "incremental".
+            kwargs: Reasoner options, e.g. use_logs
+        """
+
+        self.kb_path = kb_path
+        self.interval = interval
+        self.backend = backend
+        self.kwargs = kwargs
+
+        self.reasoner = None
+        self.version = 0
+        self.signature = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        self.counters = {
+            "reloads": 0,
+            "failures": 0,
+            "rebuild_ms": None,
+            "swap_ms": None,
+            "lag_ms": None,
+        }
+
+    @property
+    def kb(self) -> KB:
+        """Knowledge base of the serving reasoner"""
+
+        return self.reasoner.kb
+
+    def start(self):
+        """Load the knowledge base, then watch it in the background"""
+
+        if self.reasoner is None:
+            self.reload(force=True)
+
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self.watch, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop watching"""
+
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.reload()
+            except Exception:
+                _LOGGER.exception(
+                    "Failed to reload {}, keep version {}".format(
+                        self.kb_path, self.version
+                    )
+                )
+
+    def reload(self, force: bool = False) -> bool:
+        """Rebuild and swap the knowledge base in if its file changed
+
+        Args:
+            force (bool, optional): Rebuild even if the file did not change.
+                Defaults to False.
+
+        Raises:
+            Exception: Knowledge base failed to load
+
+        Returns:
+            bool: Whether a new version was swapped in
+        """
+
+        with self.lock:
+            stat = os.stat(self.kb_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if not force and signature == self.signature:
+                return False
+            # Not retried until the file changes again
+            self.signature = signature
+
+            start = time.perf_counter()
+            kb = KB()
+            try:
+                if is_snapshot(self.kb_path):
+                    kb.open_snapshot(self.kb_path)
+                else:
+                    kb.load(self.kb_path, self.backend)
+                kb.build_matrix()
+                reasoner = Reasoner(kb, **self.kwargs)
+            except Exception:
+                self.counters["failures"] += 1
+                raise
+            rebuilt = time.perf_counter()
+
+            self.reasoner = reasoner
+            self.version += 1
+            swapped = time.perf_counter()
+
+            self.counters["reloads"] += 1
+            self.counters["rebuild_ms"] = 1000 * (rebuilt - start)
+            self.counters["swap_ms"] = 1000 * (swapped - rebuilt)
+            # From the file change to the new version serving
+            self.counters["lag_ms"] = 1000 * (time.time() - stat.st_mtime)
+
+        _LOGGER.info(
+            "Knowledge Base version {} ({}) swapped in after {:.1f} ms".format(
+                self.version, kb.source_hash, self.counters["rebuild_ms"]
+            )
+        )
+        return True
+
+    def metrics(self) -> dict:
+        """Reload counters and timings, in milliseconds
+
+        Returns:
+            dict: Version, hash, reload and failure counts, and the rebuild
+                time, swap latency and lag behind the file of the last reload
+        """
+
+        metrics = dict(self.counters)
+        metrics["version"] = self.version
+        metrics["kb_hash"] = (
+            self.reasoner.kb.source_hash if self.reasoner else None
+        )
+
+        return metrics
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
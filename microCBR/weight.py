@@ -1,5 +1,8 @@
 import logging
 import copy
+from collections import Counter
+import numpy as np
+from scipy import sparse
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -57,6 +60,201 @@ class Weight:
         return self.scores
 
 
+class Incremental_Weight:
+    def __init__(self, item_list=()) -> None:
+        """Weight kept up to date as items are added and removed
+
+        Instead of the co-occurrence lists of ``Weight``, every unit keeps its
+        frequency, the number of items it shares with every other unit and
+        the total size of its co-occurrence list, so ``add`` and ``remove``
+        cost time proportional to the item. A score depends on the number of
+        items, which every ``add`` changes, so scores are all recomputed from
+        the counters when asked for after a change: in time proportional to
+        the number of units, without going over the items again. Scores are
+        equal to ``Weight`` for the same item list.
+
+        Args:
+            item_list (list, optional): Initial items. Defaults to ().
+        """
+
+        self.freq = {}
+        self.degree = {}
+        self.pairs = {}
+        self.co_occur = {}
+        self.total_fingerprint = 0
+
+        # Number of units for each frequency, to follow the largest one
+        self.freq_count = Counter()
+        self.max_freq = 0
+
+        # Scores of the counters as they were when last computed
+        self.scores = None
+
+        for item in item_list:
+            self.add(item)
+
+    def __call__(self) -> dict:
+        return self.cal_item_scores()
+
+    def add(self, item: list):
+        """Add an item
+
+        Args:
+            item (list): Units of the item
+        """
+
+        self.update(item, 1)
+
+    def remove(self, item: list):
+        """Remove a previously added item
+
+        Args:
+            item (list): Units of the item
+        """
+
+        self.update(item, -1)
+
+    def update(self, item: list, sign: int):
+        item_len = len(item) - 1
+        item_set = set(item)
+        self.total_fingerprint += sign
+        self.scores = None
+
+        for unit in item_set:
+            freq = self.freq.get(unit, 0)
+            self.freq_count[freq] -= 1
+            self.freq_count[freq + sign] += 1
+            if sign > 0 and freq + 1 > self.max_freq:
+                self.max_freq = freq + 1
+            elif sign < 0 and freq == self.max_freq:
+                if self.freq_count[freq] == 0:
+                    self.max_freq = freq - 1
+
+            if freq + sign == 0:
+                del self.freq[unit]
+                del self.degree[unit]
+                del self.pairs[unit]
+                del self.co_occur[unit]
+                continue
+
+            self.freq[unit] = freq + sign
+            self.degree[unit] = self.degree.get(unit, 0) + sign * item_len
+            self.co_occur[unit] = (
+                self.co_occur.get(unit, 0) + sign * (len(item_set) - 1)
+            )
+
+            pairs = self.pairs.setdefault(unit, Counter())
+            for other in item_set:
+                if other != unit:
+                    pairs[other] += sign
+                    if pairs[other] == 0:
+                        del pairs[other]
+
+        del self.freq_count[0]
+
+    def score(self, unit) -> float:
+        """Score of one unit, as in ``Weight.cal_item_scores``
+
+        Args:
+            unit (str): Unit
+
+        Returns:
+            float: Score
+        """
+
+        rel = self.co_occur[unit]
+        neighbours = len(self.pairs[unit])
+        w_rel = (
+            1
+            + (neighbours + 1) / (rel + 1)
+            + (neighbours + 1) / self.max_freq
+        )  # high with importance
+
+        w_dif = self.freq[unit] / self.total_fingerprint
+
+        return w_rel / ((w_dif / w_rel) + (rel + 1))
+
+    def cal_item_scores(self) -> dict:
+        """Scores of all units
+
+        Returns:
+            dict: Scores, in a new dict
+        """
+
+        if self.scores is None:
+            self.scores = {unit: self.score(unit) for unit in self.freq}
+
+        return dict(self.scores)
+
+
+class Sparse_Weight:
+    def __init__(self, item_list) -> None:
+        """Weight computed with sparse matrix products
+
+        Items are encoded as a sparse item by unit incidence matrix B. Unit
+        frequencies are its column sums, co-occurrence list sizes come from
+        ``B.T @ (item sizes - 1)`` and distinct co-occurring units from the
+        nonzeros of ``B.T @ B``, then every score is computed in one
+        vectorized pass. Scores are equal to ``Weight`` for the same item
+        list.
+
+        Args:
+            item_list (list): Items
+        """
+
+        self.item_list = item_list
+        self.freq = {}
+        self.degree = {}
+        self.scores = {}
+        self.total_fingerprint = len(item_list)
+
+    def __call__(self) -> dict:
+        return self.cal_item_scores()
+
+    def cal_item_scores(self) -> dict:
+
+        if self.freq or self.degree:
+            _LOGGER.error("Please initialize the Rake before calculate scores!")
+            return
+
+        vocab = {}
+        indices, indptr, item_len = [], [0], []
+        for item in self.item_list:
+            for unit in set(item):
+                indices.append(vocab.setdefault(unit, len(vocab)))
+            indptr.append(len(indices))
+            item_len.append(len(item) - 1)
+
+        if not vocab:
+            return self.scores
+
+        incidence = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int64), indices, indptr),
+            shape=(len(self.item_list), len(vocab)),
+        )
+        item_size = np.diff(incidence.indptr)
+
+        freq = np.asarray(incidence.sum(axis=0)).ravel()
+        degree = incidence.T @ np.array(item_len, dtype=np.int64) + freq
+        rel = incidence.T @ (item_size - 1)
+        neighbours = np.diff((incidence.T @ incidence).tocsr().indptr) - 1
+
+        w_rel = (
+            1 + (neighbours + 1) / (rel + 1) + (neighbours + 1) / freq.max()
+        )  # high with importance
+
+        w_dif = freq / self.total_fingerprint
+
+        scores = w_rel / ((w_dif / w_rel) + (rel + 1))
+
+        units = list(vocab)
+        self.freq = dict(zip(units, freq.tolist()))
+        self.degree = dict(zip(units, degree.tolist()))
+        self.scores = dict(zip(units, scores.tolist()))
+
+        return self.scores
+
+
 if __name__ == "__main__":
     item_list = [
         ["a", "b", "c"],
@@ -70,3 +268,8 @@ if __name__ == "__main__":
     print(weight.freq)
     print(weight.co_occur)
     print(scores)
+
+    incremental = Incremental_Weight(item_list[:2])
+    incremental.add(item_list[2])
+    incremental.add(item_list[3])
+    print(incremental() == scores)